@@ -0,0 +1,72 @@
+"""
+CPU time and bytes per rendition for the encoder profiles against the old
+global optimize/progressive flags, over a range of rendition sizes.
+
+    python benchmarks/bench_encoder_profiles.py [repeats]
+"""
+from StringIO import StringIO
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure()
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from lazythumbs.encoding import get_save_params
+
+SIZES = [(48, 48), (150, 150), (640, 480), (1600, 1200)]
+FORMATS = ['JPEG', 'PNG']
+PROFILES = {
+    # small thumbnails gain nothing from progressive scans
+    'JPEG': [
+        (160 * 160, {'optimize': True, 'progressive': False}),
+        (None, {'optimize': True, 'progressive': True}),
+    ],
+    # optimize makes PIL try every zlib setting, which is slow for little gain
+    'PNG': [
+        (None, {'optimize': False, 'compress_level': 6}),
+    ],
+}
+
+
+def photo(size):
+    """ something with both smooth areas and detail, like a photo """
+    random.seed(0)
+    img = Image.new('RGB', size)
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = random.randint(0, size[0]), random.randint(0, size[1])
+        r = random.randint(2, max(size) // 4)
+        color = tuple(random.randint(0, 255) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    return img.filter(ImageFilter.GaussianBlur(max(size) / 200.0))
+
+
+def encode(img, params, repeats):
+    started = time.clock()
+    for _ in range(repeats):
+        buf = StringIO()
+        img.save(buf, **params)
+    return (time.clock() - started) / repeats * 1000, len(buf.getvalue())
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('%-5s %-10s %-8s %10s %10s' % ('', 'size', 'profile', 'ms', 'bytes'))
+    for img_format in FORMATS:
+        for size in SIZES:
+            img = photo(size)
+            legacy = {'format': img_format, 'quality': 80, 'optimize': True, 'progressive': True}
+            for name, params in (('flags', legacy), ('profile', get_save_params(img, img_format, 80, PROFILES))):
+                ms, nbytes = encode(img, params, repeats)
+                print('%-5s %-10s %-8s %10.2f %10d' % (img_format, '%dx%d' % size, name, ms, nbytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Renders per second of a threaded web worker rendering in its threads and in
+a pool of render processes (LAZYTHUMBS_RENDER_PROCESSES).
+
+    python benchmarks/bench_render_processes.py [threads] [renders]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+media_root = tempfile.mkdtemp()
+settings.configure(MEDIA_ROOT=media_root)
+
+from PIL import Image
+
+from lazythumbs.executor import RenderPool
+from lazythumbs.views import LazyThumbRenderer
+
+
+def run(threads, renders, pool=None):
+    """ :returns: renders per second of threads threads rendering renders renditions """
+    renderer = LazyThumbRenderer()
+    shutil.rmtree(os.path.join(media_root, 'lt_cache'), ignore_errors=True)
+    jobs = list(range(renders))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                i = jobs.pop()
+            args = ('resize', 100 + i, 100, 'source.jpg', 'lt_cache/resize/%d/100/source.jpg' % (100 + i), 80)
+            if pool:
+                pool.render(LazyThumbRenderer, *args)
+            else:
+                renderer._render_and_save(*args)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return renders / (time.time() - started)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    renders = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    Image.effect_noise((2000, 1500), 64).convert('RGB').save(os.path.join(media_root, 'source.jpg'))
+    print('%d threads, %d renders of a 2000x1500 JPEG' % (threads, renders))
+    print('%-20s %12s' % ('renders in', 'renders/s'))
+    try:
+        print('%-20s %12.1f' % ('threads', run(threads, renders)))
+        for size in (2, 4, 8):
+            pool = RenderPool(size, None, 60)
+            pool.start()
+            try:
+                print('%-20s %12.1f' % ('%d processes' % size, run(threads, renders, pool)))
+            finally:
+                pool.stop()
+    finally:
+        shutil.rmtree(media_root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+CPU time per resize for each resampling tier, and how far the output of the
+faster tiers is from the 'quality' tier's (mean absolute difference per
+channel, 0-255), over a range of reduction ratios.
+
+    python benchmarks/bench_resample.py [repeats]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure()
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageStat
+
+from lazythumbs.resample import resample
+
+SOURCE_SIZE = (4000, 3000)
+SIZES = [(2000, 1500), (800, 600), (200, 150), (100, 75)]
+
+
+def photo(size):
+    """ something with both smooth areas and detail, like a photo """
+    random.seed(0)
+    img = Image.new('RGB', size)
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = random.randint(0, size[0]), random.randint(0, size[1])
+        r = random.randint(2, max(size) // 4)
+        color = tuple(random.randint(0, 255) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    return img.filter(ImageFilter.GaussianBlur(max(size) / 200.0))
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    img = photo(SOURCE_SIZE)
+    img.load()
+    print('%-10s %-9s %10s %10s' % ('size', 'tier', 'ms', 'diff'))
+    for size in SIZES:
+        expected = resample(img, size, 'quality')
+        for tier in ('quality', 'balanced', 'fast'):
+            started = time.time()
+            for _ in range(repeats):
+                result = resample(img, size, tier)
+            ms = (time.time() - started) / repeats * 1000
+            diff = sum(ImageStat.Stat(ImageChops.difference(result, expected)).mean) / 3
+            print('%-10s %-9s %10.2f %10.3f' % ('%dx%d' % size, tier, ms, diff))
+
+
+if __name__ == '__main__':
+    main()
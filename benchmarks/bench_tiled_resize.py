@@ -0,0 +1,47 @@
+"""
+Wall time of resizing a large source in one piece and tiled on 2, 4 and 8
+threads, checking that the tiled output is pixel identical.
+
+    python benchmarks/bench_tiled_resize.py [megapixels] [repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure()
+
+from mock import patch
+from PIL import Image, ImageChops
+
+from lazythumbs import resample
+
+SIZES = [(2000, 1500), (800, 600), (200, 150)]
+
+
+def main():
+    megapixels = float(sys.argv[1]) if len(sys.argv) > 1 else 48
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    img = Image.effect_noise((height * 4 // 3, height), 64).convert('RGB')
+    print('source %dx%d' % img.size)
+    print('%-10s %-8s %10s %10s' % ('size', 'threads', 'ms', 'identical'))
+    for size in SIZES:
+        expected = img.resize(size, Image.ANTIALIAS)
+        for threads in (1, 2, 4, 8):
+            with patch.object(resample, 'TILED_RESIZE_PIXELS', 1 if threads > 1 else 0):
+                with patch.object(resample, 'TILED_RESIZE_THREADS', threads):
+                    del resample._pool[:]
+                    started = time.time()
+                    for _ in range(repeats):
+                        result = resample.resize(img, size, Image.ANTIALIAS)
+                    ms = (time.time() - started) / repeats * 1000
+            identical = ImageChops.difference(result, expected).getbbox() is None
+            print('%-10s %-8d %10.1f %10s' % ('%dx%d' % size, threads, ms, identical))
+
+
+if __name__ == '__main__':
+    main()
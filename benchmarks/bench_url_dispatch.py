@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of rendition url dispatch: the six lt_cache url patterns
+plus the view's geometry, quality and path checks that lazythumbs used to
+run, against the single lt_cache pattern and parse_rendition_path.
+
+    python benchmarks/bench_url_dispatch.py [iterations]
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure(
+    MEDIA_ROOT='/tmp', MEDIA_URL='/media/', LAZYTHUMBS_URL='/media/lt/',
+    ROOT_URLCONF='lazythumbs.urls', USE_I18N=False,
+)
+
+from django.conf.urls import patterns, url
+from django.core.urlresolvers import RegexURLResolver
+
+from lazythumbs.spec import parse_rendition_path
+from lazythumbs.util import geometry_parse
+from lazythumbs.views import LazyThumbRenderer
+
+view = LazyThumbRenderer.as_view()
+
+old_urlpatterns = patterns('',
+    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+/\d+|\d+)/(?P<quality>q\d+)/(?P<source_path>.+)$', view),
+    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+/\d+|\d+)/(?P<source_path>.+)$', view),
+    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+x\d+)/(?P<quality>q\d+)/(?P<source_path>.+)$', view),
+    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+x\d+)/(?P<source_path>.+)$', view),
+    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>x/\d+)/(?P<quality>q\d+)/(?P<source_path>.+)$', view),
+    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>x/\d+)/(?P<source_path>.+)$', view),
+)
+
+
+class OldUrls(object):
+    urlpatterns = old_urlpatterns
+
+
+old_resolver = RegexURLResolver(r'^/', OldUrls)
+new_resolver = RegexURLResolver(r'^/', 'lazythumbs.urls')
+
+PATHS = [
+    '/lt_cache/resize/200/150/photos/2014/01/beach.jpg',
+    '/lt_cache/resize/200/150/q70/photos/2014/01/beach.jpg',
+    '/lt_cache/thumbnail/48/photos/2014/01/beach.jpg',
+    '/lt_cache/resize/200x150/photos/2014/01/beach.jpg',
+    '/lt_cache/scale/x/300/q90/photos/2014/01/beach.jpg',
+]
+
+
+def old_dispatch(path):
+    """ url resolution and the parsing LazyThumbRenderer.get used to do """
+    kwargs = old_resolver.resolve(path).kwargs
+    quality = int(kwargs.get('quality', 'q80').lstrip('q'))
+    assert 0 < quality <= 100
+    source_path = kwargs['source_path']
+    assert not source_path.startswith('/')
+    assert not re.match('\.\./', source_path)
+    return geometry_parse(kwargs['action'], kwargs['geometry'], ValueError), quality
+
+
+def new_dispatch(path):
+    spec = parse_rendition_path(new_resolver.resolve(path).kwargs['rendition'])
+    assert not (spec.source_path.startswith('/') or spec.source_path.startswith('../'))
+    return spec
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, dispatch in (('six patterns', old_dispatch), ('single pass', new_dispatch)):
+        seconds = timeit.timeit(lambda: [dispatch(p) for p in PATHS], number=iterations)
+        print('%-13s %6.2f us/request' % (name, seconds / (iterations * len(PATHS)) * 10 ** 6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Admission control for renders done in the request.
+
+At most LAZYTHUMBS_MAX_RENDERS renders run at once in a process and at most
+LAZYTHUMBS_MAX_HOST_RENDERS on the host. A render that finds no free slot
+waits in a queue of at most LAZYTHUMBS_RENDER_QUEUE_SIZE renders for up to
+LAZYTHUMBS_RENDER_QUEUE_TIMEOUT seconds; renders that don't fit in the queue
+or time out in it are rejected, and the view answers them with
+LAZYTHUMBS_RENDER_REJECT_FALLBACK instead. Requests for renditions that
+already exist never get here.
+
+Requests for a rendition that is being rendered wait on its render lock, and
+get the slot after it. When the render is rejected instead, renders of the
+same rendition asking within LAZYTHUMBS_RENDER_QUEUE_TIMEOUT seconds are
+rejected right away rather than each waiting in the queue again.
+
+Host slots are lock files (flock) in LAZYTHUMBS_ADMISSION_DIR, one per slot,
+so that the slots of a process that dies are freed with it. The directory
+must be local to the host, which is why it defaults to a directory in the
+system's temporary directory rather than under MEDIA_ROOT, which may be
+shared between hosts.
+"""
+from contextlib import contextmanager
+import errno
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from django.conf import settings
+
+from lazythumbs.settings import MAX_RENDERS, MAX_HOST_RENDERS, RENDER_QUEUE_SIZE, RENDER_QUEUE_TIMEOUT
+from lazythumbs.lru import LRUCache
+from lazythumbs.settings import ADMISSION_DIR
+
+logger = logging.getLogger('lazythumbs')
+
+# seconds between attempts to take a host slot
+SLOT_POLL_INTERVAL = 0.05
+
+# renditions whose recent rejection is passed on to the renders waiting for them
+RECENT_REJECTIONS = 1000
+
+
+class RenderRejected(Exception):
+    """ raised when a render can't be admitted """
+
+
+def get_admission_dir():
+    return ADMISSION_DIR or os.path.join(tempfile.gettempdir(), 'lazythumbs-admission')
+
+
+def try_host_slot(limit):
+    """
+    :returns: an open file descriptor holding one of limit host slots, or
+        None if they are all taken
+    """
+    admission_dir = get_admission_dir()
+    try:
+        os.makedirs(admission_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    for i in range(limit):
+        fd = os.open(os.path.join(admission_dir, 'slot-%d' % i), os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+        else:
+            return fd
+    return None
+
+
+class Admission(object):
+    """
+    Process and host render slots with a bounded wait queue. active and
+    waiting count the renders holding and waiting for a process slot,
+    rejected the renders rejected since the process started.
+    """
+    def __init__(self, limit, host_limit, queue_size, timeout):
+        self.limit = limit
+        self.host_limit = host_limit if fcntl is not None else None
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        # rendition key -> time until which its renders are rejected
+        self.recent_rejections = LRUCache(RECENT_REJECTIONS)
+
+    def enqueue(self):
+        """ join the wait queue; the caller holds self.cond """
+        if self.waiting >= self.queue_size:
+            return False
+        self.waiting += 1
+        return True
+
+    def reject(self, reason, key=None):
+        with self.cond:
+            self.rejected += 1
+            counts = 'active=%s waiting=%s rejected=%s' % (self.active, self.waiting, self.rejected)
+        if key is not None:
+            self.recent_rejections.set(key, time.time() + self.timeout)
+        logger.warning('render rejected, %s (%s)', reason, counts)
+        raise RenderRejected(reason)
+
+    def rejected_recently(self, key):
+        until = self.recent_rejections.get(key)
+        if until is None:
+            return False
+        if until <= time.time():
+            self.recent_rejections.delete(key)
+            return False
+        return True
+
+    def acquire_process_slot(self, deadline):
+        with self.cond:
+            if self.limit and self.active >= self.limit:
+                if not self.enqueue():
+                    return False
+                try:
+                    while self.active >= self.limit:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return False
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            return True
+
+    def release_process_slot(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def acquire_host_slot(self, deadline):
+        """
+        :returns: an open file descriptor holding a host slot, or None
+        """
+        fd = try_host_slot(self.host_limit)
+        if fd is not None:
+            return fd
+        with self.cond:
+            if not self.enqueue():
+                return None
+        try:
+            while fd is None and time.time() < deadline:
+                time.sleep(SLOT_POLL_INTERVAL)
+                fd = try_host_slot(self.host_limit)
+            return fd
+        finally:
+            with self.cond:
+                self.waiting -= 1
+
+    @contextmanager
+    def slot(self, key=None):
+        """
+        Hold a render slot for the duration of the block.
+
+        :param key: what is rendered, e.g. the rendered path; a rejection is
+            passed on to the renders of the same key that ask for a slot
+            while the rejected one was waiting
+        :raises RenderRejected: if no slot came free in time
+        """
+        if not (self.limit or self.host_limit):
+            yield
+            return
+
+        if key is not None and self.rejected_recently(key):
+            self.reject('%s was rejected moments ago' % key)
+        deadline = time.time() + self.timeout
+        if not self.acquire_process_slot(deadline):
+            self.reject('process at LAZYTHUMBS_MAX_RENDERS', key)
+        try:
+            fd = None
+            if self.host_limit:
+                try:
+                    fd = self.acquire_host_slot(deadline)
+                except (IOError, OSError) as e:
+                    logger.warning('unable to take a host render slot: %s', e)
+                else:
+                    if fd is None:
+                        self.reject('host at LAZYTHUMBS_MAX_HOST_RENDERS', key)
+            try:
+                yield
+            finally:
+                if fd is not None:
+                    os.close(fd)
+        finally:
+            self.release_process_slot()
+
+
+admission = Admission(MAX_RENDERS, MAX_HOST_RENDERS, RENDER_QUEUE_SIZE, RENDER_QUEUE_TIMEOUT)
@@ -0,0 +1,180 @@
+"""
+Keeping the rendition cache within a byte budget.
+
+Renditions are evicted least recently used first. The view records accesses
+by bumping a served rendition's atime (at most once per
+LAZYTHUMBS_ACCESS_TIME_RESOLUTION seconds, and leaving its mtime, which
+Last-Modified is based on, alone); renditions the web server sends without
+going through Django rely on the filesystem's own atime updates.
+
+Each rendition is deleted under its render lock and only if it hasn't been
+accessed since the scan, so eviction can run next to live renders.
+"""
+from collections import namedtuple
+import logging
+import os
+import re
+import time
+
+from django.conf import settings
+
+from lazythumbs.locks import render_lock
+from lazythumbs.settings import RENDER_LOCK, CACHE_SHARD_WIDTH
+from lazythumbs.spec import parse_rendition_path
+
+logger = logging.getLogger('lazythumbs')
+
+CachedRendition = namedtuple('CachedRendition', 'path size atime')
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """ '500M' -> 524288000 """
+    match = re.match(r'^(\d+)([KMGT]?)B?$', str(size).strip().upper())
+    if not match:
+        raise ValueError('bad size %r' % size)
+    return int(match.group(1)) * SIZE_SUFFIXES[match.group(2)]
+
+
+def is_shard(name):
+    return len(name) == CACHE_SHARD_WIDTH and all(c in '0123456789abcdef' for c in name)
+
+
+def is_sharded(path):
+    """ whether a rendition path relative to MEDIA_ROOT is in the sharded layout """
+    parts = path.split('/', 2)
+    return len(parts) == 3 and parts[0] == 'lt_cache' and is_shard(parts[1])
+
+
+def get_spec(path):
+    """
+    :returns: the RenditionSpec of a rendition stored at its url path, or None
+    """
+    if is_sharded(path) or 'lt_cache/' not in path:
+        return None
+    return parse_rendition_path(path.rsplit('lt_cache/', 1)[1])
+
+
+def walk_renditions(actions, sharded=True):
+    """
+    Every rendition under MEDIA_ROOT, relative to it: those stored at their
+    url path, i.e. below an lt_cache/<action> directory, and, if sharded is
+    set, those in the sharded layout.
+
+    :param actions: names of the renderer's actions
+    """
+    for root, dirs, files in os.walk(settings.MEDIA_ROOT):
+        rel_root = os.path.relpath(root, settings.MEDIA_ROOT).split(os.sep)
+        if rel_root[-1] == 'lt_cache':
+            # leave the lock, index and spool directories alone
+            keep = [d for d in dirs if d in actions]
+            if sharded and rel_root == ['lt_cache']:
+                keep.extend(d for d in dirs if is_shard(d))
+            dirs[:] = keep
+            continue
+        if 'lt_cache' not in rel_root:
+            continue
+        for name in files:
+            rel_path = '/'.join(rel_root + [name])
+            if is_sharded(rel_path) or get_spec(rel_path) is not None:
+                yield rel_path
+
+
+def scan(paths):
+    """
+    :returns: a CachedRendition for each of paths still on disk
+    """
+    renditions = []
+    for path in paths:
+        try:
+            stat = os.stat(os.path.join(settings.MEDIA_ROOT, path))
+        except OSError:
+            continue
+        renditions.append(CachedRendition(path, stat.st_size, stat.st_atime))
+    return renditions
+
+
+def get_stats(renditions):
+    """
+    :returns: {(action, geometry): [file count, bytes]}. Renditions in the
+        sharded layout don't carry their url and are counted under
+        ('sharded', '').
+    """
+    stats = {}
+    for rendition in renditions:
+        spec = get_spec(rendition.path)
+        if spec is None:
+            key = ('sharded', '')
+        else:
+            key = (spec.action, '%sx%s' % (spec.width or '', spec.height or ''))
+        counts = stats.setdefault(key, [0, 0])
+        counts[0] += 1
+        counts[1] += rendition.size
+    return stats
+
+
+def remove_empty_dirs(path, stop):
+    """ remove path and its parents up to, but not including, stop while they are empty """
+    while path != stop and path.startswith(stop + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
+
+
+def evict(renditions, budget, dry_run=False, batch_size=100, pause=0):
+    """
+    Delete least recently used renditions until the rest fit in budget bytes.
+    Every batch_size deletions the process sleeps pause seconds, which keeps
+    the load on the disk down.
+
+    :returns: (files deleted, bytes freed)
+    """
+    media_root = settings.MEDIA_ROOT.rstrip(os.sep)
+    total = sum(r.size for r in renditions)
+    deleted = freed = 0
+    for rendition in sorted(renditions, key=lambda r: r.atime):
+        if total <= budget:
+            break
+        if dry_run:
+            total -= rendition.size
+            deleted += 1
+            freed += rendition.size
+            continue
+        path = os.path.join(media_root, rendition.path)
+        # never wait for a render in progress, just move on
+        with render_lock(rendition.path, timeout=0) as locked:
+            if RENDER_LOCK and not locked:
+                continue
+            try:
+                if os.stat(path).st_atime != rendition.atime:
+                    # accessed since the scan
+                    continue
+                os.unlink(path)
+            except OSError:
+                continue
+        remove_empty_dirs(os.path.dirname(path), media_root)
+        total -= rendition.size
+        deleted += 1
+        freed += rendition.size
+        if pause and deleted % batch_size == 0:
+            time.sleep(pause)
+    return deleted, freed
+
+
+def touch(path, stat, resolution):
+    """
+    Record an access to a rendition by setting its atime to now, unless it
+    was recorded less than resolution seconds ago.
+
+    :param stat: a recent os.stat of path
+    """
+    now = time.time()
+    if stat.st_atime >= now - resolution:
+        return
+    try:
+        os.utime(path, (now, stat.st_mtime))
+    except OSError as e:
+        logger.debug('unable to record access to %s: %s', path, e)
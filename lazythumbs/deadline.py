@@ -0,0 +1,96 @@
+"""
+Deadlines for renders done in the request.
+
+With LAZYTHUMBS_RENDER_DEADLINE set the view renders on a thread of its own
+and waits at most that many seconds for it. PIL can't be interrupted, so a
+render that takes longer goes on in the background, still holding its render
+lock and admission slot, while the request is answered with a stand-in.
+
+Renders that take longer than the deadline, in the view or anywhere else, get
+their source appended to LAZYTHUMBS_SLOW_SOURCE_LOG, one path relative to
+MEDIA_ROOT per line, ready for lazythumbs_pregenerate:
+
+    sort -u media/lt_cache/.slow_sources | ./manage.py lazythumbs_pregenerate -f - -s resize:150x150
+"""
+from collections import deque
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from lazythumbs.settings import SLOW_SOURCE_LOG
+
+logger = logging.getLogger('lazythumbs')
+
+# (time, source path, rendered path, seconds) of the latest slow renders
+slow_renders = deque(maxlen=100)
+
+
+class DeadlineExceeded(Exception):
+    """ raised when a call doesn't return in time; it goes on in the background """
+
+
+def call_with_deadline(fun, deadline, name=None):
+    """
+    Call fun on a new thread and wait up to deadline seconds for it.
+
+    :param name: what fun does, for the log
+    :returns: what fun returned
+    :raises: what fun raised, or DeadlineExceeded if it is still running
+    """
+    outcome = []
+    abandoned = []
+    lock = threading.Lock()
+    started = time.time()
+
+    def call():
+        try:
+            result = (fun(), None)
+        except Exception:
+            result = (None, sys.exc_info())
+        with lock:
+            outcome.append(result)
+            late = bool(abandoned)
+        if late:
+            elapsed = time.time() - started
+            if result[1]:
+                logger.warning('%s failed after %.1fs in the background', name, elapsed, exc_info=result[1])
+            else:
+                logger.info('%s finished after %.1fs in the background', name, elapsed)
+
+    thread = threading.Thread(target=call, name='lazythumbs-deadline')
+    thread.daemon = True
+    thread.start()
+    thread.join(deadline)
+    with lock:
+        if not outcome:
+            abandoned.append(True)
+            raise DeadlineExceeded('%s is still running after %ss' % (name, deadline))
+
+    value, exc_info = outcome[0]
+    if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return value
+
+
+def get_slow_source_log():
+    return SLOW_SOURCE_LOG or os.path.join(settings.MEDIA_ROOT, 'lt_cache', '.slow_sources')
+
+
+def record_slow_source(source_path, rendered_path, elapsed):
+    """ note a source that took elapsed seconds to render rendered_path from """
+    logger.warning('%s: %.1fs to render %s, over LAZYTHUMBS_RENDER_DEADLINE', source_path, elapsed, rendered_path)
+    slow_renders.append((time.time(), source_path, rendered_path, elapsed))
+    path = get_slow_source_log()
+    line = source_path + '\n'
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+    try:
+        # lines this short are appended atomically, even from several processes
+        with open(path, 'a') as f:
+            f.write(line)
+    except IOError as e:
+        logger.warning('unable to record slow source in %s: %s', path, e)
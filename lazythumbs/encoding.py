@@ -0,0 +1,84 @@
+"""
+Encoder options per output format and rendition size.
+
+LAZYTHUMBS_ENCODER_PROFILES maps a PIL format to a list of
+(max pixel count, options) bands in increasing order; the first band whose
+max pixel count (None for no limit) the rendition fits in applies. Options
+are passed to PIL's save, e.g. optimize, progressive, subsampling or
+compress_level, except strip_metadata: unless it is False the source's ICC
+profile and EXIF data are left out. Formats without a profile are saved with
+LAZYTHUMBS_OPTIMIZE_FLAG and LAZYTHUMBS_PROGRESSIVE_FLAG.
+
+encode saves an image with these options, and without them should PIL
+reject them.
+"""
+from collections import deque
+from cStringIO import StringIO
+import logging
+import time
+
+from lazythumbs.settings import DEFAULT_OPTIMIZE_FLAG, DEFAULT_PROGRESSIVE_FLAG, ENCODER_PROFILES
+
+logger = logging.getLogger('lazythumbs')
+
+# the most recent renditions that had to be saved without their options,
+# as (time, name, size, params, error)
+fallbacks = deque(maxlen=100)
+
+
+def get_profile(img_format, size, profiles=None):
+    """
+    :param size: (width, height) of the rendition
+    :returns: the options of the band the rendition falls in, or None if
+        img_format has no profile
+    """
+    if profiles is None:
+        profiles = ENCODER_PROFILES
+    bands = profiles.get(img_format)
+    if not bands:
+        return None
+    pixels = size[0] * size[1]
+    for max_pixels, options in bands:
+        if max_pixels is None or pixels <= max_pixels:
+            return options
+    return bands[-1][1]
+
+
+def get_save_params(img, img_format, quality, profiles=None):
+    """
+    :param img: the PIL image about to be saved
+    :returns: keyword arguments for img.save
+    """
+    options = get_profile(img_format, img.size, profiles)
+    if options is None:
+        options = {'optimize': DEFAULT_OPTIMIZE_FLAG, 'progressive': DEFAULT_PROGRESSIVE_FLAG}
+
+    params = dict(options)
+    # the quality asked for in the url wins over a profile's
+    params.update(format=img_format, quality=quality)
+    if params.pop('strip_metadata', True) is False:
+        for key in ('icc_profile', 'exif'):
+            if img.info.get(key):
+                params[key] = img.info[key]
+    return params
+
+
+def encode(img, params, name=None):
+    """
+    Save img with params, as returned by get_save_params.
+
+    Should PIL reject the options anyway, img is saved with just its format
+    and quality, and the rendition is recorded in fallbacks.
+
+    :param name: what to record the rendition as, e.g. its path
+    :returns: the encoded image data
+    """
+    buf = StringIO()
+    try:
+        img.save(buf, **params)
+    except IOError as e:
+        logger.warning("saving %s with %r failed (%s), trying without options", name, params.keys(), e)
+        fallbacks.append((time.time(), name, img.size, params.keys(), str(e)))
+        buf = StringIO()
+        img.save(buf, format=params['format'], quality=params['quality'])
+    return buf.getvalue()
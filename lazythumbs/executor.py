@@ -0,0 +1,317 @@
+"""
+Render threads and processes for the view.
+
+With LAZYTHUMBS_RENDER_THREADS set, the view hands renders to a fixed pool of
+that many render threads and waits for their outcome, a Future, instead of
+starting a thread per render to bound the wait with
+LAZYTHUMBS_RENDER_DEADLINE. Renders wait for a free thread in a queue of at
+most LAZYTHUMBS_RENDER_QUEUE_SIZE renders and are rejected like by admission
+control when it is full. On the render thread they go through render_lock
+and admission control like renders in the request's thread do, so
+concurrent requests for a rendition still share one render.
+
+Decoding, resizing and encoding release the GIL only in parts, so renders on
+many threads of one process mostly wait for each other. With
+LAZYTHUMBS_RENDER_PROCESSES set, the view sends each render, as a tuple of
+the renderer class's path and the arguments of _render_and_save, to one of a
+pool of forked render processes, which saves the rendition and sends back its
+data. The web worker's thread keeps the render lock and admission slot while
+it waits.
+
+A render process that dies, e.g. in a decoder crashing on a corrupt image, or
+that takes longer than LAZYTHUMBS_RENDER_PROCESS_TIMEOUT seconds is replaced
+and its render fails with RenderCrashed, which the view answers like a
+rejected render, without caching a 404: the crash may have nothing to do with
+the source. The view deletes whatever the process left at the rendition's
+path, which may be a partly written file. A process found dead while idle is replaced before it gets a
+render. Processes are also replaced after LAZYTHUMBS_RENDER_PROCESS_MAX_TASKS
+renders, which returns the memory they fragmented.
+
+Processes are forked on first use, or by render_pool.start(), which is best
+called from wsgi.py before the server starts its threads. Replacements are
+forked from the request thread that needs one; after_fork resets the locks
+the new process may have inherited held.
+"""
+from importlib import import_module
+import logging
+import multiprocessing
+import pickle
+import Queue
+import sys
+import threading
+
+from lazythumbs.admission import RenderRejected
+from lazythumbs.deadline import DeadlineExceeded
+from lazythumbs.settings import RENDER_PROCESSES, RENDER_PROCESS_MAX_TASKS, RENDER_PROCESS_TIMEOUT
+from lazythumbs.settings import RENDER_QUEUE_SIZE, RENDER_THREADS
+
+logger = logging.getLogger('lazythumbs')
+
+
+class RenderCrashed(Exception):
+    """ raised when a render process died or was killed during a render """
+
+
+class Future(object):
+    """ the outcome of a render """
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.exc_info = None
+
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+
+    def set_exception(self, exc_info):
+        self.exc_info = exc_info
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait up to timeout seconds, or as long as it takes if None, for the
+        render to finish.
+
+        :returns: what the render returned
+        :raises: what the render raised, or DeadlineExceeded if it is still
+            running
+        """
+        if not self.event.wait(timeout):
+            raise DeadlineExceeded('render is still running after %ss' % timeout)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+
+class RenderThreads(object):
+    """
+    size render threads working through the renders submitted to them, of
+    which at most queue_size wait for a free thread. Threads are started on
+    first use.
+    """
+    def __init__(self, size, queue_size):
+        self.size = size
+        # a Queue of maxsize 0 is unbounded, and a render passes through the
+        # queue even when a thread is free
+        self.jobs = Queue.Queue(max(queue_size, 1))
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, fun):
+        """
+        Have fun called on a render thread.
+
+        :returns: the Future of the call
+        :raises RenderRejected: if the queue is full
+        """
+        with self.lock:
+            if not self.threads:
+                for i in range(self.size):
+                    thread = threading.Thread(target=self.work, name='lazythumbs-render-thread-%d' % i)
+                    thread.daemon = True
+                    thread.start()
+                    self.threads.append(thread)
+        future = Future()
+        try:
+            self.jobs.put_nowait((fun, future))
+        except Queue.Full:
+            logger.warning('render rejected, %d renders waiting for a render thread', self.jobs.maxsize)
+            raise RenderRejected('render threads busy')
+        return future
+
+    def work(self):
+        while True:
+            fun, future = self.jobs.get()
+            try:
+                future.set_result(fun())
+            except Exception:
+                future.set_exception(sys.exc_info())
+            finally:
+                self.jobs.task_done()
+
+
+def after_fork():
+    """
+    Give a render process its own copies of the state the threads of the web
+    worker share, and of the locks of logging, which one of them might have
+    been holding at fork time.
+    """
+    from lazythumbs import locks, resample, views
+    from lazythumbs.lru import DecodedImageCache
+
+    logging._lock = threading.RLock()
+    for ref in logging._handlerList:
+        handler = ref()
+        if handler is not None:
+            handler.createLock()
+    locks.flights = locks.SingleFlight()
+    resample._pool_lock = threading.Lock()
+    del resample._pool[:]
+    views.source_cache = DecodedImageCache(views.source_cache.max_cost)
+
+
+# one renderer per class and render process, created on first use
+_renderers = {}
+
+
+def get_renderer(class_path):
+    if class_path not in _renderers:
+        module_name, class_name = class_path.rsplit('.', 1)
+        _renderers[class_path] = getattr(import_module(module_name), class_name)()
+    return _renderers[class_path]
+
+
+def serve(conn, max_tasks):
+    """
+    Main loop of a render process: answer (class path, render args) specs
+    from conn with ('ok', raw data) or ('error', exception) until max_tasks
+    renders are done or the web worker goes away.
+    """
+    after_fork()
+    tasks = 0
+    while not max_tasks or tasks < max_tasks:
+        try:
+            spec = conn.recv()
+        except (EOFError, IOError):
+            return
+        try:
+            result = ('ok', get_renderer(spec[0])._render_and_save(*spec[1:]))
+        except Exception as e:
+            result = ('error', e)
+        try:
+            conn.send(result)
+        except (pickle.PicklingError, TypeError):
+            conn.send(('error', IOError(repr(result[1]))))
+        tasks += 1
+
+
+class RenderProcess(object):
+    """ a forked render process and the web worker's end of its pipe """
+    def __init__(self, max_tasks):
+        self.max_tasks = max_tasks
+        self.tasks = 0
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve, args=(child_conn, max_tasks), name='lazythumbs-render'
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def send(self, spec):
+        """
+        Hand the process a render.
+
+        :returns: False if the process is gone, True otherwise
+        """
+        self.tasks += 1
+        try:
+            self.conn.send(spec)
+        except (EOFError, IOError, OSError):
+            self.stop()
+            return False
+        return True
+
+    def receive(self, timeout):
+        """
+        :returns: the rendition's data
+        :raises RenderCrashed: if the process died or timed out
+        """
+        if not self.conn.poll(timeout):
+            self.stop()
+            raise RenderCrashed('render process %s timed out after %ss' % (self.process.pid, timeout))
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, IOError):
+            self.stop()
+            raise RenderCrashed('render process %s died with exit code %s' % (
+                self.process.pid, self.process.exitcode))
+        if status == 'error':
+            raise value
+        return value
+
+    @property
+    def usable(self):
+        return self.process.is_alive() and not (self.max_tasks and self.tasks >= self.max_tasks)
+
+    def stop(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+
+class RenderPool(object):
+    """
+    size render processes, each used by one thread at a time. Threads wait
+    for a free process; processes that are used up or dead are replaced by
+    the next thread to need them.
+    """
+    def __init__(self, size, max_tasks, timeout):
+        self.size = size
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self.idle = Queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        """ fork the render processes, unless that's already done """
+        with self.lock:
+            if self.started:
+                return
+            for i in range(self.size):
+                self.idle.put(RenderProcess(self.max_tasks))
+            self.started = True
+
+    def stop(self):
+        """ terminate the idle render processes """
+        with self.lock:
+            while True:
+                try:
+                    process = self.idle.get_nowait()
+                except Queue.Empty:
+                    break
+                if process is not None:
+                    process.stop()
+            self.started = False
+
+    def render(self, renderer_class, *args):
+        """
+        renderer_class()._render_and_save(*args) in a render process.
+
+        :raises RenderCrashed: if the render process died or timed out
+        """
+        self.start()
+        spec = ('%s.%s' % (renderer_class.__module__, renderer_class.__name__),) + args
+        process = self.idle.get()
+        try:
+            if process is None or not process.usable:
+                process = self.replace(process)
+            if not process.send(spec):
+                # died since, e.g. killed by the OOM killer; try a fresh one
+                process = self.replace(process)
+                if not process.send(spec):
+                    raise RenderCrashed('render process %s died before rendering' % process.process.pid)
+            return process.receive(self.timeout)
+        except RenderCrashed as e:
+            logger.warning('%s rendering %s', e, args[4])
+            raise
+        finally:
+            if process is not None and not process.usable:
+                process.stop()
+                process = None
+            self.idle.put(process)
+
+    def replace(self, process):
+        """ :returns: a new render process in place of process """
+        if process is not None:
+            process.stop()
+        return RenderProcess(self.max_tasks)
+
+
+render_threads = RenderThreads(RENDER_THREADS, RENDER_QUEUE_SIZE)
+render_pool = RenderPool(RENDER_PROCESSES, RENDER_PROCESS_MAX_TASKS, RENDER_PROCESS_TIMEOUT)
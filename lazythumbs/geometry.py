@@ -0,0 +1,198 @@
+"""
+Geometry of the built in actions, worked out from the source's dimensions
+before any pixels are touched.
+
+A Plan says which box of the source to resample to what size, and, for
+results that don't fill the requested size, the canvas to paste it into.
+The renderer carries out a plan with a single resample of the source box
+(or a crop when nothing is scaled), so cropping after scaling doesn't create
+an intermediate image of the full scaled size.
+"""
+from collections import namedtuple
+
+
+class Plan(namedtuple('Plan', 'box size canvas offset background')):
+    """
+    box: (left, top, right, bottom) of the source to resample, possibly
+        fractional, or to crop, possibly reaching outside the source, when
+        it is as large as size.
+    size: (width, height) to resample box to.
+    canvas: (width, height) of the image to paste the result into at offset,
+        or None if the result is the rendition.
+    background: color of the canvas, or None for PIL's crop fill, i.e. zeros
+        in the image's mode. A rendition with a background is always RGB.
+    """
+    __slots__ = ()
+
+    @property
+    def scaled(self):
+        left, top, right, bottom = self.box
+        return (right - left, bottom - top) != self.size
+
+    def decoded(self, source_size, decoded_size):
+        """
+        The plan for the source decoded at decoded_size, e.g. by JPEG draft
+        mode: the same result, with box in the decoded image's coordinates.
+        """
+        if tuple(source_size) == tuple(decoded_size):
+            return self
+        x = float(decoded_size[0]) / source_size[0]
+        y = float(decoded_size[1]) / source_size[1]
+        left, top, right, bottom = self.box
+        return self._replace(box=(left * x, top * y, right * x, bottom * y))
+
+
+def unchanged(source_size):
+    """ the plan that leaves the source as it is """
+    return Plan((0, 0) + tuple(source_size), tuple(source_size), None, (0, 0), None)
+
+
+def get_thumbnail_size(source_size, width=None, height=None):
+    """
+    Scale to width or height, retaining the source's ratio in the other
+    dimension. Sources are never scaled up.
+
+    :returns: (width, height), source_size if it would have to grow
+    :raises ValueError: unless exactly one of width and height is given
+    """
+    if (width and height) or (width is None and height is None):
+        raise ValueError('thumbnail requires width XOR height; got (%s, %s)' % (width, height))
+    source_width, source_height = source_size
+    width = width or int(source_width * float(height) / source_height)
+    height = height or int(source_height * float(width) / source_width)
+    if width >= source_width or height >= source_height:
+        return tuple(source_size)
+    return width, height
+
+
+def get_fit_size(source_size, width, height):
+    """ the largest size of the source's ratio within width x height, like PIL's Image.thumbnail """
+    fit_width, fit_height = source_size
+    if fit_width > width:
+        fit_height = int(max(fit_height * width // fit_width, 1))
+        fit_width = width
+    if fit_height > height:
+        fit_width = int(max(fit_width * height // fit_height, 1))
+        fit_height = height
+    return fit_width, fit_height
+
+
+def cut(source_size, scaled_size, rect, background=None):
+    """
+    Plan scaling the source to scaled_size and cutting rect out of the result.
+    Parts of rect outside the scaled image are left to the canvas.
+
+    :param rect: (left, top, right, bottom) in the scaled image's coordinates
+    """
+    source_width, source_height = source_size
+    scaled_width, scaled_height = scaled_size
+    left, top, right, bottom = rect
+    canvas = (right - left, bottom - top)
+    if tuple(scaled_size) == tuple(source_size) and background is None:
+        # PIL's crop fills what lies outside with zeros itself
+        return Plan(tuple(rect), canvas, None, (0, 0), None)
+
+    inner = (max(left, 0), max(top, 0), min(right, scaled_width), min(bottom, scaled_height))
+    box = (
+        float(inner[0] * source_width) / scaled_width,
+        float(inner[1] * source_height) / scaled_height,
+        float(inner[2] * source_width) / scaled_width,
+        float(inner[3] * source_height) / scaled_height,
+    )
+    size = (inner[2] - inner[0], inner[3] - inner[1])
+    if inner == tuple(rect):
+        return Plan(box, size, None, (0, 0), background)
+    return Plan(box, size, canvas, (inner[0] - left, inner[1] - top), background)
+
+
+def plan_scale(source_size, width, height):
+    """ scale to width x height, paying no attention to ratio, but never up """
+    source_width, source_height = source_size
+    size = (min(width, source_width), min(height, source_height))
+    return Plan((0, 0) + tuple(source_size), size, None, (0, 0), None)
+
+
+def plan_thumbnail(source_size, width=None, height=None):
+    size = get_thumbnail_size(source_size, width, height)
+    return Plan((0, 0) + tuple(source_size), size, None, (0, 0), None)
+
+
+def plan_resize(source_size, width, height, allow_undersized=False):
+    """
+    Thumbnail along the larger dimension and center crop to width x height.
+    Unless allow_undersized is set, sources already within width x height
+    are left alone; if it is, the crop fills them out to width x height.
+    """
+    source_width, source_height = source_size
+    if not allow_undersized and width >= source_width and height >= source_height:
+        return unchanged(source_size)
+
+    scaled_size = get_thumbnail_size(
+        source_size,
+        width=width if source_width < source_height else None,
+        height=height if source_height <= source_width else None,
+    )
+    if scaled_size == (width, height):
+        return Plan((0, 0) + tuple(source_size), scaled_size, None, (0, 0), None)
+
+    left = (scaled_size[0] - width) // 2
+    top = (scaled_size[1] - height) // 2
+    return cut(source_size, scaled_size, (left, top, left + width, top + height))
+
+
+def plan_aresize(source_size, width, height, background, crop_img=True):
+    """
+    Scale taking source and target aspect ratios into consideration, see
+    LazyThumbRenderer.aresize, and center the result on a width x height
+    background.
+    """
+    if tuple(source_size) == (width, height):
+        return unchanged(source_size)
+
+    source_width, source_height = source_size
+    source_aspect = float(source_width) / source_height
+    aspect = float(width) / height if width and height else source_aspect
+
+    source_is_landscape = (source_aspect >= 1.0)
+    is_landscape = (aspect >= 1.0)
+
+    if source_is_landscape == is_landscape:
+        # Same orientation. When cropping, scale according to aspect ratio to
+        # maximize photo area and minimize border insertion; otherwise scale
+        # according to the larger dimension to avoid cropping, which mattes.
+        if (source_aspect > aspect) == crop_img:
+            target_width, target_height = None, height
+        else:
+            target_width, target_height = width, None
+    elif source_is_landscape:
+        # Opposite orientations, crop_img is irrelevant. Scale to the
+        # source's longer dimension, which mattes but keeps the visual
+        # appearance of the source orientation.
+        target_width, target_height = width, None
+    else:
+        target_width, target_height = None, height
+
+    # never expand images
+    if ((target_width and target_width < source_width) or
+            (target_height and target_height < source_height)):
+        scaled_size = get_thumbnail_size(source_size, target_width, target_height)
+    else:
+        scaled_size = tuple(source_size)
+
+    if scaled_size == (width, height):
+        return Plan((0, 0) + tuple(source_size), scaled_size, None, (0, 0), None)
+
+    offset_x = (width - scaled_size[0]) // 2
+    offset_y = (height - scaled_size[1]) // 2
+    return cut(
+        source_size, scaled_size,
+        (-offset_x, -offset_y, width - offset_x, height - offset_y),
+        background
+    )
+
+
+def plan_matte(source_size, width, height, background):
+    """ fit the source in width x height and center it on a background """
+    fit_size = get_fit_size(source_size, width, height)
+    offset = ((width - fit_size[0]) // 2, (height - fit_size[1]) // 2)
+    return Plan((0, 0) + tuple(source_size), fit_size, (width, height), offset, background)
@@ -0,0 +1,172 @@
+"""
+Single-flight locking for renders. When many requests for the same missing
+rendition arrive at once, exactly one of them renders it; the others wait
+for the lock and then find the finished file on disk.
+
+Threads in one process coordinate through a condition variable, WSGI
+processes coordinate through a lock file (flock) per rendition.
+"""
+from contextlib import contextmanager
+from hashlib import md5
+import errno
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from django.conf import settings
+
+from lazythumbs.settings import RENDER_LOCK, RENDER_LOCK_TIMEOUT, RENDER_LOCK_DIR
+
+logger = logging.getLogger('lazythumbs')
+
+# seconds between attempts to take a lock file held by another process
+LOCK_POLL_INTERVAL = 0.05
+
+
+class SingleFlight(object):
+    """
+    Keep track of keys currently being worked on by a thread of this process.
+    Only one thread at a time may hold a key; the others block on a shared
+    condition variable until it is released or their timeout runs out.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.in_flight = set()
+
+    def acquire(self, key, timeout):
+        """
+        :returns: True once key is held, False if timeout seconds passed first
+        """
+        deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            while key in self.in_flight:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            self.in_flight.add(key)
+            return True
+        finally:
+            self.cond.release()
+
+    def release(self, key):
+        self.cond.acquire()
+        try:
+            self.in_flight.discard(key)
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+
+flights = SingleFlight()
+
+
+def get_lock_dir():
+    return RENDER_LOCK_DIR or os.path.join(settings.MEDIA_ROOT, 'lt_cache', '.locks')
+
+
+def get_lock_path(name):
+    return os.path.join(get_lock_dir(), '%s.lock' % md5(name).hexdigest())
+
+
+def acquire_file_lock(path, deadline):
+    """
+    Take an exclusive flock on path, creating it if needed.
+
+    The holder unlinks the lock file on release, so after locking we make
+    sure the file we hold is still the one at path; otherwise we raced
+    with a release and have to try again.
+
+    :returns: an open file descriptor holding the lock, or None on timeout
+    """
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        locked = False
+        try:
+            while not locked:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    if time.time() >= deadline:
+                        os.close(fd)
+                        return None
+                    time.sleep(LOCK_POLL_INTERVAL)
+
+            try:
+                current = os.stat(path).st_ino
+            except OSError:
+                current = None
+            if current == os.fstat(fd).st_ino:
+                return fd
+        except Exception:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+
+def release_file_lock(path, fd):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    os.close(fd)
+
+
+@contextmanager
+def render_lock(name, timeout=None):
+    """
+    Hold the render lock for name (usually the rendered path) for the
+    duration of the block. Yields True when the lock is held exclusively and
+    False when locking is disabled or timed out, in which case the caller
+    renders without coordination just as it would have without this lock.
+
+    Callers should look for the finished rendition again once inside the
+    block: whoever held the lock before them has probably written it.
+    """
+    if not RENDER_LOCK:
+        yield False
+        return
+
+    if timeout is None:
+        timeout = RENDER_LOCK_TIMEOUT
+    deadline = time.time() + timeout
+
+    if not flights.acquire(name, timeout):
+        logger.info('timed out waiting for in-process render of %s', name)
+        yield False
+        return
+
+    try:
+        fd = None
+        path = get_lock_path(name)
+        if fcntl is not None:
+            try:
+                fd = acquire_file_lock(path, deadline)
+            except (IOError, OSError) as e:
+                logger.warning('unable to take render lock %s: %s', path, e)
+            else:
+                if fd is None:
+                    logger.info('timed out waiting for render lock %s', path)
+        try:
+            yield fd is not None or fcntl is None
+        finally:
+            if fd is not None:
+                release_file_lock(path, fd)
+    finally:
+        flights.release(name)
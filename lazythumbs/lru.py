@@ -0,0 +1,112 @@
+"""
+Small in-process LRU caches. Entries carry a cost (bytes, or 1 per entry)
+and the least recently used entries are evicted once the total cost goes
+over budget.
+"""
+from collections import OrderedDict
+import threading
+
+from lazythumbs.util import get_decode_size
+
+
+class LRUCache(object):
+    """
+    Thread safe, cost bounded least-recently-used cache. A max_cost of 0
+    disables the cache: nothing is stored and every lookup misses.
+    """
+    def __init__(self, max_cost):
+        self.max_cost = max_cost
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.cost = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, cost = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = (value, cost)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, cost=1):
+        if cost > self.max_cost:
+            return
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = (value, cost)
+            self.cost += cost
+            while self.cost > self.max_cost:
+                _, (_, evicted_cost) = self.entries.popitem(last=False)
+                self.cost -= evicted_cost
+
+    def delete(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.cost = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'items': len(self.entries),
+            'cost': self.cost,
+            'max_cost': self.max_cost,
+        }
+
+    def _discard(self, key):
+        try:
+            _, cost = self.entries.pop(key)
+        except KeyError:
+            return
+        self.cost -= cost
+
+
+def get_image_cost(img):
+    """ approximate number of bytes a decoded PIL image holds """
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class DecodedImageCache(LRUCache):
+    """
+    LRU of decoded source images with a byte budget. Keys should identify a
+    source file version (e.g. path, mtime and file size). Sources may have
+    been decoded at a reduced scale (JPEG draft mode), so an entry is only a
+    hit if it is big enough for the requested geometry. Images are handed out
+    as copies because actions are free to modify the image they are given,
+    with the source's full size as their source_size attribute.
+    """
+    def get_image(self, key, width=None, height=None):
+        with self.lock:
+            try:
+                (source_size, img), cost = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = ((source_size, img), cost)
+
+            needed = get_decode_size(source_size, width, height) or source_size
+            if img.size[0] < needed[0] or img.size[1] < needed[1]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        copy = img.copy()
+        copy.source_size = source_size
+        return copy
+
+    def set_image(self, key, source_size, img):
+        self.set(key, (source_size, img), get_image_cost(img))
@@ -0,0 +1,63 @@
+"""
+Evict least recently used renditions until lt_cache fits in a byte budget,
+and/or report what the cache holds.
+
+    ./manage.py lazythumbs_gc                   # budget from LAZYTHUMBS_CACHE_BUDGET
+    ./manage.py lazythumbs_gc --budget 20G --pause 0.1
+    ./manage.py lazythumbs_gc --stats --dry-run
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lazythumbs.cache_manager import evict, get_stats, parse_size, scan, walk_renditions
+from lazythumbs.settings import CACHE_BUDGET
+from lazythumbs.views import LazyThumbRenderer
+
+
+class Command(BaseCommand):
+    help = 'Evict least recently used lazythumbs renditions to keep lt_cache within a byte budget.'
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--budget', dest='budget', default=CACHE_BUDGET,
+            help='bytes to keep, with an optional K, M, G or T suffix (default: LAZYTHUMBS_CACHE_BUDGET)'),
+        make_option('--stats', dest='stats', action='store_true', default=False,
+            help='report file count and bytes per action and geometry'),
+        make_option('--dry-run', dest='dry_run', action='store_true', default=False,
+            help="count what would be evicted without deleting anything"),
+        make_option('--batch-size', dest='batch_size', type='int', default=100,
+            help='deletions between pauses (default: 100)'),
+        make_option('--pause', dest='pause', type='float', default=0,
+            help='seconds to sleep after each batch of deletions (default: 0)'),
+    )
+
+    def handle(self, *args, **options):
+        budget = options['budget']
+        if budget is None and not options['stats']:
+            raise CommandError('give a --budget or set LAZYTHUMBS_CACHE_BUDGET')
+        if budget is not None:
+            try:
+                budget = parse_size(budget)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        renditions = scan(walk_renditions(LazyThumbRenderer().allowed_actions))
+        if options['stats']:
+            self.write_stats(renditions)
+
+        if budget is not None:
+            deleted, freed = evict(
+                renditions, budget, options['dry_run'], options['batch_size'], options['pause']
+            )
+            left = sum(r.size for r in renditions) - freed
+            if int(options.get('verbosity', 1)):
+                self.stdout.write('%d renditions %s, %.1f MB freed, %.1f MB in %d renditions left\n' % (
+                    deleted, 'would be evicted' if options['dry_run'] else 'evicted',
+                    freed / 1048576.0, left / 1048576.0, len(renditions) - deleted))
+
+    def write_stats(self, renditions):
+        stats = get_stats(renditions)
+        self.stdout.write('%-20s %-12s %10s %14s\n' % ('action', 'geometry', 'files', 'bytes'))
+        for (action, geometry), (count, size) in sorted(stats.items()):
+            self.stdout.write('%-20s %-12s %10d %14d\n' % (action, geometry, count, size))
+        self.stdout.write('%-20s %-12s %10d %14d\n' % (
+            'total', '', sum(c for c, _ in stats.values()), sum(s for _, s in stats.values())))
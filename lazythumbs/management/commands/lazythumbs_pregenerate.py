@@ -0,0 +1,165 @@
+"""
+Render lt_cache renditions ahead of time.
+
+    ./manage.py lazythumbs_pregenerate 'photos/*.jpg' -s resize:150x150 -s thumbnail:48:q60
+    find media/photos -name '*.jpg' -printf '%P\\n' | ./manage.py lazythumbs_pregenerate -f - -s aresize:640/360
+"""
+from glob import glob
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+import os
+import sys
+import time
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+from django.core.management.base import BaseCommand, CommandError
+
+from lazythumbs.settings import DEFAULT_QUALITY_FACTOR
+from lazythumbs.util import geometry_parse, get_format, get_rendered_path, get_sibling_path
+from lazythumbs.views import LazyThumbRenderer, NEGOTIABLE_FORMATS
+
+# one renderer per pool process, created on first use
+_renderer = None
+
+
+def parse_spec(spec, allowed_actions):
+    """
+    Turn an 'action:geometry[:quality]' string such as 'resize:150x150:q80'
+    into an (action, width, height, quality) tuple. quality is None when not
+    given so that the rendered path has no quality segment, just like urls
+    built without one.
+
+    :raises ValueError: for unknown actions or unparsable geometry/quality
+    """
+    bits = spec.split(':')
+    if len(bits) not in (2, 3):
+        raise ValueError('expected action:geometry[:quality], got %r' % spec)
+    action, geometry = bits[:2]
+    if action not in allowed_actions:
+        raise ValueError('unknown action %r' % action)
+    width, height = geometry_parse(action, geometry, ValueError('bad geometry %r' % geometry))
+
+    quality = None
+    if len(bits) == 3:
+        quality = int(bits[2].lstrip('q'))
+        if not 0 < quality <= 100:
+            raise ValueError('quality must be 0 < quality <= 100, got %r' % bits[2])
+    return action, width, height, quality
+
+
+def get_sources(patterns, source_file=None):
+    """
+    Collect source paths relative to MEDIA_ROOT from globs and/or a file
+    listing one path per line ('-' for stdin), skipping lt_cache.
+    """
+    sources = []
+    for pattern in patterns:
+        for path in sorted(glob(os.path.join(settings.MEDIA_ROOT, pattern))):
+            if os.path.isfile(path):
+                sources.append(os.path.relpath(path, settings.MEDIA_ROOT))
+
+    if source_file == '-':
+        sources.extend(line.strip() for line in sys.stdin if line.strip())
+    elif source_file:
+        with open(source_file) as lines:
+            sources.extend(line.strip() for line in lines if line.strip())
+
+    return [s for s in sources if not s.startswith('lt_cache/')]
+
+
+def render_one(task):
+    """
+    Pool worker: render a single (source, spec, force, format) task with the
+    same code LazyThumbRenderer.get uses on a cache miss. format is None for
+    the format of the url, or that of a negotiated sibling such as 'WEBP'.
+
+    :returns: (status, rendered_path, byte count) where status is one of
+        'rendered', 'skipped' or 'failed'
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = LazyThumbRenderer()
+
+    source_path, (action, width, height, quality), force, img_format = task
+    rendered_path = get_rendered_path(source_path, action, width, height, quality)
+    if img_format:
+        if get_format(rendered_path) not in NEGOTIABLE_FORMATS:
+            return 'skipped', rendered_path, 0
+        rendered_path = get_sibling_path(rendered_path, img_format)
+    try:
+        if _renderer.fs.exists(rendered_path):
+            if not force:
+                return 'skipped', rendered_path, 0
+            _renderer.fs.delete(rendered_path)
+        raw_data = _renderer.render(
+            action, width, height, source_path, rendered_path,
+            quality or DEFAULT_QUALITY_FACTOR
+        )
+    except (IOError, SuspiciousOperation, ValueError) as e:
+        return 'failed', '%s (%s)' % (rendered_path, e), 0
+    if raw_data is None:
+        return 'failed', rendered_path, 0
+    return 'rendered', rendered_path, len(raw_data)
+
+
+class Command(BaseCommand):
+    args = '[glob relative to MEDIA_ROOT ...]'
+    help = 'Render missing lt_cache renditions of many sources in parallel.'
+    option_list = BaseCommand.option_list + (
+        make_option('-f', '--file', dest='source_file',
+            help="read source paths relative to MEDIA_ROOT, one per line, from this file ('-' for stdin)"),
+        make_option('-s', '--spec', dest='specs', action='append', default=[],
+            help='action:geometry[:quality] to render, e.g. resize:150x150:q80. may be repeated'),
+        make_option('-p', '--processes', dest='processes', type='int', default=cpu_count(),
+            help='number of render processes (default: one per core)'),
+        make_option('--force', dest='force', action='store_true', default=False,
+            help='render again even if the rendition already exists'),
+        make_option('-F', '--format', dest='formats', action='append', default=[],
+            help='also render the sibling in this format that clients accepting it are served, e.g. WEBP. may be repeated'),
+    )
+
+    def handle(self, *patterns, **options):
+        if not options['specs']:
+            raise CommandError('at least one --spec is required')
+        allowed_actions = LazyThumbRenderer().allowed_actions
+        try:
+            specs = [parse_spec(s, allowed_actions) for s in options['specs']]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        sources = get_sources(patterns, options['source_file'])
+        if not sources:
+            raise CommandError('no sources given')
+
+        formats = [None] + [f.upper() for f in options.get('formats', [])]
+        tasks = [
+            (source, spec, options['force'], img_format)
+            for source in sources for spec in specs for img_format in formats
+        ]
+        counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+        written = 0
+        total = len(tasks)
+        verbosity = int(options.get('verbosity', 1))
+        started = time.time()
+
+        pool = Pool(options['processes'])
+        try:
+            for done, (status, rendered_path, nbytes) in enumerate(pool.imap_unordered(render_one, tasks, 8), 1):
+                counts[status] += 1
+                written += nbytes
+                if status == 'failed':
+                    self.stderr.write('failed: %s\n' % rendered_path)
+                elif verbosity > 1:
+                    self.stdout.write('%s: %s\n' % (status, rendered_path))
+                if verbosity and (done % 100 == 0 or done == total):
+                    elapsed = time.time() - started
+                    self.stdout.write('[%d/%d] %d rendered, %d skipped, %d failed, %.1f renders/s, %.1f MB written\n' % (
+                        done, total, counts['rendered'], counts['skipped'], counts['failed'],
+                        counts['rendered'] / elapsed if elapsed else 0, written / 1048576.0))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
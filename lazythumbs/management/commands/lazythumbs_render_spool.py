@@ -0,0 +1,45 @@
+"""
+Render jobs spooled by the asynchronous render mode (LAZYTHUMBS_ASYNC_RENDER).
+
+    ./manage.py lazythumbs_render_spool           # keep watching the spool
+    ./manage.py lazythumbs_render_spool --once    # drain it and exit
+"""
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+from lazythumbs import spool
+from lazythumbs.views import LazyThumbRenderer
+
+
+class Command(BaseCommand):
+    help = 'Render pending lazythumbs renditions from the render spool.'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', dest='once', action='store_true', default=False,
+            help='exit once the spool is empty instead of watching it'),
+        make_option('--interval', dest='interval', type='float', default=1.0,
+            help='seconds between looks at an empty spool (default: 1)'),
+        make_option('--reclaim-after', dest='reclaim_after', type='int', default=600,
+            help='put back jobs claimed longer than this many seconds ago by a worker that died (default: 600)'),
+    )
+
+    def handle(self, *args, **options):
+        renderer = LazyThumbRenderer()
+        verbosity = int(options.get('verbosity', 1))
+        rendered = failed = 0
+        while True:
+            spool.reclaim(options['reclaim_after'])
+            names = spool.pending()
+            for name in names:
+                if spool.run(renderer, name):
+                    rendered += 1
+                else:
+                    failed += 1
+            if not names:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        if verbosity:
+            self.stdout.write('%d rendered, %d failed or claimed elsewhere\n' % (rendered, failed))
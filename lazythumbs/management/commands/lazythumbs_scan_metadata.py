@@ -0,0 +1,56 @@
+"""
+Fill the source metadata index by reading image headers.
+
+    ./manage.py lazythumbs_scan_metadata              # everything under MEDIA_ROOT
+    ./manage.py lazythumbs_scan_metadata 'photos/*.jpg'
+"""
+from optparse import make_option
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from lazythumbs.management.commands.lazythumbs_pregenerate import get_sources
+from lazythumbs.metadata import metadata_index
+
+
+def walk_media_root():
+    """ every file under MEDIA_ROOT except renditions, relative to MEDIA_ROOT """
+    for root, dirs, files in os.walk(settings.MEDIA_ROOT):
+        if root == settings.MEDIA_ROOT.rstrip(os.sep) and 'lt_cache' in dirs:
+            dirs.remove('lt_cache')
+        for name in files:
+            yield os.path.relpath(os.path.join(root, name), settings.MEDIA_ROOT)
+
+
+class Command(BaseCommand):
+    args = '[glob relative to MEDIA_ROOT ...]'
+    help = 'Record dimensions, format, mode and mtime of source images in the lazythumbs metadata index.'
+    option_list = BaseCommand.option_list + (
+        make_option('-f', '--file', dest='source_file',
+            help="read source paths relative to MEDIA_ROOT, one per line, from this file ('-' for stdin)"),
+    )
+
+    def handle(self, *patterns, **options):
+        source_file = options.get('source_file')
+        if patterns or source_file:
+            sources = get_sources(patterns, source_file)
+        else:
+            sources = walk_media_root()
+
+        indexed = skipped = 0
+        for source_path in sources:
+            path = os.path.join(settings.MEDIA_ROOT, source_path)
+            try:
+                mtime = os.stat(path).st_mtime
+                # only reads the header
+                img = Image.open(path)
+            except (IOError, OSError):
+                skipped += 1
+                continue
+            metadata_index.record(source_path, img, mtime)
+            indexed += 1
+
+        if int(options.get('verbosity', 1)):
+            self.stdout.write('%d sources indexed, %d skipped\n' % (indexed, skipped))
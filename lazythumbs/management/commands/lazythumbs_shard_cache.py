@@ -0,0 +1,59 @@
+"""
+Move renditions stored at their url path into the sharded layout configured
+with LAZYTHUMBS_CACHE_SHARD_DEPTH. Renditions still in the old layout keep
+being served while this runs.
+
+    ./manage.py lazythumbs_shard_cache
+    ./manage.py lazythumbs_shard_cache --dry-run
+"""
+from optparse import make_option
+import errno
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lazythumbs.cache_manager import remove_empty_dirs, walk_renditions
+from lazythumbs.settings import CACHE_SHARD_DEPTH
+from lazythumbs.util import get_storage_path
+from lazythumbs.views import LazyThumbRenderer
+
+
+class Command(BaseCommand):
+    help = 'Move lazythumbs renditions stored at their url path into the sharded cache layout.'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', dest='dry_run', action='store_true', default=False,
+            help="list what would be moved without moving anything"),
+    )
+
+    def handle(self, *args, **options):
+        if not CACHE_SHARD_DEPTH:
+            raise CommandError('set LAZYTHUMBS_CACHE_SHARD_DEPTH to pick the sharded layout first')
+        verbosity = int(options.get('verbosity', 1))
+        media_root = settings.MEDIA_ROOT.rstrip(os.sep)
+
+        moved = replaced = 0
+        actions = LazyThumbRenderer().allowed_actions
+        for rel_path in list(walk_renditions(actions, sharded=False)):
+            src = os.path.join(media_root, rel_path)
+            dest = os.path.join(media_root, get_storage_path(rel_path))
+            if verbosity > 1 or options['dry_run']:
+                self.stdout.write('%s -> %s\n' % (rel_path, get_storage_path(rel_path)))
+            if options['dry_run']:
+                continue
+            if os.path.exists(dest):
+                # rendered again in the new layout already
+                os.unlink(src)
+                replaced += 1
+            else:
+                try:
+                    os.makedirs(os.path.dirname(dest))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                os.rename(src, dest)
+                moved += 1
+            remove_empty_dirs(os.path.dirname(src), media_root)
+
+        if verbosity:
+            self.stdout.write('%d renditions moved, %d already in the sharded layout\n' % (moved, replaced))
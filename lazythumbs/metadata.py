@@ -0,0 +1,124 @@
+"""
+Persistent index of source image metadata (dimensions, format, mode and
+mtime) kept in a SQLite file, so url computation can know a source's size
+without touching the image. Filled in whenever a source is rendered and by
+the lazythumbs_scan_metadata management command.
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+
+from lazythumbs.settings import METADATA_DB
+
+logger = logging.getLogger('lazythumbs')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    format TEXT,
+    mode TEXT,
+    mtime REAL NOT NULL
+)
+'''
+
+FIELDS = ('path', 'width', 'height', 'format', 'mode', 'mtime')
+
+
+class SourceMetadataIndex(object):
+    """
+    SQLite backed mapping of source paths (relative to MEDIA_ROOT) to their
+    metadata. Connections are opened lazily, one per thread and process.
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.local = threading.local()
+
+    def get_db_path(self):
+        if self.db_path or METADATA_DB:
+            return self.db_path or METADATA_DB
+        media_root = settings.MEDIA_ROOT.rstrip(os.sep)
+        return os.path.join(os.path.dirname(media_root), 'lazythumbs_metadata.sqlite3')
+
+    def connect(self):
+        # connections must not be shared with forked children
+        if getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.get_db_path(), timeout=5)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.DatabaseError:
+                pass
+            conn.execute(SCHEMA)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def get(self, source_path):
+        """
+        :returns: a dict of the source's metadata, or None if not indexed
+        """
+        try:
+            row = self.connect().execute(
+                'SELECT %s FROM sources WHERE path = ?' % ', '.join(FIELDS), (source_path,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning('unable to read source metadata for %s: %s', source_path, e)
+            return None
+        if row is None:
+            return None
+        return dict(zip(FIELDS, row))
+
+    def get_current(self, source_path):
+        """
+        :returns: a dict of the source's metadata, or None if it isn't
+            indexed at the mtime the source has now, e.g. since it was
+            replaced
+        """
+        try:
+            mtime = os.stat(os.path.join(settings.MEDIA_ROOT, source_path)).st_mtime
+        except OSError:
+            return None
+        metadata = self.get(source_path)
+        if metadata is None or metadata['mtime'] != mtime:
+            return None
+        return metadata
+
+    def set(self, source_path, width, height, img_format, mode, mtime):
+        try:
+            conn = self.connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO sources (%s) VALUES (?, ?, ?, ?, ?, ?)' % ', '.join(FIELDS),
+                    (source_path, width, height, img_format, mode, mtime)
+                )
+        except sqlite3.Error as e:
+            logger.warning('unable to write source metadata for %s: %s', source_path, e)
+
+    def delete(self, source_path):
+        try:
+            conn = self.connect()
+            with conn:
+                conn.execute('DELETE FROM sources WHERE path = ?', (source_path,))
+        except sqlite3.Error as e:
+            logger.warning('unable to delete source metadata for %s: %s', source_path, e)
+
+    def record(self, source_path, img, mtime):
+        """
+        Index a freshly opened (not yet drafted) PIL image, skipping the
+        write when nothing changed.
+        """
+        width, height = img.size
+        current = self.get(source_path)
+        if current and (
+            (current['width'], current['height'], current['format'], current['mode'], current['mtime'])
+            == (width, height, img.format, img.mode, mtime)
+        ):
+            return
+        self.set(source_path, width, height, img.format, img.mode, mtime)
+
+
+metadata_index = SourceMetadataIndex()
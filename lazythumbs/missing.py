@@ -0,0 +1,58 @@
+"""
+Negative cache of missing source images.
+
+A missing source is recorded once, in the Django cache under a key for the
+source alone, so requests for any geometry, action or quality of a dead image
+are answered without touching the filesystem. The view also remembers missing
+sources in a small in-process LRU so repeated misses don't reach the cache
+backend either. Local entries live at most LAZYTHUMBS_MISSING_SOURCE_LOCAL_TTL
+seconds, which bounds how long other processes keep answering 404 after
+forget().
+"""
+from hashlib import md5
+import time
+
+from django.core.cache import cache
+
+from lazythumbs.lru import LRUCache
+from lazythumbs.settings import MISSING_SOURCE_CACHE_SIZE, MISSING_SOURCE_LOCAL_TTL
+
+
+def get_cache_key(source_path):
+    return 'lazythumbs:missing:{0}'.format(md5(source_path.encode('utf-8')).hexdigest())
+
+
+class MissingSourceCache(LRUCache):
+    """
+    LRU of up to max_cost missing source paths, each remembered for ttl
+    seconds.
+    """
+    def __init__(self, max_cost, ttl):
+        super(MissingSourceCache, self).__init__(max_cost)
+        self.ttl = ttl
+
+    def is_missing(self, source_path):
+        expires = self.get(source_path)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            self.delete(source_path)
+            return False
+        return True
+
+    def add(self, source_path, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        self.set(source_path, time.time() + min(ttl, self.ttl))
+
+
+missing_sources = MissingSourceCache(MISSING_SOURCE_CACHE_SIZE, MISSING_SOURCE_LOCAL_TTL)
+
+
+def forget(source_path):
+    """
+    Stop answering 404 for a source, e.g. right after it has been uploaded.
+    Other processes notice within LAZYTHUMBS_MISSING_SOURCE_LOCAL_TTL seconds.
+    """
+    cache.delete(get_cache_key(source_path))
+    missing_sources.delete(source_path)
@@ -0,0 +1,166 @@
+"""
+Per-source index of rendered variants, used to render new renditions from an
+existing, smaller-than-the-source rendition instead of decoding the original.
+
+A rendition can stand in for the source when scaling it gives the same
+picture the source would:
+
+* a thumbnail is the whole source scaled down, so any action can use it as
+  long as it is at least as big as the decode the action would need
+  (see get_decode_size)
+* a rendition of the same action with the same aspect ratio can be scaled
+  down to a smaller one, as long as the source was big enough that the
+  parent came out at exactly its requested size
+
+Only renditions rendered from the source itself and stored lossless or at a
+high enough quality are used, so generation loss stays bounded.
+"""
+from hashlib import md5
+import errno
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+
+from lazythumbs.locks import render_lock
+from lazythumbs.settings import DERIVE_MIN_QUALITY, RENDITION_INDEX_DIR
+from lazythumbs.util import get_decode_size
+
+logger = logging.getLogger('lazythumbs')
+
+LOSSLESS_FORMATS = ('PNG',)
+
+# actions whose output scales down to a smaller rendition of the same action
+# when the aspect ratio is the same
+SCALABLE_ACTIONS = ('resize', 'mresize', 'aresize', 'aresize_no_crop', 'matte', 'scale')
+
+
+def can_derive(entry, action, width, height, source_size, min_quality=None):
+    """
+    Check whether the rendition described by index entry can be used in place
+    of the source to render action at width x height.
+
+    :param entry: a rendition index entry
+    :param source_size: (width, height) of the source image
+    """
+    if min_quality is None:
+        min_quality = DERIVE_MIN_QUALITY
+    if entry['derived']:
+        return False
+    if entry['format'] not in LOSSLESS_FORMATS and entry['quality'] < min_quality:
+        return False
+
+    parent_width, parent_height = entry['size']
+    if entry['action'] == 'thumbnail':
+        needed = get_decode_size(source_size, width, height) or source_size
+        return parent_width >= needed[0] and parent_height >= needed[1]
+
+    if entry['action'] != action or action not in SCALABLE_ACTIONS:
+        return False
+    if not (width and height):
+        return False
+    return (
+        (parent_width, parent_height) == (entry['width'], entry['height'])
+        and parent_width * height == parent_height * width
+        and parent_width >= width and parent_height >= height
+        and source_size[0] >= parent_width and source_size[1] >= parent_height
+    )
+
+
+def find_parent(entries, action, width, height, source_size, min_quality=None):
+    """
+    :returns: the smallest entry that can be derived from, or None
+    """
+    candidates = [
+        e for e in entries
+        if can_derive(e, action, width, height, source_size, min_quality)
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda e: e['size'][0] * e['size'][1])
+
+
+def find_variant(entries, action, width, height):
+    """
+    Pick the rendition that best stands in, as it is, for action at width x
+    height: one of the same action if there is any, the smallest of them at
+    least as big, or else the biggest.
+
+    :returns: an entry, or None if there are none
+    """
+    def distance(entry):
+        entry_width, entry_height = entry['size']
+        covers = entry_width >= (width or 0) and entry_height >= (height or 0)
+        area = entry_width * entry_height
+        return (entry['action'] != action, not covers, area if covers else -area)
+
+    if not entries:
+        return None
+    return min(entries, key=distance)
+
+
+class RenditionIndex(object):
+    """
+    Renditions of each source, stored as a small JSON file per source under
+    LAZYTHUMBS_RENDITION_INDEX_DIR (MEDIA_ROOT/lt_cache/.index by default).
+    An index is thrown away when its source's mtime changes.
+    """
+    def get_dir(self):
+        return RENDITION_INDEX_DIR or os.path.join(settings.MEDIA_ROOT, 'lt_cache', '.index')
+
+    def get_path(self, source_path):
+        return os.path.join(self.get_dir(), '%s.json' % md5(source_path).hexdigest())
+
+    def load(self, source_path, source_mtime):
+        """
+        :returns: a dict of rendered path to entry for a source
+        """
+        try:
+            with open(self.get_path(source_path)) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if index.get('mtime') != source_mtime:
+            return {}
+        return index['renditions']
+
+    def entries(self, source_path, source_mtime):
+        return self.load(source_path, source_mtime).values()
+
+    def add(self, source_path, source_mtime, entry):
+        self._update(source_path, source_mtime, lambda r: r.__setitem__(entry['path'], entry))
+
+    def remove(self, source_path, source_mtime, rendered_path):
+        self._update(source_path, source_mtime, lambda r: r.pop(rendered_path, None))
+
+    def _update(self, source_path, source_mtime, change):
+        path = self.get_path(source_path)
+        with render_lock(path):
+            renditions = self.load(source_path, source_mtime)
+            change(renditions)
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            # write to a temporary file and rename it into place so that
+            # readers never see a partially written index
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'mtime': source_mtime, 'renditions': renditions}, f)
+            os.rename(tmp_path, path)
+
+
+def make_entry(rendered_path, action, width, height, size, quality, img_format, derived):
+    return {
+        'path': rendered_path,
+        'action': action,
+        'width': width,
+        'height': height,
+        'size': list(size),
+        'quality': quality,
+        'format': img_format,
+        'derived': derived,
+    }
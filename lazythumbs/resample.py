@@ -0,0 +1,181 @@
+"""
+Resampling policy for the actions' resizes.
+
+A tier trades quality for speed. Past a certain reduction ratio the 'balanced'
+and 'fast' tiers first shrink the image by integer factors, averaging boxes of
+pixels (Image.reduce where Pillow has it, a BOX resize otherwise), and then
+run the final filter on the much smaller intermediate; the 'quality' tier
+always runs the final filter on the full-size image, as lazythumbs always did.
+
+    tier        pre-shrink to at least   final filter
+    quality     -                        ANTIALIAS
+    balanced    3x the output            ANTIALIAS
+    fast        2x the output            BILINEAR
+
+LAZYTHUMBS_RESAMPLE_TIER sets the tier, LAZYTHUMBS_RESAMPLE_ACTION_TIERS
+overrides it per action, e.g. {'matte': 'fast'}.
+
+Resizes of sources of at least LAZYTHUMBS_TILED_RESIZE_PIXELS pixels are
+spread over a pool of threads (Pillow releases the GIL while resampling).
+Pillow resizes in two passes, first horizontally, rounding the result, then
+vertically; the tiled path runs the very same passes, the horizontal one on
+bands of source rows and the vertical one on strips of columns. Neither
+pass's coefficients depend on the rows or columns being worked on, so the
+result is pixel identical to a single resize.
+"""
+from multiprocessing.pool import ThreadPool
+import math
+import multiprocessing
+import threading
+
+from PIL import Image
+
+from lazythumbs.settings import RESAMPLE_TIER, RESAMPLE_ACTION_TIERS
+from lazythumbs.settings import TILED_RESIZE_PIXELS, TILED_RESIZE_THREADS
+
+# tier: (minimum ratio of the pre-shrunk to the output size or None, final filter)
+TIERS = {
+    'quality': (None, Image.ANTIALIAS),
+    'balanced': (3.0, Image.ANTIALIAS),
+    'fast': (2.0, Image.BILINEAR),
+}
+
+# the widest support of Pillow's filters, LANCZOS's, in source pixels at 1:1
+MAX_SUPPORT = 3.0
+
+
+def get_tier(action=None):
+    tier = RESAMPLE_ACTION_TIERS.get(action, RESAMPLE_TIER)
+    if tier not in TIERS:
+        raise ValueError('unknown resampling tier %r' % tier)
+    return tier
+
+
+def get_reduce_factors(source_size, size, gap):
+    """
+    :returns: the integer factors (x, y) to pre-shrink source_size by so that
+        the result is still at least gap times size
+    """
+    return tuple(
+        max(1, int(source / (target * gap)))
+        for source, target in zip(source_size, size)
+    )
+
+
+def reduce(img, factors, box=None):
+    """
+    Shrink img, or the box of it, by integer factors, averaging each box of
+    pixels.
+    """
+    if box is None:
+        box = (0, 0) + img.size
+    if hasattr(img, 'reduce') and all(int(c) == c for c in box):
+        return img.reduce(factors, tuple(int(c) for c in box))
+    size = (
+        int(math.ceil(float(box[2] - box[0]) / factors[0])),
+        int(math.ceil(float(box[3] - box[1]) / factors[1])),
+    )
+    return resize(img, size, Image.BOX, box)
+
+
+def resample(img, size, tier=None, box=None):
+    """
+    Resize img, or the (left, top, right, bottom) box of it, to size
+    according to tier.
+
+    :param tier: a key of TIERS, LAZYTHUMBS_RESAMPLE_TIER if None
+    :returns: a new PIL Image
+    """
+    gap, resample_filter = TIERS[tier or get_tier()]
+    # PIL resizes '1' and 'P' images with NEAREST regardless of the filter
+    if gap and img.mode not in ('1', 'P'):
+        if box is None:
+            box = (0, 0) + img.size
+        factors = get_reduce_factors((box[2] - box[0], box[3] - box[1]), size, gap)
+        if factors != (1, 1):
+            img = reduce(img, factors, box)
+            box = None
+    return resize(img, size, resample_filter, box)
+
+
+def split(start, end, count):
+    """ [start, end) in up to count (first, end) ranges of about the same size """
+    step = max(1, int(math.ceil(float(end - start) / count)))
+    return [(a, min(a + step, end)) for a in range(start, end, step)]
+
+
+_pool = []
+_pool_lock = threading.Lock()
+
+
+def get_thread_count():
+    return TILED_RESIZE_THREADS or multiprocessing.cpu_count()
+
+
+def get_pool():
+    """ the thread pool for tiled resizes, started on first use """
+    with _pool_lock:
+        if not _pool:
+            _pool.append(ThreadPool(get_thread_count()))
+    return _pool[0]
+
+
+def resize(img, size, resample_filter, box=None):
+    """
+    img.resize(size, resample_filter, box), on the thread pool if the source
+    box has at least LAZYTHUMBS_TILED_RESIZE_PIXELS pixels.
+    """
+    if box is None:
+        box = (0, 0) + img.size
+    width, height = size
+    left, top, right, bottom = box
+    if (not TILED_RESIZE_PIXELS
+            or (right - left) * (bottom - top) < TILED_RESIZE_PIXELS
+            or width == right - left or height == bottom - top
+            or resample_filter == Image.NEAREST
+            or img.mode in ('1', 'P')):
+        return img.resize(size, resample_filter, box)
+
+    mode = img.mode
+    if mode in ('LA', 'RGBA'):
+        # what Image.resize does for these, once instead of per piece
+        img = img.convert(mode[:-1] + 'a')
+    img.load()
+    source_width, source_height = img.size
+    count = get_thread_count()
+    pool = get_pool()
+
+    # the horizontal pass, in bands of the source rows the vertical pass reads
+    support = MAX_SUPPORT * max(1.0, float(bottom - top) / height) + 1
+    rows = split(
+        max(0, int(math.floor(top - support))),
+        min(source_height, int(math.ceil(bottom + support))),
+        count
+    )
+
+    def horizontal(rows):
+        a, b = rows
+        band = img.crop((0, a, source_width, b))
+        return band.resize((width, b - a), resample_filter, (left, 0, right, b - a))
+
+    bands = pool.map(horizontal, rows)
+    intermediate = Image.new(img.mode, (width, source_height))
+    for (a, b), band in zip(rows, bands):
+        intermediate.paste(band, (0, a))
+
+    # the vertical pass, in strips of columns
+    columns = split(0, width, count)
+
+    def vertical(columns):
+        a, b = columns
+        strip = intermediate.crop((a, 0, b, source_height))
+        return strip.resize((b - a, height), resample_filter, (0, top, b - a, bottom))
+
+    strips = pool.map(vertical, columns)
+    result = Image.new(img.mode, size)
+    for (a, b), strip in zip(columns, strips):
+        result.paste(strip, (a, 0))
+
+    if result.mode != mode:
+        result = result.convert(mode)
+    return result
@@ -11,7 +11,188 @@ except ImportError:
 fallback_quality_factor = 80
 fallback_optimize_flag = True
 fallback_progressive_flag = True
+fallback_draft_decode = True
+fallback_render_lock = True
+fallback_render_lock_timeout = 30
+fallback_render_lock_dir = None
+fallback_source_cache_bytes = 0
+fallback_serve_mode = 'memory'
+fallback_stream_chunk_size = 64 * 1024
+fallback_x_accel_redirect_prefix = '/lazythumbs-internal/'
+fallback_stale_while_revalidate = None
+fallback_stale_if_error = None
+fallback_derive_renditions = False
+fallback_derive_min_quality = 90
+fallback_rendition_index_dir = None
+fallback_metadata_index = False
+fallback_metadata_db = None
+fallback_async_render = False
+fallback_async_render_fallback = 'redirect'
+fallback_async_retry_after = 2
+fallback_async_render_workers = 2
+fallback_render_spool_dir = None
+fallback_missing_source_cache_size = 10000
+fallback_missing_source_local_ttl = 60
+fallback_cache_shard_depth = 0
+fallback_cache_shard_width = 2
+fallback_cache_budget = None
+fallback_access_time_resolution = 3600
+fallback_negotiate_formats = ()
+fallback_encoder_profiles = {}
+fallback_resample_tier = 'quality'
+fallback_resample_action_tiers = {}
+fallback_tiled_resize_pixels = 0
+fallback_tiled_resize_threads = None
+fallback_max_renders = None
+fallback_max_host_renders = None
+fallback_render_queue_size = 16
+fallback_render_queue_timeout = 5
+fallback_render_reject_fallback = 'unavailable'
+fallback_render_reject_retry_after = 2
+fallback_admission_dir = None
+fallback_render_deadline = None
+fallback_render_deadline_fallback = 'redirect'
+fallback_render_deadline_retry_after = 30
+fallback_slow_source_log = None
+fallback_render_threads = 0
+fallback_render_processes = 0
+fallback_render_process_max_tasks = 200
+fallback_render_process_timeout = 60
 
 DEFAULT_QUALITY_FACTOR = getattr(settings, 'LAZYTHUMBS_QUALITY_FACTOR', fallback_quality_factor)
 DEFAULT_OPTIMIZE_FLAG = getattr(settings, 'LAZYTHUMBS_OPTIMIZE_FLAG', fallback_optimize_flag)
 DEFAULT_PROGRESSIVE_FLAG = getattr(settings, 'LAZYTHUMBS_PROGRESSIVE_FLAG', fallback_progressive_flag)
+
+# NOTE: Let libjpeg decode large JPEG sources at 1/2, 1/4 or 1/8 scale when the
+#       requested geometry is small enough.
+DRAFT_DECODE = getattr(settings, 'LAZYTHUMBS_DRAFT_DECODE', fallback_draft_decode)
+
+# NOTE: Coalesce concurrent renders of the same rendition so only one worker does
+#       the work. Lock files live in LAZYTHUMBS_RENDER_LOCK_DIR, which defaults to
+#       MEDIA_ROOT/lt_cache/.locks.
+RENDER_LOCK = getattr(settings, 'LAZYTHUMBS_RENDER_LOCK', fallback_render_lock)
+RENDER_LOCK_TIMEOUT = getattr(settings, 'LAZYTHUMBS_RENDER_LOCK_TIMEOUT', fallback_render_lock_timeout)
+RENDER_LOCK_DIR = getattr(settings, 'LAZYTHUMBS_RENDER_LOCK_DIR', fallback_render_lock_dir)
+
+# NOTE: Byte budget for the in-process LRU of decoded source images. 0 disables it.
+SOURCE_CACHE_BYTES = getattr(settings, 'LAZYTHUMBS_SOURCE_CACHE_BYTES', fallback_source_cache_bytes)
+
+# NOTE: How already rendered images are sent: 'memory', 'stream', 'x-accel-redirect'
+#       (nginx, files served from an internal location aliased to MEDIA_ROOT) or
+#       'x-sendfile' (Apache/lighttpd).
+SERVE_MODE = getattr(settings, 'LAZYTHUMBS_SERVE_MODE', fallback_serve_mode)
+STREAM_CHUNK_SIZE = getattr(settings, 'LAZYTHUMBS_STREAM_CHUNK_SIZE', fallback_stream_chunk_size)
+X_ACCEL_REDIRECT_PREFIX = getattr(settings, 'LAZYTHUMBS_X_ACCEL_REDIRECT_PREFIX', fallback_x_accel_redirect_prefix)
+
+# NOTE: Seconds for the stale-while-revalidate and stale-if-error Cache-Control
+#       extensions. None leaves the directive out.
+STALE_WHILE_REVALIDATE = getattr(settings, 'LAZYTHUMBS_STALE_WHILE_REVALIDATE', fallback_stale_while_revalidate)
+STALE_IF_ERROR = getattr(settings, 'LAZYTHUMBS_STALE_IF_ERROR', fallback_stale_if_error)
+
+# NOTE: Render new renditions from a larger existing rendition of the same source
+#       when that gives the same picture. Only renditions saved lossless or with at
+#       least LAZYTHUMBS_DERIVE_MIN_QUALITY are used. The per-source index of
+#       renditions lives in LAZYTHUMBS_RENDITION_INDEX_DIR, which defaults to
+#       MEDIA_ROOT/lt_cache/.index.
+DERIVE_RENDITIONS = getattr(settings, 'LAZYTHUMBS_DERIVE_RENDITIONS', fallback_derive_renditions)
+DERIVE_MIN_QUALITY = getattr(settings, 'LAZYTHUMBS_DERIVE_MIN_QUALITY', fallback_derive_min_quality)
+RENDITION_INDEX_DIR = getattr(settings, 'LAZYTHUMBS_RENDITION_INDEX_DIR', fallback_rendition_index_dir)
+
+# NOTE: Keep source dimensions, format, mode and mtime in a SQLite file so urls can
+#       be computed for plain paths without touching images. The file defaults to
+#       lazythumbs_metadata.sqlite3 next to MEDIA_ROOT.
+METADATA_INDEX = getattr(settings, 'LAZYTHUMBS_METADATA_INDEX', fallback_metadata_index)
+METADATA_DB = getattr(settings, 'LAZYTHUMBS_METADATA_DB', fallback_metadata_db)
+
+# NOTE: Render missing renditions in the background and answer right away with a
+#       fallback: 'redirect' to the original, a 'placeholder' GIF or 'accepted' (202).
+#       Pending renders are spooled in LAZYTHUMBS_RENDER_SPOOL_DIR, which defaults to
+#       MEDIA_ROOT/lt_cache/.spool, and rendered by LAZYTHUMBS_ASYNC_RENDER_WORKERS
+#       threads per process and/or the lazythumbs_render_spool command.
+ASYNC_RENDER = getattr(settings, 'LAZYTHUMBS_ASYNC_RENDER', fallback_async_render)
+ASYNC_RENDER_FALLBACK = getattr(settings, 'LAZYTHUMBS_ASYNC_RENDER_FALLBACK', fallback_async_render_fallback)
+ASYNC_RETRY_AFTER = getattr(settings, 'LAZYTHUMBS_ASYNC_RETRY_AFTER', fallback_async_retry_after)
+ASYNC_RENDER_WORKERS = getattr(settings, 'LAZYTHUMBS_ASYNC_RENDER_WORKERS', fallback_async_render_workers)
+RENDER_SPOOL_DIR = getattr(settings, 'LAZYTHUMBS_RENDER_SPOOL_DIR', fallback_render_spool_dir)
+
+# NOTE: Missing sources are remembered per source path in the Django cache for
+#       LAZYTHUMBS_404_CACHE_TIMEOUT seconds, fronted by an in-process LRU of this
+#       many paths whose entries live at most LAZYTHUMBS_MISSING_SOURCE_LOCAL_TTL
+#       seconds.
+MISSING_SOURCE_CACHE_SIZE = getattr(settings, 'LAZYTHUMBS_MISSING_SOURCE_CACHE_SIZE', fallback_missing_source_cache_size)
+MISSING_SOURCE_LOCAL_TTL = getattr(settings, 'LAZYTHUMBS_MISSING_SOURCE_LOCAL_TTL', fallback_missing_source_local_ttl)
+
+# NOTE: Store renditions at lt_cache/<shard>/.../<hash>.<ext>, with this many levels
+#       of LAZYTHUMBS_CACHE_SHARD_WIDTH hex characters each, instead of at their url
+#       path. 0 keeps the url path.
+CACHE_SHARD_DEPTH = getattr(settings, 'LAZYTHUMBS_CACHE_SHARD_DEPTH', fallback_cache_shard_depth)
+CACHE_SHARD_WIDTH = getattr(settings, 'LAZYTHUMBS_CACHE_SHARD_WIDTH', fallback_cache_shard_width)
+
+# NOTE: Byte budget lazythumbs_gc keeps lt_cache within, e.g. '20G'. Served renditions
+#       have their atime bumped at most once per LAZYTHUMBS_ACCESS_TIME_RESOLUTION
+#       seconds so that the least recently used can be evicted first; None disables it,
+#       and is the default unless there is a budget.
+CACHE_BUDGET = getattr(settings, 'LAZYTHUMBS_CACHE_BUDGET', fallback_cache_budget)
+ACCESS_TIME_RESOLUTION = getattr(
+    settings, 'LAZYTHUMBS_ACCESS_TIME_RESOLUTION', fallback_access_time_resolution if CACHE_BUDGET else None
+)
+
+# NOTE: PIL formats, in order of preference, to serve JPEG renditions in to clients
+#       whose Accept header names them, e.g. ('AVIF', 'WEBP'). Formats the local
+#       Pillow can't encode are ignored.
+NEGOTIATE_FORMATS = getattr(settings, 'LAZYTHUMBS_NEGOTIATE_FORMATS', fallback_negotiate_formats)
+
+# NOTE: Save options per output format and rendition size, see lazythumbs.encoding.
+#       Formats without a profile use LAZYTHUMBS_OPTIMIZE_FLAG and
+#       LAZYTHUMBS_PROGRESSIVE_FLAG.
+ENCODER_PROFILES = getattr(settings, 'LAZYTHUMBS_ENCODER_PROFILES', fallback_encoder_profiles)
+
+# NOTE: How hard the actions work at resizing: 'quality', 'balanced' or 'fast', and
+#       overrides per action name. See lazythumbs.resample.
+RESAMPLE_TIER = getattr(settings, 'LAZYTHUMBS_RESAMPLE_TIER', fallback_resample_tier)
+RESAMPLE_ACTION_TIERS = getattr(settings, 'LAZYTHUMBS_RESAMPLE_ACTION_TIERS', fallback_resample_action_tiers)
+
+# NOTE: Resize sources of at least this many pixels in bands on a pool of this many
+#       threads (None for one per CPU). 0 resizes in one piece.
+TILED_RESIZE_PIXELS = getattr(settings, 'LAZYTHUMBS_TILED_RESIZE_PIXELS', fallback_tiled_resize_pixels)
+TILED_RESIZE_THREADS = getattr(settings, 'LAZYTHUMBS_TILED_RESIZE_THREADS', fallback_tiled_resize_threads)
+
+# NOTE: Renders the view runs at once per process and per host (None for no limit),
+#       how many more may wait and for how many seconds, and the response to those
+#       that can't: 'unavailable' (503), 'redirect' or 'placeholder', with a
+#       Retry-After of LAZYTHUMBS_RENDER_REJECT_RETRY_AFTER seconds. Host slots are
+#       lock files in LAZYTHUMBS_ADMISSION_DIR, a directory local to the host, by
+#       default lazythumbs-admission in the system's temporary directory.
+MAX_RENDERS = getattr(settings, 'LAZYTHUMBS_MAX_RENDERS', fallback_max_renders)
+MAX_HOST_RENDERS = getattr(settings, 'LAZYTHUMBS_MAX_HOST_RENDERS', fallback_max_host_renders)
+RENDER_QUEUE_SIZE = getattr(settings, 'LAZYTHUMBS_RENDER_QUEUE_SIZE', fallback_render_queue_size)
+RENDER_QUEUE_TIMEOUT = getattr(settings, 'LAZYTHUMBS_RENDER_QUEUE_TIMEOUT', fallback_render_queue_timeout)
+RENDER_REJECT_FALLBACK = getattr(settings, 'LAZYTHUMBS_RENDER_REJECT_FALLBACK', fallback_render_reject_fallback)
+RENDER_REJECT_RETRY_AFTER = getattr(settings, 'LAZYTHUMBS_RENDER_REJECT_RETRY_AFTER', fallback_render_reject_retry_after)
+ADMISSION_DIR = getattr(settings, 'LAZYTHUMBS_ADMISSION_DIR', fallback_admission_dir)
+
+# NOTE: Seconds a request waits for its render, None to wait as long as it takes.
+#       Renders that take longer go on in the background and are spooled for
+#       lazythumbs_render_spool in case they don't finish; the request is answered
+#       with LAZYTHUMBS_RENDER_DEADLINE_FALLBACK: 'variant' (the nearest existing
+#       rendition of the source), 'redirect', 'placeholder', 'unavailable' or
+#       'accepted'. Sources that blow the budget are appended to
+#       LAZYTHUMBS_SLOW_SOURCE_LOG, by default MEDIA_ROOT/lt_cache/.slow_sources.
+RENDER_DEADLINE = getattr(settings, 'LAZYTHUMBS_RENDER_DEADLINE', fallback_render_deadline)
+RENDER_DEADLINE_FALLBACK = getattr(settings, 'LAZYTHUMBS_RENDER_DEADLINE_FALLBACK', fallback_render_deadline_fallback)
+RENDER_DEADLINE_RETRY_AFTER = getattr(settings, 'LAZYTHUMBS_RENDER_DEADLINE_RETRY_AFTER', fallback_render_deadline_retry_after)
+SLOW_SOURCE_LOG = getattr(settings, 'LAZYTHUMBS_SLOW_SOURCE_LOG', fallback_slow_source_log)
+
+# NOTE: Run the renders of requests on a pool of this many threads, sharing each
+#       render among concurrent requests for its rendition. 0 renders in the
+#       request's thread.
+RENDER_THREADS = getattr(settings, 'LAZYTHUMBS_RENDER_THREADS', fallback_render_threads)
+
+# NOTE: Run the renders of requests in a pool of this many forked render processes
+#       instead of the web worker's threads. 0 renders in the request's thread. Each
+#       process is replaced after LAZYTHUMBS_RENDER_PROCESS_MAX_TASKS renders (None
+#       for never), and killed if a render takes more than
+#       LAZYTHUMBS_RENDER_PROCESS_TIMEOUT seconds.
+RENDER_PROCESSES = getattr(settings, 'LAZYTHUMBS_RENDER_PROCESSES', fallback_render_processes)
+RENDER_PROCESS_MAX_TASKS = getattr(settings, 'LAZYTHUMBS_RENDER_PROCESS_MAX_TASKS', fallback_render_process_max_tasks)
+RENDER_PROCESS_TIMEOUT = getattr(settings, 'LAZYTHUMBS_RENDER_PROCESS_TIMEOUT', fallback_render_process_timeout)
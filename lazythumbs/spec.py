@@ -0,0 +1,82 @@
+"""
+Parsing of rendition urls, ``lt_cache/<action>/<geometry>/[q<quality>/]<source path>``,
+into RenditionSpec objects in a single pass.
+
+Geometries are the ones build_geometry produces: '800/600', '800',
+'x/600' and the older '800x600'.
+"""
+from collections import namedtuple
+import re
+
+from lazythumbs.settings import DEFAULT_QUALITY_FACTOR
+from lazythumbs.util import geometry_parse
+
+RENDITION_PATH_RE = re.compile(r'''
+    (?P<action>\w+)/
+    (?:
+        (?P<width>\d+)(?:/(?P<height>\d+))?
+      | (?P<x_width>\d+)x(?P<x_height>\d+)
+      | x/(?P<height_only>\d+)
+    )/
+    (?:q(?P<quality>\d+)/)?
+    (?P<source_path>.+)$
+''', re.VERBOSE)
+
+
+class RenditionSpec(namedtuple('RenditionSpec', 'action width height quality source_path')):
+    """
+    What to render: action, width and height (None for a dimension a
+    thumbnail leaves free), quality as an int and the source path relative
+    to MEDIA_ROOT.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_args(cls, action, geometry, source_path, quality=None):
+        """
+        Build a spec from separately captured url parts.
+
+        :param quality: a string of 'q\d', None for the default quality
+        :raises ValueError: if geometry or quality are malformed
+        """
+        width, height = geometry_parse(action, geometry, ValueError)
+        if quality is None:
+            quality = DEFAULT_QUALITY_FACTOR
+        else:
+            try:
+                quality = int(quality.lstrip('q'))
+            except AttributeError:
+                raise ValueError('bad quality %r' % quality)
+        if not 0 < quality <= 100:
+            raise ValueError('quality out of range: %s' % quality)
+        return cls(action, width, height, quality, source_path)
+
+
+def parse_rendition_path(path):
+    """
+    :param path: the part of a rendition url after 'lt_cache/'
+    :returns: a RenditionSpec, or None if path isn't a rendition url
+    """
+    match = RENDITION_PATH_RE.match(path)
+    if match is None:
+        return None
+    action, width, height, x_width, x_height, height_only, quality, source_path = match.groups()
+
+    if x_width is not None:
+        width, height = x_width, x_height
+    elif height_only is not None:
+        height = height_only
+    width = int(width) if width else None
+    height = int(height) if height else None
+    # same rules as geometry_parse
+    if not (width and height) and not action == 'thumbnail':
+        height = width or height
+        width = width or height
+
+    if quality is None:
+        quality = DEFAULT_QUALITY_FACTOR
+    else:
+        quality = int(quality)
+        if not 0 < quality <= 100:
+            return None
+    return RenditionSpec(action, width, height, quality, source_path)
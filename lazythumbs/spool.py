@@ -0,0 +1,204 @@
+"""
+Filesystem spool of pending renders for the asynchronous render mode.
+
+Each job is a small JSON file named after the rendition it produces, so
+enqueueing the same rendition twice is a no-op. A worker claims a job by
+renaming it, which only one worker can do, renders it with the same code the
+view uses and removes it. Jobs are picked up by a pool of background threads
+in the web process and/or by the lazythumbs_render_spool management command.
+"""
+from hashlib import md5
+import errno
+import json
+import logging
+import os
+import Queue
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+
+from lazythumbs.settings import RENDER_SPOOL_DIR, ASYNC_RENDER_WORKERS
+
+logger = logging.getLogger('lazythumbs')
+
+JOB_SUFFIX = '.json'
+CLAIMED_SUFFIX = '.working'
+
+
+def get_spool_dir():
+    return RENDER_SPOOL_DIR or os.path.join(settings.MEDIA_ROOT, 'lt_cache', '.spool')
+
+
+def get_job_name(rendered_path):
+    return md5(rendered_path).hexdigest()
+
+
+def enqueue(action, width, height, source_path, rendered_path, quality):
+    """
+    Spool a render unless it is already waiting or being worked on.
+
+    :returns: the job name
+    """
+    spool_dir = get_spool_dir()
+    name = get_job_name(rendered_path)
+    path = os.path.join(spool_dir, name + JOB_SUFFIX)
+    if os.path.exists(path) or os.path.exists(os.path.join(spool_dir, name + CLAIMED_SUFFIX)):
+        return name
+
+    try:
+        os.makedirs(spool_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    job = {
+        'action': action,
+        'width': width,
+        'height': height,
+        'source_path': source_path,
+        'rendered_path': rendered_path,
+        'quality': quality,
+    }
+    # write to a temporary file and rename it into place so that workers
+    # never see a partially written job
+    fd, tmp_path = tempfile.mkstemp(dir=spool_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(job, f)
+    os.rename(tmp_path, path)
+    return name
+
+
+def pending():
+    """ names of jobs waiting to be claimed, oldest first """
+    spool_dir = get_spool_dir()
+    try:
+        names = os.listdir(spool_dir)
+    except OSError:
+        return []
+    jobs = [n for n in names if n.endswith(JOB_SUFFIX)]
+    mtimes = {}
+    for n in jobs:
+        try:
+            mtimes[n] = os.path.getmtime(os.path.join(spool_dir, n))
+        except OSError:
+            pass
+    return [n[:-len(JOB_SUFFIX)] for n in sorted(mtimes, key=mtimes.get)]
+
+
+def claim(name):
+    """
+    :returns: the job, or None if another worker claimed it first
+    """
+    spool_dir = get_spool_dir()
+    claimed = os.path.join(spool_dir, name + CLAIMED_SUFFIX)
+    try:
+        os.rename(os.path.join(spool_dir, name + JOB_SUFFIX), claimed)
+    except OSError:
+        return None
+    # mark the claim time so stale claims can be recognized
+    os.utime(claimed, None)
+    with open(claimed) as f:
+        return json.load(f)
+
+
+def complete(name):
+    try:
+        os.unlink(os.path.join(get_spool_dir(), name + CLAIMED_SUFFIX))
+    except OSError:
+        pass
+
+
+def reclaim(older_than):
+    """
+    Put jobs claimed more than older_than seconds ago, whose worker has
+    presumably died, back in the spool.
+
+    :returns: the number of jobs put back
+    """
+    spool_dir = get_spool_dir()
+    try:
+        names = os.listdir(spool_dir)
+    except OSError:
+        return 0
+    count = 0
+    for n in names:
+        if not n.endswith(CLAIMED_SUFFIX):
+            continue
+        path = os.path.join(spool_dir, n)
+        try:
+            if time.time() - os.path.getmtime(path) > older_than:
+                os.rename(path, path[:-len(CLAIMED_SUFFIX)] + JOB_SUFFIX)
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+def run(renderer, name):
+    """
+    Claim and render one job. Sources that turn out to be missing have their
+    404 cached just like the view would.
+
+    :returns: True if the job was rendered, False if it was claimed elsewhere
+        or failed
+    """
+    job = claim(name)
+    if job is None:
+        return False
+    try:
+        raw_data = renderer.render(
+            job['action'], job['width'], job['height'], job['source_path'],
+            job['rendered_path'], job['quality']
+        )
+        return raw_data is not None
+    except (IOError, SuspiciousOperation, ValueError), e:
+        logger.info('404: %s', e)
+        cache_key = renderer.cache_key(
+            job['source_path'], job['action'], job['width'], job['height'], job['quality']
+        )
+        renderer.cache_404(job['source_path'], cache_key)
+        return False
+    except Exception:
+        logger.exception('spooled render of %s failed', job['rendered_path'])
+        return False
+    finally:
+        complete(name)
+
+
+class WorkerPool(object):
+    """
+    Background threads of this process rendering jobs as they are spooled.
+    Threads are started on first use.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.jobs = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, renderer_class, name):
+        if not self.size:
+            return
+        with self.lock:
+            if not self.threads:
+                for i in range(self.size):
+                    thread = threading.Thread(target=self.work, name='lazythumbs-render-%d' % i)
+                    thread.daemon = True
+                    thread.start()
+                    self.threads.append(thread)
+        self.jobs.put((renderer_class, name))
+
+    def work(self):
+        while True:
+            renderer_class, name = self.jobs.get()
+            try:
+                run(renderer_class(), name)
+            except Exception:
+                logger.exception('background render worker error')
+            finally:
+                self.jobs.task_done()
+
+
+workers = WorkerPool(ASYNC_RENDER_WORKERS)
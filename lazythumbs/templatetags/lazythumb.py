@@ -9,7 +9,7 @@
 import logging
 
 from django.template import TemplateSyntaxError, Library, Node, Variable
-from lazythumbs.util import compute_img, get_attr_string
+from lazythumbs.util import compile_geometry, compute_img, get_attr_string
 from lazythumbs.views import LazyThumbRenderer
 
 
@@ -37,15 +37,17 @@ class LazythumbNode(Node):
             as_var = bits[-1]
             # Keyword arguments
             self.kwargs = {}
+            self.quality = None
             raw_kwargs = bits[4:-2]
             for kwarg in raw_kwargs:
                 kwarg_name, kwarg_value = kwarg.split('=')
                 if kwarg_name == 'quality':
                     try:
-                        self.quality = int(kwarg_value)
-                        assert 0 < self.quality <= 100
+                        quality = int(kwarg_value)
+                        assert 0 < quality <= 100
                     except (ValueError, AssertionError):
                         raise tse(self.quality_usage)
+                    self.quality = 'q{0}'.format(quality)
                 else:
                     self.kwargs[kwarg_name] = Variable(kwarg_value)
         except ValueError:
@@ -59,6 +61,11 @@ class LazythumbNode(Node):
 
         self.thing = Variable(thing)
         self.geometry = Variable(geometry)
+        # a literal geometry is parsed, and the url path it leads to built,
+        # once here instead of on every render
+        self.compiled = None
+        if isinstance(self.geometry.literal, basestring):
+            self.compiled = compile_geometry(action, self.geometry.literal, self.quality)
 
         self.nodelist = parser.parse(('endlazythumb',))
         parser.delete_first_token()
@@ -67,18 +74,17 @@ class LazythumbNode(Node):
 
         thing = self.thing.resolve(context)
         action = self.action
-        geometry = self.geometry.resolve(context)
+        if self.compiled is not None:
+            geometry = self.geometry.literal
+        else:
+            geometry = self.geometry.resolve(context)
 
         options = {}
         for k, v in self.kwargs.items():
             options[k] = v.resolve(context)
 
         context.push()
-        try:
-            self.quality = 'q{0}'.format(self.quality)
-        except AttributeError:
-            self.quality = None
-        context[self.as_var] = compute_img(thing, action, geometry, options, self.quality)
+        context[self.as_var] = compute_img(thing, action, geometry, options, self.quality, self.compiled)
         output = self.nodelist.render(context)
         context.pop()
         return output
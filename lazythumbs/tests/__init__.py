@@ -1,4 +1,21 @@
-from lazythumbs.tests.test_server import  RenderTest, GetViewTest
+from lazythumbs.tests.test_server import  RenderTest, GetViewTest, TestDraftDecode, TestServeModes, TestConditionalGet
+from lazythumbs.tests.test_server import TestShardedLayout, TestUrlMatching, TestFormatNegotiation
 from lazythumbs.tests.test_templatetag import LazythumbSyntaxTest, LazythumbGeometryCompileTest, LazythumbRenderTest
 from lazythumbs.tests.test_templatetag import ImgAttrsRenderTest
 from lazythumbs.tests.test_util import TestGeometry, TestComputeIMG, TestGetImgAttrs, TestGetFormat
+from lazythumbs.tests.test_util import TestGetDecodeSize, TestCompileGeometry, TestGetStoragePath
+from lazythumbs.tests.test_locks import TestSingleFlight, TestRenderLock
+from lazythumbs.tests.test_lru import TestLRUCache, TestDecodedImageCache
+from lazythumbs.tests.test_commands import TestParseSpec, TestRenderOne, TestPregenerateCommand, TestShardCacheCommand
+from lazythumbs.tests.test_renditions import TestCanDerive, TestRenditionIndex, TestDeriveRenditions
+from lazythumbs.tests.test_metadata import TestSourceMetadataIndex, TestComputeImgMetadata, TestScanMetadataCommand
+from lazythumbs.tests.test_spool import TestSpool, TestAsyncRender
+from lazythumbs.tests.test_missing import TestMissingSourceCache
+from lazythumbs.tests.test_cache_manager import TestCacheManager, TestGCCommand
+from lazythumbs.tests.test_encoding import TestEncoderProfiles, TestEncode
+from lazythumbs.tests.test_resample import TestResample, TestTiledResize
+from lazythumbs.tests.test_geometry import TestPlans
+from lazythumbs.tests.test_admission import TestAdmission, TestRenderRejected
+from lazythumbs.tests.test_deadline import TestCallWithDeadline, TestRenderDeadline
+from lazythumbs.tests.test_executor import TestRenderPool, TestRenderThreads
+from lazythumbs.tests.test_batch import TestRenderBatch
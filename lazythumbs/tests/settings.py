@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +19,8 @@ LAZYTHUMBS_404_CACHE_TIMEOUT = 60
 
 LAZYTHUMBS_USE_X_FOR_DIMENSIONS = True
 
+LAZYTHUMBS_RENDER_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'lazythumbs-test-locks')
+
 CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
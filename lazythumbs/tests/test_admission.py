@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from mock import Mock, patch
+from PIL import Image
+
+from lazythumbs.admission import Admission, RenderRejected, get_admission_dir
+from lazythumbs.missing import missing_sources
+from lazythumbs.tests.test_server import MockCache
+from lazythumbs.views import LazyThumbRenderer
+
+
+class TestAdmission(TestCase):
+
+    def setUp(self):
+        self.admission_dir = tempfile.mkdtemp()
+        self.patcher = patch('lazythumbs.admission.ADMISSION_DIR', self.admission_dir)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.admission_dir)
+
+    def test_unlimited(self):
+        admission = Admission(None, None, 0, 0)
+        with admission.slot():
+            with admission.slot():
+                pass
+        self.assertEqual(admission.active, 0)
+
+    def test_process_limit(self):
+        admission = Admission(1, None, 0, 0)
+        with admission.slot():
+            self.assertEqual(admission.active, 1)
+            with self.assertRaises(RenderRejected):
+                with admission.slot():
+                    pass  # pragma: no cover
+        with admission.slot():
+            pass
+        self.assertEqual((admission.active, admission.rejected), (0, 1))
+
+    def test_queue(self):
+        """ a render waits for a slot to come free, unless the queue is full """
+        admission = Admission(1, None, 1, 5)
+        started, finished = threading.Event(), []
+
+        def wait():
+            started.set()
+            with admission.slot():
+                finished.append(True)
+
+        with admission.slot():
+            thread = threading.Thread(target=wait)
+            thread.start()
+            started.wait()
+            while not admission.waiting:
+                time.sleep(0.01)
+            # the queue is full
+            with self.assertRaises(RenderRejected):
+                with admission.slot():
+                    pass  # pragma: no cover
+        thread.join()
+        self.assertEqual(finished, [True])
+        self.assertEqual((admission.waiting, admission.rejected), (0, 1))
+
+    def test_queue_timeout(self):
+        admission = Admission(1, None, 1, 0.05)
+        with admission.slot():
+            with self.assertRaises(RenderRejected):
+                with admission.slot():
+                    pass  # pragma: no cover
+        self.assertEqual(admission.waiting, 0)
+
+    def test_rejection_shared(self):
+        """ renders of a rendition that was just rejected are rejected without waiting again """
+        admission = Admission(1, None, 1, 0.05)
+        with admission.slot():
+            with self.assertRaises(RenderRejected):
+                with admission.slot('lt_cache/resize/100/100/a.jpg'):
+                    pass  # pragma: no cover
+        started = time.time()
+        with self.assertRaises(RenderRejected):
+            with admission.slot('lt_cache/resize/100/100/a.jpg'):
+                pass  # pragma: no cover
+        self.assertTrue(time.time() - started < 0.05)
+        # other renditions are admitted
+        with admission.slot('lt_cache/resize/200/200/a.jpg'):
+            pass
+        # and so is the rendition, once its rejection is older than the queue timeout
+        time.sleep(0.06)
+        with admission.slot('lt_cache/resize/100/100/a.jpg'):
+            pass
+
+    def test_admission_dir(self):
+        """ host slots live on the host, not under a possibly shared MEDIA_ROOT """
+        with patch('lazythumbs.admission.ADMISSION_DIR', None):
+            self.assertEqual(get_admission_dir(), os.path.join(tempfile.gettempdir(), 'lazythumbs-admission'))
+
+    def test_host_limit(self):
+        """ host slots are shared with other processes through lock files """
+        admission, other_process = Admission(None, 1, 0, 0), Admission(None, 1, 0, 0)
+        with admission.slot():
+            with self.assertRaises(RenderRejected):
+                with other_process.slot():
+                    pass  # pragma: no cover
+        with other_process.slot():
+            pass
+        self.assertEqual((other_process.active, other_process.rejected), (0, 1))
+
+
+class TestRenderRejected(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (400, 300)).save(os.path.join(self.media_root, 'a.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.locks.settings'),
+            patch('lazythumbs.admission.settings'),
+        ]
+        for patcher in self.patchers:
+            mock_settings = patcher.start()
+            mock_settings.MEDIA_ROOT = self.media_root
+            mock_settings.MEDIA_URL = 'http://media.example.com/media/'
+        self.admission = Admission(1, None, 0, 0)
+        self.patchers.append(patch('lazythumbs.views.admission', self.admission))
+        self.patchers.append(patch('lazythumbs.views.cache', MockCache()))
+        for patcher in self.patchers[-2:]:
+            patcher.start()
+        missing_sources.clear()
+        self.renderer = LazyThumbRenderer()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def get(self, geometry='100/100'):
+        req = Mock(path='/lt_cache/resize/%s/a.jpg' % geometry, META={})
+        return self.renderer.get(req, 'resize', geometry, 'a.jpg')
+
+    def test_rejected(self):
+        with self.admission.slot():
+            resp = self.get()
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp['Retry-After'], '2')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'lt_cache/resize/100/100/a.jpg')))
+        # nothing was cached for the rendition
+        self.assertEqual(self.get().status_code, 200)
+
+    @patch('lazythumbs.views.RENDER_REJECT_FALLBACK', 'redirect')
+    def test_redirect(self):
+        with self.admission.slot():
+            resp = self.get()
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp['Location'], 'http://media.example.com/media/a.jpg')
+
+    def test_hits_served(self):
+        """ renditions that exist are served while every slot is taken """
+        self.assertEqual(self.get().status_code, 200)
+        with self.admission.slot():
+            self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.admission.rejected, 0)
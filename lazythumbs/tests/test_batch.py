@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from urlparse import urlparse
+
+from mock import Mock, patch
+from PIL import Image
+
+from lazythumbs.tests.test_server import MockCache
+from lazythumbs.views import LazyThumbRenderer
+
+
+class TestRenderBatch(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (800, 600)).save(os.path.join(self.media_root, 'a.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.locks.settings'),
+            patch('lazythumbs.renditions.settings'),
+        ]
+        for patcher in self.patchers:
+            mock_settings = patcher.start()
+            mock_settings.MEDIA_ROOT = self.media_root
+            mock_settings.MEDIA_URL = 'http://media.example.com/media/'
+        self.renderer = LazyThumbRenderer()
+        self.renderer.get_pil_from_path = Mock(wraps=self.renderer.get_pil_from_path)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def test_one_decode(self):
+        specs = [('thumbnail', '100', None), ('resize', '400/300', 90), ('matte', '200/200', None)]
+        results = self.renderer.render_batch('a.jpg', specs)
+        self.assertEqual(self.renderer.get_pil_from_path.call_count, 1)
+        self.assertEqual(
+            [(r['width'], r['height']) for r in results],
+            [(100, 75), (400, 300), (200, 200)]
+        )
+        self.assertEqual(results[1]['url'], 'http://media.example.com/media/lt/lt_cache/resize/400x300/q90/a.jpg')
+        for result in results:
+            self.assertTrue(result['rendered'])
+            self.assertEqual(os.path.getsize(os.path.join(self.media_root, result['path'])), result['bytes'])
+
+    def test_served_by_the_view(self):
+        result = self.renderer.render_batch('a.jpg', [('resize', '400/300', None)])[0]
+        req = Mock(path=urlparse(result['url']).path, META={})
+        renderer = LazyThumbRenderer()
+        renderer._render_and_save = Mock()
+        with patch('lazythumbs.views.cache', MockCache()):
+            resp = renderer.get(req, 'resize', '400/300', 'a.jpg')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.content), result['bytes'])
+        self.assertFalse(renderer._render_and_save.called)
+
+    @patch('lazythumbs.views.DRAFT_DECODE', False)
+    def test_derives_smaller_renditions(self):
+        self.renderer.resize = Mock(wraps=self.renderer.resize)
+        self.renderer.render_batch('a.jpg', [('resize', '200/150', None), ('resize', '400/300', None)])
+        sources = [call[1]['img'].size for call in self.renderer.resize.call_args_list]
+        # largest first, from the source, then from the 400x300
+        self.assertEqual(sources, [(800, 600), (400, 300)])
+
+    def test_same_size_as_single_renders(self):
+        """ renditions derived within the batch come out as if rendered from the source """
+        Image.new('RGB', (3000, 2000)).save(os.path.join(self.media_root, 'b.jpg'))
+        specs = [('thumbnail', '1000', None), ('thumbnail', '300', None), ('thumbnail', '450', None)]
+        results = self.renderer.render_batch('b.jpg', specs)
+        single = [
+            LazyThumbRenderer().thumbnail(width=int(geometry), img_path='b.jpg').size
+            for _, geometry, _ in specs
+        ]
+        self.assertEqual([(r['width'], r['height']) for r in results], single)
+        self.assertEqual(single, [(1000, 666), (300, 200), (450, 300)])
+
+    def test_existing(self):
+        self.renderer.render_batch('a.jpg', [('resize', '400/300', None)])
+        results = self.renderer.render_batch('a.jpg', [('resize', '400/300', None), ('resize', '100/100', None)])
+        self.assertEqual([r['rendered'] for r in results], [False, True])
+        results = self.renderer.render_batch('a.jpg', [('resize', '400/300', None)], force=True)
+        self.assertTrue(results[0]['rendered'])
+
+    def test_bad_specs(self):
+        self.assertRaises(ValueError, self.renderer.render_batch, 'a.jpg', [('crop', '100/100', None)])
+        self.assertRaises(ValueError, self.renderer.render_batch, 'a.jpg', [('resize', 'big', None)])
+        self.assertRaises(ValueError, self.renderer.render_batch, '../a.jpg', [('resize', '100/100', None)])
+        self.assertRaises(IOError, self.renderer.render_batch, 'missing.jpg', [('resize', '100/100', None)])
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+from unittest import TestCase
+
+from django.core.management.base import CommandError
+from mock import patch
+
+from lazythumbs import cache_manager
+from lazythumbs.cache_manager import evict, get_stats, parse_size, scan, touch, walk_renditions
+from lazythumbs.locks import render_lock
+from lazythumbs.management.commands import lazythumbs_gc
+
+ACTIONS = ['resize', 'thumbnail', 'scale']
+
+
+class CacheTestCase(TestCase):
+    """ a throwaway MEDIA_ROOT with a source, renditions in both layouts and lock files """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.patcher = patch('lazythumbs.cache_manager.settings')
+        self.patcher.start().MEDIA_ROOT = self.media_root
+        now = time.time()
+        self.files = {
+            # path: (size, seconds since last access)
+            'photos/a.jpg': (1000, 0),
+            'lt/lt_cache/resize/10/10/photos/a.jpg': (100, 300),
+            'lt/lt_cache/resize/10/10/photos/b.jpg': (100, 100),
+            'lt/lt_cache/thumbnail/48/q70/photos/a.jpg': (50, 200),
+            'lt_cache/ab/cd/abcd0123.jpg': (10, 400),
+            'lt_cache/.locks/ab/abcd.lock': (0, 500),
+        }
+        for path, (size, age) in self.files.items():
+            full_path = os.path.join(self.media_root, path)
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            with open(full_path, 'w') as f:
+                f.write('x' * size)
+            os.utime(full_path, (now - age, now - age))
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.media_root, path))
+
+    def renditions(self):
+        return scan(walk_renditions(ACTIONS))
+
+
+class TestCacheManager(CacheTestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1024'), 1024)
+        self.assertEqual(parse_size('20G'), 20 * 1024 ** 3)
+        self.assertEqual(parse_size('500mb'), 500 * 1024 ** 2)
+        self.assertRaises(ValueError, parse_size, '2 gigs')
+
+    def test_walk_renditions(self):
+        self.assertEqual(sorted(walk_renditions(ACTIONS)), [
+            'lt/lt_cache/resize/10/10/photos/a.jpg',
+            'lt/lt_cache/resize/10/10/photos/b.jpg',
+            'lt/lt_cache/thumbnail/48/q70/photos/a.jpg',
+            'lt_cache/ab/cd/abcd0123.jpg',
+        ])
+        self.assertEqual(len(list(walk_renditions(ACTIONS, sharded=False))), 3)
+
+    def test_stats(self):
+        self.assertEqual(get_stats(self.renditions()), {
+            ('resize', '10x10'): [2, 200],
+            ('thumbnail', '48x'): [1, 50],
+            ('sharded', ''): [1, 10],
+        })
+
+    def test_evict_lru(self):
+        self.assertEqual(evict(self.renditions(), 160), (2, 110))
+        self.assertFalse(self.exists('lt_cache/ab/cd/abcd0123.jpg'))
+        self.assertFalse(self.exists('lt/lt_cache/resize/10/10/photos/a.jpg'))
+        self.assertTrue(self.exists('lt/lt_cache/resize/10/10/photos/b.jpg'))
+        self.assertTrue(self.exists('lt/lt_cache/thumbnail/48/q70/photos/a.jpg'))
+        self.assertTrue(self.exists('photos/a.jpg'))
+        # emptied directories go too
+        self.assertFalse(self.exists('lt_cache/ab'))
+        self.assertTrue(self.exists('lt_cache/.locks'))
+
+    def test_evict_dry_run(self):
+        self.assertEqual(evict(self.renditions(), 0, dry_run=True), (4, 260))
+        self.assertEqual(len(self.renditions()), 4)
+
+    def test_evict_skips_accessed(self):
+        renditions = self.renditions()
+        path = os.path.join(self.media_root, 'lt_cache/ab/cd/abcd0123.jpg')
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        self.assertEqual(evict(renditions, 160), (1, 100))
+        self.assertTrue(self.exists('lt_cache/ab/cd/abcd0123.jpg'))
+
+    def test_evict_skips_rendering(self):
+        with render_lock('lt_cache/ab/cd/abcd0123.jpg'):
+            self.assertEqual(evict(self.renditions(), 160), (1, 100))
+        self.assertTrue(self.exists('lt_cache/ab/cd/abcd0123.jpg'))
+
+    def test_touch(self):
+        path = os.path.join(self.media_root, 'lt/lt_cache/resize/10/10/photos/a.jpg')
+        stat = os.stat(path)
+        touch(path, stat, 600)
+        self.assertEqual(os.stat(path).st_atime, stat.st_atime)
+        touch(path, stat, 60)
+        self.assertTrue(os.stat(path).st_atime > stat.st_atime)
+        self.assertAlmostEqual(os.stat(path).st_mtime, stat.st_mtime, 3)
+
+
+class TestGCCommand(CacheTestCase):
+
+    def call(self, **options):
+        command = lazythumbs_gc.Command()
+        command.stdout = StringIO()
+        defaults = {'budget': None, 'stats': False, 'dry_run': False, 'batch_size': 100, 'pause': 0}
+        defaults.update(options)
+        command.handle(**defaults)
+        return command.stdout.getvalue()
+
+    def test_gc(self):
+        output = self.call(budget='160')
+        self.assertEqual(output, '2 renditions evicted, 0.0 MB freed, 0.0 MB in 2 renditions left\n')
+        self.assertEqual(len(self.renditions()), 2)
+
+    def test_stats(self):
+        lines = self.call(stats=True).splitlines()
+        self.assertEqual(lines[0].split(), ['action', 'geometry', 'files', 'bytes'])
+        self.assertEqual(lines[1].split(), ['resize', '10x10', '2', '200'])
+        self.assertEqual(lines[-1].split(), ['total', '4', '260'])
+
+    def test_no_budget(self):
+        self.assertRaises(CommandError, self.call)
+        self.assertRaises(CommandError, self.call, budget='lots')
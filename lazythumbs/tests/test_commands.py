@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from django.core.management.base import CommandError
+from mock import patch
+from PIL import Image
+
+from lazythumbs.management.commands import lazythumbs_pregenerate, lazythumbs_shard_cache
+from lazythumbs.management.commands.lazythumbs_pregenerate import parse_spec, render_one
+from lazythumbs.util import compute_img, get_storage_path
+
+
+ACTIONS = ['resize', 'thumbnail', 'scale']
+
+
+class MediaRootTestCase(TestCase):
+    """ run against a throwaway MEDIA_ROOT holding photos/a.jpg """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.media_root, 'photos'))
+        Image.new('RGB', (400, 300)).save(os.path.join(self.media_root, 'photos', 'a.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.management.commands.lazythumbs_pregenerate.settings'),
+        ]
+        for patcher in self.patchers:
+            patcher.start().MEDIA_ROOT = self.media_root
+        lazythumbs_pregenerate._renderer = None
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        lazythumbs_pregenerate._renderer = None
+        shutil.rmtree(self.media_root)
+
+    def rendered(self, path):
+        return os.path.join(self.media_root, path)
+
+
+class TestParseSpec(TestCase):
+
+    def test_valid(self):
+        self.assertEqual(parse_spec('resize:150x100', ACTIONS), ('resize', 150, 100, None))
+        self.assertEqual(parse_spec('thumbnail:48:q60', ACTIONS), ('thumbnail', 48, None, 60))
+        self.assertEqual(parse_spec('scale:10/20:70', ACTIONS), ('scale', 10, 20, 70))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_spec, 'resize', ACTIONS)
+        self.assertRaises(ValueError, parse_spec, 'boom:10x10', ACTIONS)
+        self.assertRaises(ValueError, parse_spec, 'resize:10x10x10', ACTIONS)
+        self.assertRaises(ValueError, parse_spec, 'resize:10x10:q0', ACTIONS)
+
+
+class TestRenderOne(MediaRootTestCase):
+
+    def test_render_then_skip(self):
+        """ renditions land where the template tag points and are not redone """
+        task = ('photos/a.jpg', ('resize', 100, 100, None), False, None)
+        status, path, nbytes = render_one(task)
+        self.assertEqual(status, 'rendered')
+        self.assertTrue(nbytes > 0)
+        self.assertEqual(
+            compute_img('photos/a.jpg', 'resize', '100x100')['src'],
+            'http://media.example.com/' + path,
+        )
+        self.assertEqual(Image.open(self.rendered(path)).size, (100, 100))
+        self.assertEqual(render_one(task)[0], 'skipped')
+        self.assertEqual(render_one(task[:2] + (True, None))[0], 'rendered')
+
+    def test_quality_in_path(self):
+        status, path, _ = render_one(('photos/a.jpg', ('thumbnail', 48, None, 60), False, None))
+        self.assertEqual(status, 'rendered')
+        self.assertTrue('/lt_cache/thumbnail/48/q60/photos/a.jpg' in '/' + path)
+
+    def test_sibling_format(self):
+        status, path, _ = render_one(('photos/a.jpg', ('resize', 100, 100, None), False, 'WEBP'))
+        self.assertEqual(status, 'rendered')
+        self.assertTrue(path.endswith('/lt_cache/resize/100x100/photos/a.jpg.webp'))
+        self.assertEqual(Image.open(self.rendered(path)).format, 'WEBP')
+
+    def test_missing_source(self):
+        status, _, _ = render_one(('photos/missing.jpg', ('resize', 100, 100, None), False, None))
+        self.assertEqual(status, 'failed')
+
+
+class TestPregenerateCommand(MediaRootTestCase):
+
+    def run_command(self, *args, **options):
+        command = lazythumbs_pregenerate.Command()
+        command.stdout = StringIO()
+        command.stderr = StringIO()
+        options.setdefault('source_file', None)
+        options.setdefault('processes', 1)
+        options.setdefault('force', False)
+        command.handle(*args, **options)
+        return command.stdout.getvalue()
+
+    def test_glob(self):
+        out = self.run_command('photos/*.jpg', specs=['resize:50x50', 'thumbnail:20'])
+        self.assertTrue('[2/2] 2 rendered, 0 skipped, 0 failed' in out)
+        out = self.run_command('photos/*.jpg', specs=['resize:50x50'])
+        self.assertTrue('[1/1] 0 rendered, 1 skipped, 0 failed' in out)
+
+    def test_source_file(self):
+        listing = os.path.join(self.media_root, 'sources.txt')
+        with open(listing, 'w') as f:
+            f.write('photos/a.jpg\n\n')
+        out = self.run_command(source_file=listing, specs=['scale:30x30'])
+        self.assertTrue('[1/1] 1 rendered' in out)
+
+    def test_errors(self):
+        self.assertRaises(CommandError, self.run_command, 'photos/*.jpg', specs=[])
+        self.assertRaises(CommandError, self.run_command, 'photos/*.jpg', specs=['boom:10'])
+        self.assertRaises(CommandError, self.run_command, 'nothing/*.jpg', specs=['resize:10'])
+
+
+class TestShardCacheCommand(MediaRootTestCase):
+
+    def setUp(self):
+        super(TestShardCacheCommand, self).setUp()
+        for name in ('lazythumbs.management.commands.lazythumbs_shard_cache.settings', 'lazythumbs.cache_manager.settings'):
+            self.patchers.append(patch(name))
+            self.patchers[-1].start().MEDIA_ROOT = self.media_root
+        for name in ('lazythumbs.util.CACHE_SHARD_DEPTH', 'lazythumbs.management.commands.lazythumbs_shard_cache.CACHE_SHARD_DEPTH'):
+            self.patchers.append(patch(name, 2))
+            self.patchers[-1].start()
+        self.renditions = ['lt/lt_cache/resize/10/10/photos/a.jpg', 'lt/lt_cache/thumbnail/48/q70/photos/a.jpg']
+        for path in self.renditions + ['lt_cache/.index/x.json', 'lt/lt_cache/junk.jpg']:
+            if not os.path.isdir(os.path.dirname(self.rendered(path))):
+                os.makedirs(os.path.dirname(self.rendered(path)))
+            with open(self.rendered(path), 'w') as f:
+                f.write(path)
+
+    def call(self, **options):
+        command = lazythumbs_shard_cache.Command()
+        command.stdout = StringIO()
+        options.setdefault('dry_run', False)
+        command.handle(**options)
+        return command.stdout.getvalue()
+
+    def test_migrate(self):
+        self.assertEqual(self.call(), '2 renditions moved, 0 already in the sharded layout\n')
+        for path in self.renditions:
+            self.assertFalse(os.path.exists(self.rendered(path)))
+            with open(self.rendered(get_storage_path(path))) as f:
+                self.assertEqual(f.read(), path)
+        self.assertFalse(os.path.exists(self.rendered('lt/lt_cache/resize')))
+        # other files are left alone
+        self.assertTrue(os.path.exists(self.rendered('lt_cache/.index/x.json')))
+        self.assertTrue(os.path.exists(self.rendered('lt/lt_cache/junk.jpg')))
+        self.assertTrue(os.path.exists(self.rendered('photos/a.jpg')))
+        self.assertEqual(self.call(), '0 renditions moved, 0 already in the sharded layout\n')
+
+    def test_dry_run(self):
+        output = self.call(dry_run=True)
+        self.assertTrue('lt/lt_cache/resize/10/10/photos/a.jpg -> lt_cache/' in output)
+        for path in self.renditions:
+            self.assertTrue(os.path.exists(self.rendered(path)))
+
+    def test_not_sharded(self):
+        with patch('lazythumbs.management.commands.lazythumbs_shard_cache.CACHE_SHARD_DEPTH', 0):
+            self.assertRaises(CommandError, self.call)
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import Mock, patch
+from PIL import Image
+
+from lazythumbs import spool
+from lazythumbs.deadline import DeadlineExceeded, call_with_deadline
+from lazythumbs.missing import missing_sources
+from lazythumbs.renditions import make_entry
+from lazythumbs.tests.test_server import MockCache
+from lazythumbs.views import LazyThumbRenderer, rendition_index
+
+
+class TestCallWithDeadline(TestCase):
+
+    def test_in_time(self):
+        self.assertEqual(call_with_deadline(lambda: 42, 5), 42)
+
+    def test_raises(self):
+        def fail():
+            raise IOError('corrupt')
+        self.assertRaises(IOError, call_with_deadline, fail, 5)
+
+    def test_late(self):
+        """ a late call is abandoned, not interrupted """
+        release, finished = threading.Event(), threading.Event()
+
+        def slow():
+            release.wait(5)
+            finished.set()
+
+        self.assertRaises(DeadlineExceeded, call_with_deadline, slow, 0.01, 'slow')
+        release.set()
+        self.assertTrue(finished.wait(5))
+
+
+class TestRenderDeadline(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (400, 300)).save(os.path.join(self.media_root, 'a.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.locks.settings'),
+            patch('lazythumbs.spool.settings'),
+            patch('lazythumbs.renditions.settings'),
+            patch('lazythumbs.deadline.settings'),
+        ]
+        for patcher in self.patchers:
+            mock_settings = patcher.start()
+            mock_settings.MEDIA_ROOT = self.media_root
+            mock_settings.MEDIA_URL = 'http://media.example.com/media/'
+        self.patchers.append(patch('lazythumbs.views.RENDER_DEADLINE', 0.05))
+        self.patchers.append(patch('lazythumbs.deadline.slow_renders', []))
+        self.patchers.append(patch('lazythumbs.views.cache', MockCache()))
+        for patcher in self.patchers[-3:]:
+            patcher.start()
+        missing_sources.clear()
+
+        # renders of 100 wide renditions take until release is set
+        self.release = threading.Event()
+        self.renderer = LazyThumbRenderer()
+        resize = self.renderer.resize
+
+        def slow_resize(**kwargs):
+            if kwargs['width'] == 100:
+                self.release.wait(5)
+            return resize(**kwargs)
+        self.renderer.resize = slow_resize
+
+    def tearDown(self):
+        self.release.set()
+        for thread in threading.enumerate():
+            if thread.name == 'lazythumbs-deadline':
+                thread.join()
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def get(self, geometry='100/100'):
+        req = Mock(path='/lt_cache/resize/%s/a.jpg' % geometry, META={})
+        return self.renderer.get(req, 'resize', geometry, 'a.jpg')
+
+    def wait_for(self, rendered_path):
+        path = os.path.join(self.media_root, rendered_path)
+        for i in range(500):
+            if os.path.exists(path):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_in_time(self):
+        self.assertEqual(self.get('200/200').status_code, 200)
+        self.assertEqual(spool.pending(), [])
+
+    def test_late(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp['Location'], 'http://media.example.com/media/a.jpg')
+        self.assertEqual(resp['Retry-After'], '30')
+        # spooled in case the background render doesn't make it
+        self.assertEqual(len(spool.pending()), 1)
+
+        self.release.set()
+        self.assertTrue(self.wait_for('lt_cache/resize/100/100/a.jpg'))
+        with open(os.path.join(self.media_root, 'lt_cache/.slow_sources')) as f:
+            self.assertEqual(f.read(), 'a.jpg\n')
+        self.assertEqual(self.get().status_code, 200)
+
+    @patch('lazythumbs.views.RENDER_DEADLINE_FALLBACK', 'variant')
+    def test_variant(self):
+        self.assertEqual(self.get('200/200').status_code, 200)
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Image.open(StringIO(resp.content)).size, (200, 200))
+        self.assertEqual(resp['Cache-Control'], 'public,max-age=30')
+
+    @patch('lazythumbs.views.RENDER_DEADLINE_FALLBACK', 'variant')
+    def test_variant_in_the_clients_format(self):
+        """ a sibling in a format the client didn't get isn't a stand-in """
+        sibling = 'lt_cache/resize/200/200/a.jpg.webp'
+        os.makedirs(os.path.join(self.media_root, 'lt_cache/resize/200/200'))
+        Image.new('RGB', (200, 200)).save(os.path.join(self.media_root, sibling), 'PNG')
+        source_mtime = os.stat(os.path.join(self.media_root, 'a.jpg')).st_mtime
+        rendition_index.add('a.jpg', source_mtime, make_entry(
+            sibling, 'resize', 200, 200, (200, 200), 80, 'WEBP', derived=False
+        ))
+        self.assertEqual(self.get().status_code, 302)
+        self.assertEqual(self.get('200/200').status_code, 200)
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'image/jpeg')
+
+    @patch('lazythumbs.views.RENDER_DEADLINE_FALLBACK', 'variant')
+    def test_no_variant(self):
+        self.assertEqual(self.get().status_code, 302)
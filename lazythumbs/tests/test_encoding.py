@@ -0,0 +1,94 @@
+from cStringIO import StringIO
+from unittest import TestCase
+
+from mock import patch
+from PIL import Image
+
+from lazythumbs import encoding
+from lazythumbs.encoding import encode, get_profile, get_save_params
+
+PROFILES = {
+    'JPEG': [
+        (100, {'progressive': False}),
+        (10000, {'progressive': True, 'subsampling': 2}),
+        (None, {'progressive': True, 'subsampling': 0, 'strip_metadata': False}),
+    ],
+    'PNG': [(1000, {'compress_level': 1})],
+}
+
+
+class TestEncoderProfiles(TestCase):
+
+    def test_bands(self):
+        self.assertEqual(get_profile('JPEG', (10, 10), PROFILES), {'progressive': False})
+        self.assertEqual(get_profile('JPEG', (10, 11), PROFILES)['subsampling'], 2)
+        self.assertEqual(get_profile('JPEG', (1000, 1000), PROFILES)['subsampling'], 0)
+        # past the last band the last one applies
+        self.assertEqual(get_profile('PNG', (1000, 1000), PROFILES), {'compress_level': 1})
+        self.assertEqual(get_profile('GIF', (10, 10), PROFILES), None)
+
+    def test_save_params(self):
+        img = Image.new('RGB', (10, 10))
+        img.info['icc_profile'] = 'profile'
+        self.assertEqual(
+            get_save_params(img, 'JPEG', 70, PROFILES),
+            {'format': 'JPEG', 'quality': 70, 'progressive': False},
+        )
+
+    def test_keep_metadata(self):
+        img = Image.new('RGB', (200, 200))
+        img.info['icc_profile'] = 'profile'
+        params = get_save_params(img, 'JPEG', 70, PROFILES)
+        self.assertEqual(params['icc_profile'], 'profile')
+        self.assertFalse('exif' in params)
+        self.assertFalse('strip_metadata' in params)
+
+    @patch('lazythumbs.encoding.DEFAULT_OPTIMIZE_FLAG', False)
+    @patch('lazythumbs.encoding.DEFAULT_PROGRESSIVE_FLAG', True)
+    def test_global_flags(self):
+        """ formats without a profile get LAZYTHUMBS_OPTIMIZE_FLAG and LAZYTHUMBS_PROGRESSIVE_FLAG """
+        params = get_save_params(Image.new('RGB', (10, 10)), 'GIF', 80, PROFILES)
+        self.assertEqual(params, {'format': 'GIF', 'quality': 80, 'optimize': False, 'progressive': True})
+
+    def test_url_quality_wins(self):
+        profiles = {'JPEG': [(None, {'quality': 95, 'progressive': True})]}
+        self.assertEqual(get_save_params(Image.new('RGB', (10, 10)), 'JPEG', 60, profiles)['quality'], 60)
+
+    @patch('lazythumbs.encoding.DEFAULT_OPTIMIZE_FLAG', False)
+    @patch('lazythumbs.encoding.DEFAULT_PROGRESSIVE_FLAG', False)
+    def test_no_profiles_by_default(self):
+        """ without LAZYTHUMBS_ENCODER_PROFILES every format follows the global flags """
+        for img_format in ('JPEG', 'PNG'):
+            params = get_save_params(Image.new('RGB', (640, 480)), img_format, 80)
+            self.assertEqual((params['optimize'], params['progressive']), (False, False))
+
+
+class TestEncode(TestCase):
+
+    def setUp(self):
+        encoding.fallbacks.clear()
+
+    def test_fallback_recorded(self):
+        img = Image.new('RGB', (20, 20))
+        params = {'format': 'JPEG', 'quality': 60, 'optimize': True}
+        save = img.save
+
+        def fail_with_options(buf, **kwargs):
+            if 'optimize' in kwargs:
+                raise IOError('encoder error -2 when writing image file')
+            save(buf, **kwargs)
+
+        with patch.object(img, 'save', side_effect=fail_with_options) as mock_save:
+            data = encode(img, params, 'lt_cache/resize/20/a.jpg')
+        self.assertEqual(Image.open(StringIO(data)).format, 'JPEG')
+        # the quality is kept
+        self.assertEqual(mock_save.call_args[1], {'format': 'JPEG', 'quality': 60})
+        self.assertEqual(len(encoding.fallbacks), 1)
+        self.assertEqual(encoding.fallbacks[0][1:3], ('lt_cache/resize/20/a.jpg', (20, 20)))
+
+    def test_large_progressive(self):
+        """ a noisy optimized progressive JPEG is encoded once, without falling back """
+        img = Image.effect_noise((1200, 900), 64).convert('RGB')
+        data = encode(img, {'format': 'JPEG', 'quality': 95, 'optimize': True, 'progressive': True})
+        self.assertEqual(Image.open(StringIO(data)).size, (1200, 900))
+        self.assertEqual(len(encoding.fallbacks), 0)
@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from django.core.files.base import ContentFile
+from mock import Mock, patch
+from PIL import Image
+
+from lazythumbs import views
+from lazythumbs.admission import RenderRejected
+from lazythumbs.deadline import DeadlineExceeded
+from lazythumbs.executor import RenderCrashed, RenderPool, RenderThreads
+from lazythumbs.missing import missing_sources
+from lazythumbs.tests.test_server import MockCache
+from lazythumbs.views import LazyThumbRenderer, action
+
+
+class CrashingRenderer(LazyThumbRenderer):
+
+    @action
+    def crash(self, width, height, img_path=None, img=None):
+        os._exit(1)
+
+    @action
+    def hang(self, width, height, img_path=None, img=None):
+        time.sleep(10)
+
+    @action
+    def pid(self, width, height, img_path=None, img=None):
+        return Image.new('L', (os.getpid() % 1000 + 1, 1))
+
+    @action
+    def torn(self, width, height, img_path=None, img=None):
+        return Image.new('L', (width, height))
+
+    def _save(self, raw_data, rendered_path, index_entry=None):
+        if '/torn/' not in rendered_path:
+            return super(CrashingRenderer, self)._save(raw_data, rendered_path, index_entry)
+        # die halfway through writing the rendition
+        self.fs.save(rendered_path, ContentFile(raw_data[:len(raw_data) // 2]))
+        os._exit(1)
+
+
+class TestRenderPool(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (400, 300)).save(os.path.join(self.media_root, 'a.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.locks.settings'),
+        ]
+        for patcher in self.patchers:
+            mock_settings = patcher.start()
+            mock_settings.MEDIA_ROOT = self.media_root
+            mock_settings.MEDIA_URL = 'http://media.example.com/media/'
+        self.patchers.append(patch('lazythumbs.views.cache', MockCache()))
+        self.patchers[-1].start()
+        missing_sources.clear()
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.stop()
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def get_pool(self, size=1, max_tasks=None, timeout=10):
+        pool = RenderPool(size, max_tasks, timeout)
+        self.pools.append(pool)
+        return pool
+
+    def render(self, pool, action, width=100, height=100):
+        rendered_path = 'lt_cache/%s/%s/%s/a.jpg' % (action, width, height)
+        return pool.render(CrashingRenderer, action, width, height, 'a.jpg', rendered_path, 80)
+
+    def test_render(self):
+        pool = self.get_pool()
+        raw_data = self.render(pool, 'resize')
+        with open(os.path.join(self.media_root, 'lt_cache/resize/100/100/a.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), raw_data)
+
+    def test_errors(self):
+        """ exceptions of the render are raised in the web worker """
+        pool = self.get_pool()
+        self.assertRaises(ValueError, self.render, pool, 'thumbnail')
+        os.unlink(os.path.join(self.media_root, 'a.jpg'))
+        self.assertRaises(IOError, self.render, pool, 'resize')
+
+    def test_crash(self):
+        pool = self.get_pool()
+        self.assertRaises(RenderCrashed, self.render, pool, 'crash')
+        # the process was replaced
+        self.assertTrue(self.render(pool, 'resize'))
+
+    def test_dead_while_idle(self):
+        """ a process that died between renders is replaced before it gets one """
+        pool = self.get_pool()
+        pool.start()
+        process = pool.idle.queue[0]
+        process.process.terminate()
+        process.process.join()
+        self.assertTrue(self.render(pool, 'resize'))
+        self.assertFalse(pool.idle.queue[0] is process)
+
+    def test_send_fails(self):
+        """ a render that can't be handed to a process is retried on a new one """
+        pool = self.get_pool()
+        pool.start()
+        process = pool.idle.queue[0]
+        process.conn.close()
+        process.conn = Mock(send=Mock(side_effect=IOError(32, 'Broken pipe')))
+        self.assertTrue(self.render(pool, 'resize'))
+        self.assertFalse(process.usable)
+
+    def test_timeout(self):
+        pool = self.get_pool(timeout=0.2)
+        self.assertRaises(RenderCrashed, self.render, pool, 'hang')
+        self.assertTrue(self.render(pool, 'resize'))
+
+    def test_max_tasks(self):
+        pool = self.get_pool(max_tasks=2)
+        sizes = [
+            Image.open(os.path.join(self.media_root, 'lt_cache/pid/%d/1/a.jpg' % width)).size
+            for width in (1, 2, 3) if self.render(pool, 'pid', width, 1)
+        ]
+        self.assertEqual(sizes[0], sizes[1])
+        self.assertNotEqual(sizes[1], sizes[2])
+
+    def test_view(self):
+        pool = self.get_pool()
+        renderer = CrashingRenderer()
+        with patch('lazythumbs.views.RENDER_PROCESSES', 1), patch('lazythumbs.views.render_pool', pool):
+            req = Mock(path='/lt_cache/resize/100/100/a.jpg', META={})
+            self.assertEqual(renderer.get(req, 'resize', '100/100', 'a.jpg').status_code, 200)
+            req = Mock(path='/lt_cache/crash/100/100/a.jpg', META={})
+            self.assertEqual(renderer.get(req, 'crash', '100/100', 'a.jpg').status_code, 503)
+            # no 404 is cached for the rendition
+            self.assertFalse(1 in views.cache.cache.values())
+
+    def test_killed_while_saving(self):
+        """ a partly written rendition isn't left behind to be served """
+        pool = self.get_pool()
+        renderer = CrashingRenderer()
+        with patch('lazythumbs.views.RENDER_PROCESSES', 1), patch('lazythumbs.views.render_pool', pool):
+            req = Mock(path='/lt_cache/torn/100/100/a.jpg', META={})
+            self.assertEqual(renderer.get(req, 'torn', '100/100', 'a.jpg').status_code, 503)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'lt_cache/torn/100/100/a.jpg')))
+
+
+class TestRenderThreads(TestCase):
+
+    def test_runs(self):
+        threads = RenderThreads(2, 1)
+        release = threading.Event()
+
+        def render():
+            release.wait(5)
+            return 'data'
+
+        future = threads.submit(render)
+        self.assertRaises(DeadlineExceeded, future.result, 0.01)
+        release.set()
+        self.assertEqual(future.result(5), 'data')
+        self.assertEqual(len(threads.threads), 2)
+
+    def test_queue_full(self):
+        """ renders that don't fit in the queue are rejected """
+        threads = RenderThreads(1, 1)
+        started, release = threading.Event(), threading.Event()
+
+        def render():
+            started.set()
+            release.wait(5)
+
+        running = threads.submit(render)
+        self.assertTrue(started.wait(5))
+        waiting = threads.submit(render)
+        self.assertRaises(RenderRejected, threads.submit, render)
+        release.set()
+        running.result(5)
+        waiting.result(5)
+        threads.jobs.join()
+        threads.submit(render).result(5)
+
+    def test_raises(self):
+        def render():
+            raise IOError('corrupt')
+        future = RenderThreads(1, 1).submit(render)
+        self.assertRaises(IOError, future.result, 5)
+
+    def test_view(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        Image.new('RGB', (400, 300)).save(os.path.join(media_root, 'a.jpg'))
+        for name in ('django.core.files.storage.settings', 'lazythumbs.views.settings', 'lazythumbs.locks.settings'):
+            patcher = patch(name)
+            patcher.start().MEDIA_ROOT = media_root
+            self.addCleanup(patcher.stop)
+        missing_sources.clear()
+        threads = RenderThreads(1, 1)
+        with patch('lazythumbs.views.RENDER_THREADS', 1), patch('lazythumbs.views.render_threads', threads):
+            with patch('lazythumbs.views.cache', MockCache()):
+                req = Mock(path='/lt_cache/resize/100/100/a.jpg', META={})
+                resp = LazyThumbRenderer().get(req, 'resize', '100/100', 'a.jpg')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(threads.threads), 1)
@@ -0,0 +1,106 @@
+from unittest import TestCase
+
+from PIL import Image
+
+from lazythumbs.geometry import Plan, get_fit_size, get_thumbnail_size, unchanged
+from lazythumbs.geometry import plan_aresize, plan_matte, plan_resize, plan_scale, plan_thumbnail
+from lazythumbs.views import LazyThumbRenderer
+
+MATTE = (255, 255, 255)
+
+
+class TestPlans(TestCase):
+    """ the actions' geometry, without decoding any images """
+
+    def test_thumbnail(self):
+        self.assertEqual(get_thumbnail_size((1000, 500), width=100), (100, 50))
+        self.assertEqual(get_thumbnail_size((1000, 500), height=100), (200, 100))
+        # never scaled up
+        self.assertEqual(get_thumbnail_size((1000, 500), width=2000), (1000, 500))
+        self.assertRaises(ValueError, get_thumbnail_size, (1000, 500), 100, 100)
+        self.assertRaises(ValueError, get_thumbnail_size, (1000, 500))
+        self.assertEqual(
+            plan_thumbnail((1000, 500), width=100),
+            Plan((0, 0, 1000, 500), (100, 50), None, (0, 0), None)
+        )
+
+    def test_scale(self):
+        self.assertEqual(plan_scale((1000, 500), 100, 600).size, (100, 500))
+        self.assertFalse(plan_scale((1000, 500), 1000, 500).scaled)
+
+    def test_resize_crops_in_the_resample(self):
+        plan = plan_resize((1000, 500), 100, 100)
+        # thumbnails to 200x100, then takes the center 100x100
+        self.assertEqual(plan, Plan((250, 0, 750, 500), (100, 100), None, (0, 0), None))
+        self.assertTrue(plan.scaled)
+
+    def test_decoded(self):
+        plan = plan_resize((1000, 500), 100, 100)
+        self.assertTrue(plan.decoded((1000, 500), (1000, 500)) is plan)
+        self.assertEqual(
+            plan.decoded((1000, 500), (250, 125)),
+            Plan((62.5, 0, 187.5, 125), (100, 100), None, (0, 0), None)
+        )
+
+    def test_resize_small_source(self):
+        self.assertEqual(plan_resize((100, 80), 200, 200), unchanged((100, 80)))
+        # taller than the source: cropped out of the unscaled source
+        self.assertEqual(
+            plan_resize((100, 80), 50, 100),
+            Plan((25, -10, 75, 90), (50, 100), None, (0, 0), None)
+        )
+
+    def test_mresize_fills_out(self):
+        self.assertEqual(
+            plan_resize((100, 80), 200, 200, allow_undersized=True),
+            Plan((-50, -60, 150, 140), (200, 200), None, (0, 0), None)
+        )
+        # scaled to width 50, 100 tall, on a canvas for the rest
+        plan = plan_resize((100, 200), 50, 150, allow_undersized=True)
+        self.assertEqual(plan, Plan((0, 0, 100, 200), (50, 100), (50, 150), (0, 25), None))
+
+    def test_aresize(self):
+        # same orientation, cropped
+        self.assertEqual(
+            plan_aresize((1500, 1000), 750, 400, MATTE),
+            Plan((0, 100, 1500, 900), (750, 400), None, (0, 0), MATTE)
+        )
+        # opposite orientation, matted
+        self.assertEqual(
+            plan_aresize((1000, 2000), 600, 500, MATTE),
+            Plan((0, 0, 1000, 2000), (250, 500), (600, 500), (175, 0), MATTE)
+        )
+        # same orientation, not cropped
+        self.assertEqual(
+            plan_aresize((2000, 1000), 600, 500, MATTE, crop_img=False),
+            Plan((0, 0, 2000, 1000), (600, 300), (600, 500), (0, 100), MATTE)
+        )
+        self.assertEqual(plan_aresize((600, 500), 600, 500, MATTE), unchanged((600, 500)))
+
+    def test_aresize_small(self):
+        plan = plan_aresize((100, 80), 300, 200, MATTE)
+        self.assertEqual(plan, Plan((0, 0, 100, 80), (100, 80), (300, 200), (100, 60), MATTE))
+        self.assertFalse(plan.scaled)
+
+    def test_matte(self):
+        self.assertEqual(get_fit_size((1000, 500), 100, 100), (100, 50))
+        self.assertEqual(get_fit_size((50, 500), 100, 100), (10, 100))
+        self.assertEqual(
+            plan_matte((1000, 500), 100, 100, MATTE),
+            Plan((0, 0, 1000, 500), (100, 50), (100, 100), (0, 25), MATTE)
+        )
+
+    def test_execute(self):
+        renderer = LazyThumbRenderer()
+        img = Image.new('L', (100, 80), 255)
+
+        result = renderer.execute(img, plan_aresize((100, 80), 300, 200, MATTE))
+        self.assertEqual((result.mode, result.size), ('RGB', (300, 200)))
+        self.assertEqual(result.getpixel((0, 0)), MATTE)
+        self.assertEqual(result.getpixel((150, 100)), (255, 255, 255))
+
+        result = renderer.execute(img, plan_resize((100, 80), 200, 200, allow_undersized=True))
+        self.assertEqual((result.mode, result.size), ('L', (200, 200)))
+        self.assertEqual(result.getpixel((0, 0)), 0)
+
+        self.assertTrue(renderer.execute(img, unchanged((100, 80))) is img)
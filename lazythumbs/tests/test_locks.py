@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from lazythumbs import locks
+from lazythumbs.locks import SingleFlight, render_lock, get_lock_path
+from lazythumbs.views import LazyThumbRenderer
+
+
+class TestSingleFlight(TestCase):
+
+    def test_exclusive(self):
+        """ a held key can't be acquired again until it is released """
+        flight = SingleFlight()
+        self.assertTrue(flight.acquire('a', 1))
+        self.assertFalse(flight.acquire('a', 0.01))
+        self.assertTrue(flight.acquire('b', 0.01))
+        flight.release('a')
+        self.assertTrue(flight.acquire('a', 0.01))
+
+    def test_waiter_wakes_on_release(self):
+        flight = SingleFlight()
+        flight.acquire('a', 1)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(flight.acquire('a', 5)))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(acquired, [])
+        flight.release('a')
+        waiter.join()
+        self.assertEqual(acquired, [True])
+
+
+class TestRenderLock(TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.patcher = patch('lazythumbs.locks.RENDER_LOCK_DIR', self.lock_dir)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.lock_dir)
+
+    def test_lock_file_lifecycle(self):
+        """ the lock file exists while the lock is held and is removed after """
+        path = get_lock_path('lt_cache/resize/10/10/a.jpg')
+        with render_lock('lt_cache/resize/10/10/a.jpg') as locked:
+            self.assertTrue(locked)
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_lock_timeout(self):
+        """ a lock file held elsewhere makes us give up after the timeout """
+        path = get_lock_path('a.jpg')
+        fd = locks.acquire_file_lock(path, time.time() + 1)
+        try:
+            with render_lock('a.jpg', timeout=0.1) as locked:
+                self.assertFalse(locked)
+        finally:
+            locks.release_file_lock(path, fd)
+
+    def test_disabled(self):
+        with patch('lazythumbs.locks.RENDER_LOCK', False):
+            with render_lock('a.jpg') as locked:
+                self.assertFalse(locked)
+        self.assertEqual(os.listdir(self.lock_dir), [])
+
+    def test_one_render_for_concurrent_requests(self):
+        """ concurrent misses for one rendition render it exactly once """
+        renderer = LazyThumbRenderer()
+        rendered = {}
+        renders = []
+
+        def fake_open(path):
+            if path not in rendered:
+                raise IOError('missing')
+            return Mock(read=Mock(return_value=rendered[path]))
+
+        def fake_render(action, width, height, source_path, rendered_path, quality):
+            renders.append(rendered_path)
+            time.sleep(0.05)
+            rendered[rendered_path] = 'data'
+            return 'data'
+
+        renderer.fs.open = fake_open
+        renderer._render_and_save = fake_render
+        responses = []
+        req = Mock(path='/lt_cache/resize/10/10/i/p.jpg')
+
+        def fetch():
+            responses.append(renderer.get(req, 'resize', '10/10', 'i/p.jpg'))
+
+        with patch('lazythumbs.views.cache', Mock(get=Mock(return_value=None))):
+            threads = [threading.Thread(target=fetch) for i in range(5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(renders, ['lt_cache/resize/10/10/i/p.jpg'])
+        self.assertEqual([r.content for r in responses], ['data'] * 5)
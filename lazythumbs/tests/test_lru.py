@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+from PIL import Image
+
+from lazythumbs.lru import LRUCache, DecodedImageCache, get_image_cost
+
+
+class TestLRUCache(TestCase):
+
+    def test_get_set(self):
+        lru = LRUCache(10)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('b', 'default'), 'default')
+        self.assertEqual(lru.stats()['hits'], 1)
+        self.assertEqual(lru.stats()['misses'], 1)
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(3)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.set('c', 3)
+        lru.get('a')
+        lru.set('d', 4)
+        self.assertTrue('a' in lru)
+        self.assertFalse('b' in lru)
+        self.assertEqual(len(lru), 3)
+
+    def test_cost_budget(self):
+        lru = LRUCache(10)
+        lru.set('a', 'x', cost=6)
+        lru.set('b', 'y', cost=6)
+        self.assertFalse('a' in lru)
+        self.assertEqual(lru.cost, 6)
+        # items bigger than the whole budget are never stored
+        lru.set('c', 'z', cost=11)
+        self.assertFalse('c' in lru)
+        self.assertTrue('b' in lru)
+
+    def test_replace_and_delete(self):
+        lru = LRUCache(10)
+        lru.set('a', 1, cost=4)
+        lru.set('a', 2, cost=5)
+        self.assertEqual(lru.cost, 5)
+        lru.delete('a')
+        self.assertEqual(lru.cost, 0)
+        self.assertEqual(len(lru), 0)
+
+    def test_disabled(self):
+        lru = LRUCache(0)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), None)
+
+
+class TestDecodedImageCache(TestCase):
+
+    def test_hit_returns_copy(self):
+        cache = DecodedImageCache(10 ** 6)
+        img = Image.new('RGB', (100, 50))
+        cache.set_image('k', (100, 50), img)
+        self.assertEqual(cache.cost, get_image_cost(img))
+        hit = cache.get_image('k', 10, 10)
+        self.assertEqual(hit.size, (100, 50))
+        self.assertFalse(hit is img)
+        self.assertEqual(cache.hits, 1)
+
+    def test_draft_entry_too_small(self):
+        """ a reduced scale decode can't serve a larger geometry """
+        cache = DecodedImageCache(10 ** 6)
+        cache.set_image('k', (800, 400), Image.new('RGB', (100, 50)))
+        self.assertEqual(cache.get_image('k', 400, 200), None)
+        self.assertTrue(cache.get_image('k', 100, None) is not None)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from django.conf import settings
+from mock import patch
+from PIL import Image
+
+from lazythumbs.management.commands import lazythumbs_scan_metadata
+from lazythumbs.metadata import SourceMetadataIndex
+from lazythumbs.util import compute_img
+from lazythumbs.views import LazyThumbRenderer
+
+
+class MetadataTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.media_root = os.path.join(self.tmp, 'media')
+        os.makedirs(os.path.join(self.media_root, 'lt_cache'))
+        Image.new('RGB', (400, 300)).save(os.path.join(self.media_root, 'a.jpg'))
+        Image.new('P', (40, 30)).save(os.path.join(self.media_root, 'lt_cache', 'b.gif'))
+        self.index = SourceMetadataIndex()
+        self.patchers = [
+            patch('lazythumbs.metadata.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.management.commands.lazythumbs_scan_metadata.settings'),
+        ]
+        for patcher in self.patchers:
+            patcher.start().MEDIA_ROOT = self.media_root
+        for name in ('util', 'views', 'management.commands.lazythumbs_scan_metadata'):
+            patcher = patch('lazythumbs.%s.metadata_index' % name, self.index)
+            patcher.start()
+            self.patchers.append(patcher)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp)
+
+
+class TestSourceMetadataIndex(MetadataTestCase):
+
+    def test_db_next_to_media_root(self):
+        self.assertEqual(self.index.get_db_path(), os.path.join(self.tmp, 'lazythumbs_metadata.sqlite3'))
+
+    def test_set_get(self):
+        self.assertEqual(self.index.get('a.jpg'), None)
+        self.index.set('a.jpg', 400, 300, 'JPEG', 'RGB', 10.5)
+        self.assertEqual(self.index.get('a.jpg'), {
+            'path': 'a.jpg', 'width': 400, 'height': 300, 'format': 'JPEG', 'mode': 'RGB', 'mtime': 10.5,
+        })
+        self.index.delete('a.jpg')
+        self.assertEqual(self.index.get('a.jpg'), None)
+
+    def test_unusable_db(self):
+        """ an index that can't be opened is logged and skipped, not raised """
+        index = SourceMetadataIndex(os.path.join(self.tmp, 'missing', 'metadata.sqlite3'))
+        index.set('a.jpg', 400, 300, 'JPEG', 'RGB', 10.5)
+        self.assertEqual(index.get('a.jpg'), None)
+        index.delete('a.jpg')
+
+    def test_record(self):
+        self.index.record('a.jpg', Image.open(os.path.join(self.media_root, 'a.jpg')), 10)
+        self.assertEqual(self.index.get('a.jpg')['width'], 400)
+        self.assertEqual(self.index.get('a.jpg')['format'], 'JPEG')
+
+    def test_filled_at_render_time(self):
+        with patch('lazythumbs.views.METADATA_INDEX', True):
+            LazyThumbRenderer().resize(100, 100, img_path='a.jpg')
+        self.assertEqual(self.index.get('a.jpg')['height'], 300)
+
+
+class TestComputeImgMetadata(MetadataTestCase):
+
+    def setUp(self):
+        super(TestComputeImgMetadata, self).setUp()
+        self.mtime = os.stat(os.path.join(self.media_root, 'a.jpg')).st_mtime
+        self.index.set('a.jpg', 400, 300, 'JPEG', 'RGB', self.mtime)
+        self.patchers.append(patch('lazythumbs.util.METADATA_INDEX', True))
+        self.patchers[-1].start()
+
+    def test_thumbnail_height(self):
+        """ plain urls get their thumbnail height from the index """
+        attrs = compute_img(settings.MEDIA_URL + 'a.jpg', 'thumbnail', '200')
+        self.assertEqual(attrs['width'], '200')
+        self.assertEqual(attrs['height'], '150')
+
+    def test_source_smaller(self):
+        """ no rendition is requested for sources that are already small enough """
+        attrs = compute_img(settings.MEDIA_URL + 'a.jpg', 'resize', '500x500')
+        self.assertEqual(attrs['src'], settings.MEDIA_URL + 'a.jpg')
+        self.assertEqual(attrs['width'], '400')
+        self.assertEqual(attrs['height'], '300')
+
+    def test_source_replaced(self):
+        """ dimensions indexed for an older version of the source aren't used """
+        os.utime(os.path.join(self.media_root, 'a.jpg'), (self.mtime + 10, self.mtime + 10))
+        attrs = compute_img(settings.MEDIA_URL + 'a.jpg', 'thumbnail', '200')
+        self.assertEqual(attrs['height'], '')
+
+    def test_not_indexed(self):
+        attrs = compute_img(settings.MEDIA_URL + 'other.jpg', 'thumbnail', '200')
+        self.assertTrue('lt_cache' in attrs['src'])
+        self.assertEqual(attrs['height'], '')
+
+
+class TestScanMetadataCommand(MetadataTestCase):
+
+    def test_scan_media_root(self):
+        with open(os.path.join(self.media_root, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+        command = lazythumbs_scan_metadata.Command()
+        command.stdout = StringIO()
+        command.handle()
+        self.assertEqual(command.stdout.getvalue(), '1 sources indexed, 1 skipped\n')
+        self.assertEqual(self.index.get('a.jpg')['mode'], 'RGB')
+        self.assertEqual(self.index.get('lt_cache/b.gif'), None)
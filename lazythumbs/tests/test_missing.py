@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from mock import patch
+
+from lazythumbs.missing import MissingSourceCache, forget, get_cache_key, missing_sources
+from lazythumbs.tests.test_server import MockCache
+
+
+class TestMissingSourceCache(TestCase):
+
+    def test_add(self):
+        missing = MissingSourceCache(10, 60)
+        self.assertFalse(missing.is_missing('a.jpg'))
+        missing.add('a.jpg')
+        self.assertTrue(missing.is_missing('a.jpg'))
+
+    @patch('lazythumbs.missing.time')
+    def test_ttl(self, mock_time):
+        missing = MissingSourceCache(10, 60)
+        mock_time.time.return_value = 1000
+        missing.add('a.jpg')
+        # never kept longer than the local ttl
+        missing.add('b.jpg', 3600)
+        missing.add('c.jpg', 10)
+        mock_time.time.return_value = 1030
+        self.assertTrue(missing.is_missing('a.jpg'))
+        self.assertTrue(missing.is_missing('b.jpg'))
+        self.assertFalse(missing.is_missing('c.jpg'))
+        mock_time.time.return_value = 1060
+        self.assertFalse(missing.is_missing('a.jpg'))
+        self.assertFalse(missing.is_missing('b.jpg'))
+        self.assertEqual(len(missing), 0)
+
+    def test_size(self):
+        missing = MissingSourceCache(2, 60)
+        for path in ('a.jpg', 'b.jpg', 'c.jpg'):
+            missing.add(path)
+        self.assertFalse(missing.is_missing('a.jpg'))
+        self.assertTrue(missing.is_missing('c.jpg'))
+
+    def test_forget(self):
+        mc = MockCache()
+        mc.delete = mc.cache.pop
+        mc.set(get_cache_key('a.jpg'), 1)
+        missing_sources.add('a.jpg')
+        with patch('lazythumbs.missing.cache', mc):
+            forget('a.jpg')
+        self.assertFalse(missing_sources.is_missing('a.jpg'))
+        self.assertEqual(mc.cache, {})
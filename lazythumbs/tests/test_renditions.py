@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import patch
+from PIL import Image
+
+from lazythumbs.renditions import RenditionIndex, can_derive, find_parent, find_variant, make_entry
+from lazythumbs import views
+from lazythumbs.views import LazyThumbRenderer
+
+
+def entry(action, width, height, size=None, quality=95, img_format='JPEG', derived=False):
+    path = 'lt_cache/%s/%s/%s/a.jpg' % (action, width, height)
+    return make_entry(path, action, width, height, size or (width, height), quality, img_format, derived)
+
+
+class TestCanDerive(TestCase):
+
+    def test_same_action_same_aspect(self):
+        parent = entry('resize', 1200, 800)
+        self.assertTrue(can_derive(parent, 'resize', 300, 200, (6000, 4000)))
+        self.assertTrue(can_derive(parent, 'resize', 1200, 800, (6000, 4000)))
+        self.assertFalse(can_derive(parent, 'resize', 300, 300, (6000, 4000)))
+        self.assertFalse(can_derive(parent, 'aresize', 300, 200, (6000, 4000)))
+        self.assertFalse(can_derive(parent, 'resize', 2400, 1600, (6000, 4000)))
+
+    def test_undersized_parent(self):
+        """ parents of sources smaller than their geometry were never scaled """
+        self.assertFalse(can_derive(entry('resize', 1200, 800), 'resize', 300, 200, (1000, 700)))
+        self.assertFalse(can_derive(entry('resize', 1200, 800, size=(1000, 700)), 'resize', 300, 200, (6000, 4000)))
+
+    def test_thumbnail_parent(self):
+        """ a thumbnail big enough for the decode stands in for the source """
+        parent = entry('thumbnail', 1500, None, size=(1500, 1000))
+        self.assertTrue(can_derive(parent, 'resize', 300, 300, (6000, 4000)))
+        self.assertTrue(can_derive(parent, 'thumbnail', 600, None, (6000, 4000)))
+        self.assertFalse(can_derive(parent, 'resize', 1600, 1000, (6000, 4000)))
+
+    def test_quality_guard(self):
+        self.assertFalse(can_derive(entry('resize', 1200, 800, quality=80), 'resize', 300, 200, (6000, 4000)))
+        self.assertTrue(can_derive(entry('resize', 1200, 800, quality=80), 'resize', 300, 200, (6000, 4000), 80))
+        self.assertTrue(can_derive(entry('resize', 1200, 800, quality=10, img_format='PNG'), 'resize', 300, 200, (6000, 4000)))
+
+    def test_no_derived_parents(self):
+        self.assertFalse(can_derive(entry('resize', 1200, 800, derived=True), 'resize', 300, 200, (6000, 4000)))
+
+    def test_find_smallest(self):
+        entries = [entry('resize', 1200, 800), entry('resize', 600, 400), entry('resize', 60, 40)]
+        self.assertEqual(find_parent(entries, 'resize', 300, 200, (6000, 4000))['width'], 600)
+        self.assertEqual(find_parent(entries, 'scale', 300, 200, (6000, 4000)), None)
+
+    def test_find_variant(self):
+        small, large = entry('resize', 100, 100), entry('resize', 400, 400)
+        thumbnail = entry('thumbnail', 1000, None, size=(1000, 750))
+        entries = [small, large, thumbnail]
+        self.assertTrue(find_variant(entries, 'resize', 200, 200) is large)
+        self.assertTrue(find_variant(entries, 'resize', 50, 50) is small)
+        self.assertTrue(find_variant(entries, 'resize', 800, 800) is large)
+        self.assertTrue(find_variant(entries, 'matte', 200, 200) is large)
+        self.assertTrue(find_variant([thumbnail], 'resize', 200, 200) is thumbnail)
+        self.assertEqual(find_variant([], 'resize', 200, 200), None)
+
+
+class TestRenditionIndex(TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.patcher = patch('lazythumbs.renditions.RENDITION_INDEX_DIR', self.index_dir)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.index_dir)
+
+    def test_add_remove(self):
+        index = RenditionIndex()
+        first, second = entry('resize', 1200, 800), entry('resize', 600, 400)
+        index.add('a.jpg', 10, first)
+        index.add('a.jpg', 10, second)
+        self.assertEqual(sorted(e['width'] for e in index.entries('a.jpg', 10)), [600, 1200])
+        index.remove('a.jpg', 10, first['path'])
+        self.assertEqual(index.entries('a.jpg', 10), [second])
+        self.assertEqual(index.entries('b.jpg', 10), [])
+
+    def test_source_changed(self):
+        index = RenditionIndex()
+        index.add('a.jpg', 10, entry('resize', 1200, 800))
+        self.assertEqual(index.entries('a.jpg', 11), [])
+
+
+class TestDeriveRenditions(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (1600, 1200), (0, 0, 255)).save(os.path.join(self.media_root, 'big.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.renditions.settings'),
+        ]
+        for patcher in self.patchers:
+            patcher.start().MEDIA_ROOT = self.media_root
+        self.patchers.append(patch('lazythumbs.views.DERIVE_RENDITIONS', True))
+        self.patchers[-1].start()
+        self.renderer = LazyThumbRenderer()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def render(self, action, width, height, quality=95):
+        rendered_path = 'lt_cache/%s/%s/%s/big.jpg' % (action, width, height)
+        self.renderer._render_and_save(action, width, height, 'big.jpg', rendered_path, quality)
+        return Image.open(os.path.join(self.media_root, rendered_path))
+
+    def test_derives_from_larger_rendition(self):
+        self.render('resize', 800, 600)
+        with patch.object(self.renderer, 'get_pil_from_path') as get_pil:
+            self.assertEqual(self.render('resize', 400, 300).size, (400, 300))
+        self.assertFalse(get_pil.called)
+
+        source_mtime = os.stat(os.path.join(self.media_root, 'big.jpg')).st_mtime
+        entries = dict((e['width'], e) for e in views.rendition_index.entries('big.jpg', source_mtime))
+        self.assertFalse(entries[800]['derived'])
+        self.assertTrue(entries[400]['derived'])
+
+    def test_low_quality_parent_not_used(self):
+        self.render('resize', 800, 600, quality=60)
+        with patch.object(self.renderer, 'get_pil_from_path', wraps=self.renderer.get_pil_from_path) as get_pil:
+            self.assertEqual(self.render('resize', 400, 300).size, (400, 300))
+        self.assertTrue(get_pil.called)
+
+    def test_same_size_as_from_the_source(self):
+        """ geometry derived from a thumbnail is worked out in source coordinates """
+        Image.new('RGB', (3000, 2000), (0, 0, 255)).save(os.path.join(self.media_root, 'big.jpg'))
+        self.assertEqual(self.render('thumbnail', 1000, None).size, (1000, 666))
+        derived = [self.render('thumbnail', width, None).size for width in (300, 450)]
+        with patch('lazythumbs.views.DERIVE_RENDITIONS', False):
+            direct = [self.renderer.thumbnail(width=width, img_path='big.jpg').size for width in (300, 450)]
+        self.assertEqual(derived, direct)
+        self.assertEqual(derived, [(300, 200), (450, 300)])
+
+    def test_removed_parent(self):
+        self.render('resize', 800, 600)
+        os.remove(os.path.join(self.media_root, 'lt_cache/resize/800/600/big.jpg'))
+        self.assertEqual(self.render('resize', 400, 300).size, (400, 300))
@@ -0,0 +1,132 @@
+import random
+from unittest import TestCase
+
+from mock import patch
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageStat
+
+from lazythumbs.resample import get_reduce_factors, get_tier, reduce, resample, resize, split
+from lazythumbs.views import LazyThumbRenderer
+
+
+def photo(size):
+    """ smooth areas and edges, like a photo """
+    random.seed(0)
+    img = Image.new('RGB', size)
+    draw = ImageDraw.Draw(img)
+    for _ in range(100):
+        x, y = random.randint(0, size[0]), random.randint(0, size[1])
+        r = random.randint(2, max(size) // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(random.randint(0, 255) for _ in range(3)))
+    return img.filter(ImageFilter.GaussianBlur(2))
+
+
+def mean_difference(a, b):
+    return sum(ImageStat.Stat(ImageChops.difference(a, b)).mean) / 3
+
+
+class TestResample(TestCase):
+
+    def test_reduce_factors(self):
+        self.assertEqual(get_reduce_factors((4000, 3000), (200, 150), 3.0), (6, 6))
+        self.assertEqual(get_reduce_factors((4000, 3000), (200, 1000), 3.0), (6, 1))
+        self.assertEqual(get_reduce_factors((500, 500), (200, 200), 2.0), (1, 1))
+
+    def test_reduce_rounds_up(self):
+        img = Image.new('RGB', (101, 50))
+        self.assertEqual(reduce(img, (4, 3)).size, (26, 17))
+
+    @patch('lazythumbs.resample.RESAMPLE_TIER', 'balanced')
+    @patch('lazythumbs.resample.RESAMPLE_ACTION_TIERS', {'matte': 'fast'})
+    def test_tiers(self):
+        self.assertEqual(get_tier('resize'), 'balanced')
+        self.assertEqual(get_tier('matte'), 'fast')
+        with patch('lazythumbs.resample.RESAMPLE_TIER', 'fastest'):
+            self.assertRaises(ValueError, get_tier, 'resize')
+
+    def test_quality_tier_unchanged(self):
+        """ the quality tier is a plain ANTIALIAS resize """
+        img = photo((800, 600))
+        expected = img.resize((40, 30), Image.ANTIALIAS)
+        self.assertEqual(mean_difference(resample(img, (40, 30), 'quality'), expected), 0)
+
+    def test_visual_difference(self):
+        """ the faster tiers stay close to the output of the quality tier """
+        img = photo((2000, 1500))
+        for size in ((100, 75), (400, 300), (1000, 750)):
+            expected = resample(img, size, 'quality')
+            for tier, tolerance in (('balanced', 1.0), ('fast', 3.0)):
+                result = resample(img, size, tier)
+                self.assertEqual(result.size, size)
+                self.assertTrue(mean_difference(result, expected) < tolerance, (size, tier))
+
+    def test_palette_not_reduced(self):
+        img = Image.new('P', (400, 400))
+        with patch('lazythumbs.resample.reduce') as mock_reduce:
+            self.assertEqual(resample(img, (20, 20), 'fast').size, (20, 20))
+        self.assertFalse(mock_reduce.called)
+
+    @patch('lazythumbs.resample.RESAMPLE_ACTION_TIERS', {'matte': 'fast'})
+    def test_action_tier(self):
+        renderer = LazyThumbRenderer()
+        img = photo((400, 200))
+        renderer.resample_tier = get_tier('matte')
+        with patch('lazythumbs.views.resample', wraps=resample) as mock_resample:
+            result = renderer.matte(width=100, height=100, img=img)
+        self.assertEqual(result.size, (100, 100))
+        self.assertEqual(mock_resample.call_args[0][1:3], ((100, 50), 'fast'))
+        # the source is left alone
+        self.assertEqual(img.size, (400, 200))
+
+
+class TestTiledResize(TestCase):
+
+    def setUp(self):
+        self.img = Image.effect_noise((601, 1203), 80).convert('RGB')
+
+    def assertIdentical(self, a, b):
+        self.assertEqual((a.mode, a.size), (b.mode, b.size))
+        self.assertEqual(ImageChops.difference(a, b).getbbox(), None)
+
+    def test_split(self):
+        self.assertEqual(split(0, 10, 3), [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(split(5, 7, 4), [(5, 6), (6, 7)])
+
+    @patch('lazythumbs.resample.TILED_RESIZE_PIXELS', 1)
+    @patch('lazythumbs.resample.TILED_RESIZE_THREADS', 3)
+    def test_pixel_identical(self):
+        """ tiled resizes are pixel identical to single resizes """
+        for mode in ('RGB', 'RGBA', 'L'):
+            img = self.img.convert(mode)
+            for resample_filter in (Image.ANTIALIAS, Image.BILINEAR, Image.BICUBIC, Image.BOX):
+                for size, box in (
+                    ((100, 200), None),
+                    ((601, 600), None),
+                    ((300, 401), (0, 0, 601, 1203)),
+                    ((80, 160), (12, 40.5, 590, 1200)),
+                    ((150, 300), (0.75, 1.5, 600, 1201.5)),
+                    ((333, 77), (10.5, 33.25, 590, 1000.7)),
+                    ((600, 1100), (0, 0, 601, 1203)),
+                ):
+                    expected = img.resize(size, resample_filter, box)
+                    self.assertIdentical(resize(img, size, resample_filter, box), expected)
+
+    @patch('lazythumbs.resample.TILED_RESIZE_PIXELS', 1000)
+    @patch('lazythumbs.resample.TILED_RESIZE_THREADS', 2)
+    def test_gated_on_pixels(self):
+        big, small = Image.new('RGB', (100, 100)), Image.new('RGB', (10, 10))
+        with patch.object(big, 'resize', wraps=big.resize) as mock_resize:
+            resize(big, (50, 50), Image.ANTIALIAS)
+        self.assertFalse(mock_resize.called)
+        with patch.object(small, 'resize', wraps=small.resize) as mock_resize:
+            resize(small, (5, 5), Image.ANTIALIAS)
+        self.assertEqual(mock_resize.call_count, 1)
+
+    @patch('lazythumbs.resample.TILED_RESIZE_PIXELS', 1)
+    @patch('lazythumbs.resample.TILED_RESIZE_THREADS', 4)
+    def test_actions(self):
+        renderer = LazyThumbRenderer()
+        for action in ('thumbnail', 'matte', 'resize'):
+            kwargs = {'width': 150} if action == 'thumbnail' else {'width': 150, 'height': 100}
+            with patch('lazythumbs.resample.TILED_RESIZE_PIXELS', 0):
+                expected = getattr(renderer, action)(img=self.img, **kwargs)
+            self.assertIdentical(getattr(renderer, action)(img=self.img, **kwargs), expected)
@@ -2,11 +2,17 @@ import errno
 import os
 import shutil
 import tempfile
+from StringIO import StringIO
 from unittest import TestCase
 
 from mock import Mock, patch
+from PIL import Image
 
-from lazythumbs.views import LazyThumbRenderer, action
+from lazythumbs.lru import DecodedImageCache
+from lazythumbs.missing import missing_sources, get_cache_key
+from lazythumbs.spec import RenditionSpec, parse_rendition_path
+from lazythumbs.util import get_storage_path
+from lazythumbs.views import DEFAULT_QUALITY_URL_PARAM, LazyThumbRenderer, action
 from lazythumbs.urls import urlpatterns
 from django.core.urlresolvers import reverse, resolve
 
@@ -30,8 +36,9 @@ class MockImg(object):
         self.size = (width, height)
         self.mode = "RGB"
 
-    def resize(self, size, _):
+    def resize(self, size, _, box=None):
         self.called.append('resize')
+        self.box = box
         self.size = size
         return self
 
@@ -64,6 +71,89 @@ class TestScale(TestCase):
         self.assertRaises(ValueError, renderer.scale, 200, 200)
 
 
+class TestDraftDecode(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (1600, 1200), (255, 0, 0)).save(
+            os.path.join(self.media_root, 'big.jpg'), 'JPEG')
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root)
+
+    def test_draft_reduces_decode(self):
+        """ a small rendition of a large JPEG is decoded at a reduced scale """
+        renderer = LazyThumbRenderer()
+        with patch('lazythumbs.views.settings') as settings:
+            settings.MEDIA_ROOT = self.media_root
+            img = renderer.get_pil_from_path('big.jpg', 200, None)
+        self.assertEqual(img.size, (200, 150))
+
+    def test_draft_covers_geometry(self):
+        """ the reduced decode is never smaller than the requested geometry """
+        renderer = LazyThumbRenderer()
+        with patch('lazythumbs.views.settings') as settings:
+            settings.MEDIA_ROOT = self.media_root
+            img = renderer.get_pil_from_path('big.jpg', 500, 500)
+        self.assertTrue(img.size[0] >= 500 and img.size[1] >= 500)
+        self.assertEqual(img.size, (800, 600))
+
+    def test_draft_disabled(self):
+        renderer = LazyThumbRenderer()
+        with patch('lazythumbs.views.settings') as settings:
+            settings.MEDIA_ROOT = self.media_root
+            with patch('lazythumbs.views.DRAFT_DECODE', False):
+                img = renderer.get_pil_from_path('big.jpg', 200, None)
+        self.assertEqual(img.size, (1600, 1200))
+
+    def test_actions_render_requested_size(self):
+        """ actions still produce exactly the requested geometry """
+        renderer = LazyThumbRenderer()
+        with patch('lazythumbs.views.settings') as settings:
+            settings.MEDIA_ROOT = self.media_root
+            self.assertEqual(renderer.thumbnail(width=150, img_path='big.jpg').size, (150, 112))
+            self.assertEqual(renderer.resize(100, 100, img_path='big.jpg').size, (100, 100))
+            self.assertEqual(renderer.aresize(300, 100, img_path='big.jpg').size, (300, 100))
+            self.assertEqual(renderer.matte(120, 120, img_path='big.jpg').size, (120, 120))
+            self.assertEqual(renderer.scale(50, 80, img_path='big.jpg').size, (50, 80))
+
+    def test_same_size_as_full_decode(self):
+        """ geometry is worked out from the source's size, not the reduced decode's """
+        renderer = LazyThumbRenderer()
+        for size, action, width, height in [
+            ((4000, 2999), 'thumbnail', 100, None),
+            ((1000, 667), 'thumbnail', 100, None),
+            ((1601, 1067), 'thumbnail', 150, None),
+            ((1601, 1067), 'aresize', 150, 150),
+            ((4000, 2999), 'matte', 100, 100),
+        ]:
+            Image.new('RGB', size, (255, 0, 0)).save(os.path.join(self.media_root, 'odd.jpg'), 'JPEG')
+            with patch('lazythumbs.views.settings') as settings:
+                settings.MEDIA_ROOT = self.media_root
+                img = renderer.get_pil_from_path('odd.jpg', width, height)
+                self.assertNotEqual(img.size, size)
+                drafted = getattr(renderer, action)(width=width, height=height, img=img)
+                with patch('lazythumbs.views.DRAFT_DECODE', False):
+                    full = getattr(renderer, action)(width=width, height=height, img_path='odd.jpg')
+            self.assertEqual(drafted.size, full.size)
+
+    def test_source_cache(self):
+        """ sibling renditions share one decode through the source cache """
+        renderer = LazyThumbRenderer()
+        source_cache = DecodedImageCache(10 ** 8)
+        with patch.object(Image, 'open', Mock(side_effect=Image.open)) as mock_open, \
+                patch('lazythumbs.views.settings') as settings:
+            settings.MEDIA_ROOT = self.media_root
+            with patch('lazythumbs.views.source_cache', source_cache):
+                self.assertEqual(renderer.resize(400, 400, img_path='big.jpg').size, (400, 400))
+                self.assertEqual(renderer.thumbnail(width=150, img_path='big.jpg').size, (150, 112))
+                self.assertEqual(renderer.get_pil_from_path('big.jpg').size, (1600, 1200))
+                self.assertRaises(IOError, renderer.get_pil_from_path, 'missing.jpg')
+        self.assertEqual(source_cache.hits, 1)
+        self.assertEqual(source_cache.misses, 2)
+        self.assertEqual(mock_open.call_count, 2)
+
+
 class RenderTest(TestCase):
     """ test image rendering process """
 
@@ -142,10 +232,10 @@ class RenderTest(TestCase):
         renderer = LazyThumbRenderer()
         mock_img = MockImg()
         img = renderer.resize(width=48, height=50, img=mock_img)
-        self.assertEqual(img.size[1], 50)
-        self.assertEqual(len(mock_img.called), 2)
-        self.assertTrue('crop' in mock_img.called)
-        self.assertTrue('resize' in mock_img.called)
+        self.assertEqual(img.size, (48, 50))
+        # thumbnail to 50x50 and crop, in one resample of the cropped box
+        self.assertEqual(mock_img.called, ['resize'])
+        self.assertEqual(mock_img.box, (20, 0, 980, 1000))
 
     def test_resize_no_img(self):
         renderer = LazyThumbRenderer()
@@ -171,15 +261,17 @@ class RenderTest(TestCase):
         mock_img = MockImg(width=1500, height=1000)
         mock_Image = Mock()
 
-        # aresize 1500x1000 => 750x400 should thumbnail to 750x500 and then
-        # paste into the center of a new image, losing some top/bottom content.
+        # aresize 1500x1000 => 750x400 should thumbnail to 750x500 and
+        # center crop, losing some top/bottom content: a resample of the
+        # source's center 1500x800.
         with patch('lazythumbs.views.Image', mock_Image):
             img = renderer.aresize(width=750, height=400, img=mock_img)
 
         self.assertEqual(mock_img.called, ['resize'])
-        self.assertEqual(img, mock_Image.new.return_value)
-        self.assertEqual(mock_Image.new.call_args[1]['size'], (750, 400))
-        img.paste.assert_called_once_with(mock_img, (0, -50))
+        self.assertEqual(img, mock_img)
+        self.assertEqual(img.size, (750, 400))
+        self.assertEqual(mock_img.box, (0, 100, 1500, 900))
+        self.assertFalse(mock_Image.new.called)
 
     def test_aresize_height(self):
         """
@@ -189,15 +281,17 @@ class RenderTest(TestCase):
         mock_img = MockImg(width=2000, height=1000)
         mock_Image = Mock()
 
-        # aresize 2000x1000 => 1000x800 should thumbnail to 1600x800 and then
-        # paste into the center of a new image, losing some left/right content.
+        # aresize 2000x1000 => 1000x800 should thumbnail to 1600x800 and
+        # center crop, losing some left/right content: a resample of the
+        # source's center 1250x1000.
         with patch('lazythumbs.views.Image', mock_Image):
             img = renderer.aresize(width=1000, height=800, img=mock_img)
 
         self.assertEqual(mock_img.called, ['resize'])
-        self.assertEqual(img, mock_Image.new.return_value)
-        self.assertEqual(mock_Image.new.call_args[1]['size'], (1000, 800))
-        img.paste.assert_called_once_with(mock_img, (-300, 0))
+        self.assertEqual(img, mock_img)
+        self.assertEqual(img.size, (1000, 800))
+        self.assertEqual(mock_img.box, (375, 0, 1625, 1000))
+        self.assertFalse(mock_Image.new.called)
 
     def test_aresize_portrait(self):
         """
@@ -361,6 +455,7 @@ class GetViewTest(TestCase):
         self.mock_img = Mock()
         self.mock_Image.open = Mock(return_value=self.mock_img)
         self.mock_img.size = [1,1]
+        missing_sources.clear()
 
     def test_img_404_warm_cache(self):
         """
@@ -416,6 +511,48 @@ class GetViewTest(TestCase):
         cached = mc.cache[key]
         self.assertEqual(cached, False)
 
+    def test_missing_source_cached_per_source(self):
+        """
+        A missing source is remembered once for all its renditions, and
+        repeated misses are answered without asking the cache backend.
+        """
+        req = Mock(path="/lt_cache/thumbnail/48/i/p.jpg")
+        mc = MockCache()
+        with patch('lazythumbs.views.cache', mc):
+            resp = self.renderer.get(req, 'thumbnail', '48', 'i/p')
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(mc.cache, {get_cache_key('i/p'): 1})
+
+            mc.get = Mock()
+            self.renderer._render_and_save = Mock()
+            req.path = "/lt_cache/resize/20/30/i/p.jpg"
+            resp = self.renderer.get(req, 'resize', '20/30', 'i/p')
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(mc.get.called)
+        self.assertFalse(self.renderer._render_and_save.called)
+
+    def test_missing_source_from_shared_cache(self):
+        """ a source found missing by another process is remembered locally """
+        req = Mock(path="/lt_cache/thumbnail/48/i/p.jpg")
+        mc = MockCache()
+        mc.set(get_cache_key('i/p'), 1)
+        with patch('lazythumbs.views.cache', mc):
+            self.assertEqual(self.renderer.get(req, 'thumbnail', '48', 'i/p').status_code, 404)
+        self.assertTrue(missing_sources.is_missing('i/p'))
+
+    def test_bad_rendition_cached_per_rendition(self):
+        """ a render failure of an existing source only 404s that rendition """
+        req = Mock(path="/lt_cache/thumbnail/48/testdata/testimage.gif")
+        self.renderer._render_and_save = Mock(side_effect=ValueError('bad'))
+        with patch('lazythumbs.views.settings') as mock_settings:
+            mock_settings.MEDIA_ROOT = os.path.dirname(__file__)
+            with patch('lazythumbs.views.cache', MockCache()) as mc:
+                resp = self.renderer.get(req, 'thumbnail', '48', 'testdata/testimage.gif')
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(missing_sources.is_missing('testdata/testimage.gif'))
+        self.assertEqual(mc.cache.values(), [1])
+        self.assertFalse(get_cache_key('testdata/testimage.gif') in mc.cache)
+
     def test_no_img_should_404(self):
         """
         When save fails with EEXIST error, it will try to read the file again
@@ -449,6 +586,235 @@ class GetViewTest(TestCase):
         self.assertEqual(resp.status_code, 404)
 
 
+class TestServeModes(TestCase):
+    """ Test the different ways an already rendered image is sent """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.rendered_path = 'lt_cache/resize/10/10/i/p.jpg'
+        os.makedirs(os.path.join(self.media_root, 'lt_cache/resize/10/10/i'))
+        with open(os.path.join(self.media_root, self.rendered_path), 'wb') as f:
+            f.write('rendered-data')
+        self.patcher = patch('django.core.files.storage.settings')
+        self.patcher.start().MEDIA_ROOT = self.media_root
+        self.renderer = LazyThumbRenderer()
+        self.renderer._render_and_save = Mock()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def get(self, rendered_path=None, **headers):
+        req = Mock(path='/' + (rendered_path or self.rendered_path), META=headers)
+        with patch('lazythumbs.views.cache', MockCache()):
+            return self.renderer.get(req, 'resize', '10/10', 'i/p.jpg')
+
+    @patch('lazythumbs.views.ACCESS_TIME_RESOLUTION', 3600)
+    def test_records_access(self):
+        path = os.path.join(self.media_root, self.rendered_path)
+        os.utime(path, (1000000000, 1000000000))
+        self.get()
+        self.assertTrue(os.stat(path).st_atime > 1000000000)
+        self.assertEqual(os.stat(path).st_mtime, 1000000000)
+
+    def test_source_missing(self):
+        """ renditions on disk are served even once their source is known to be missing """
+        missing_sources.add('i/p.jpg')
+        self.addCleanup(missing_sources.clear)
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, 'rendered-data')
+        # renditions that would have to be rendered still 404
+        resp = self.get('lt_cache/resize/20/20/i/p.jpg')
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(self.renderer._render_and_save.called)
+
+    def test_memory(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, 'rendered-data')
+        self.assertFalse(self.renderer._render_and_save.called)
+
+    @patch('lazythumbs.views.SERVE_MODE', 'stream')
+    def test_stream(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Length'], '13')
+        self.assertEqual(resp['Content-Type'], 'image/jpeg')
+        self.assertTrue('Cache-Control' in resp)
+        self.assertEqual(''.join(resp.streaming_content), 'rendered-data')
+        self.assertFalse(self.renderer._render_and_save.called)
+        # handed to the server's wsgi.file_wrapper where there is one
+        self.assertTrue(resp.file_to_stream is not None)
+
+    @patch('lazythumbs.views.SERVE_MODE', 'x-accel-redirect')
+    def test_x_accel_redirect(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, '')
+        self.assertEqual(resp['X-Accel-Redirect'], '/lazythumbs-internal/' + self.rendered_path)
+        self.assertFalse(self.renderer._render_and_save.called)
+
+    @patch('lazythumbs.views.SERVE_MODE', 'x-sendfile')
+    def test_x_sendfile(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['X-Sendfile'], os.path.join(self.media_root, self.rendered_path))
+
+    @patch('lazythumbs.views.SERVE_MODE', 'x-sendfile')
+    def test_miss_renders(self):
+        """ images that still have to be rendered are sent from memory """
+        self.renderer._render_and_save.return_value = 'new-data'
+        resp = self.get('lt_cache/resize/10/10/i/other.jpg')
+        self.assertEqual(resp.content, 'new-data')
+        self.assertFalse('X-Sendfile' in resp)
+
+
+class TestShardedLayout(TestServeModes):
+    """ Test serving and rendering with LAZYTHUMBS_CACHE_SHARD_DEPTH set """
+
+    def setUp(self):
+        super(TestShardedLayout, self).setUp()
+        self.depth_patcher = patch('lazythumbs.util.CACHE_SHARD_DEPTH', 2)
+        self.depth_patcher.start()
+
+    def tearDown(self):
+        self.depth_patcher.stop()
+        super(TestShardedLayout, self).tearDown()
+
+    def test_legacy_layout_served(self):
+        """ renditions not migrated yet are still found at their url path """
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, 'rendered-data')
+        self.assertFalse(self.renderer._render_and_save.called)
+
+    def test_sharded_layout(self):
+        sharded_path = get_storage_path(self.rendered_path)
+        os.makedirs(os.path.dirname(os.path.join(self.media_root, sharded_path)))
+        with open(os.path.join(self.media_root, sharded_path), 'wb') as f:
+            f.write('sharded-data')
+        self.assertEqual(self.get().content, 'sharded-data')
+
+    def test_render_to_sharded_path(self):
+        os.unlink(os.path.join(self.media_root, self.rendered_path))
+        self.renderer._render_and_save.return_value = 'new-data'
+        self.get()
+        sharded_path = get_storage_path(self.rendered_path)
+        self.assertEqual(self.renderer._render_and_save.call_args[0][4], sharded_path)
+
+
+class TestFormatNegotiation(TestCase):
+    """ Test serving WebP siblings of JPEG renditions to clients that accept them """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (40, 30), 'red').save(os.path.join(self.media_root, 'p.jpg'))
+        Image.new('RGB', (40, 30), 'red').save(os.path.join(self.media_root, 'p.png'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+        ]
+        for patcher in self.patchers:
+            patcher.start().MEDIA_ROOT = self.media_root
+        self.patchers.append(patch('lazythumbs.views.NEGOTIATED_FORMATS', ['WEBP']))
+        self.patchers[-1].start()
+        self.renderer = LazyThumbRenderer()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def get(self, source_path='p.jpg', **headers):
+        req = Mock(path='/lt_cache/resize/10/10/' + source_path, META=headers)
+        with patch('lazythumbs.views.cache', MockCache()):
+            return self.renderer.get(req, 'resize', '10/10', source_path)
+
+    def test_webp(self):
+        resp = self.get(HTTP_ACCEPT='image/avif,image/webp,image/apng,image/*,*/*;q=0.8')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'image/webp')
+        self.assertEqual(resp['Vary'], 'Accept')
+        self.assertEqual(Image.open(StringIO(resp.content)).format, 'WEBP')
+        path = os.path.join(self.media_root, 'lt_cache/resize/10/10/p.jpg.webp')
+        self.assertEqual(Image.open(path).format, 'WEBP')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'lt_cache/resize/10/10/p.jpg')))
+
+    def test_not_accepted(self):
+        for accept in ('image/*,*/*;q=0.8', 'image/webp;q=0', None):
+            resp = self.get(HTTP_ACCEPT=accept) if accept else self.get()
+            self.assertEqual(resp['Content-Type'], 'image/jpeg')
+            self.assertEqual(resp['Vary'], 'Accept')
+            self.assertEqual(Image.open(StringIO(resp.content)).format, 'JPEG')
+
+    def test_not_modified(self):
+        etag = self.get(HTTP_ACCEPT='image/webp')['ETag']
+        resp = self.get(HTTP_ACCEPT='image/webp', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['Vary'], 'Accept')
+
+    def test_png_not_negotiated(self):
+        resp = self.get('p.png', HTTP_ACCEPT='image/webp')
+        self.assertEqual(resp['Content-Type'], 'image/png')
+        self.assertFalse(resp.has_header('Vary'))
+
+    def test_off(self):
+        with patch('lazythumbs.views.NEGOTIATED_FORMATS', []):
+            resp = self.get(HTTP_ACCEPT='image/webp')
+        self.assertEqual(resp['Content-Type'], 'image/jpeg')
+        self.assertFalse(resp.has_header('Vary'))
+
+
+class TestConditionalGet(TestServeModes):
+    """ Test ETag/Last-Modified validators and 304 responses """
+
+    def setUp(self):
+        super(TestConditionalGet, self).setUp()
+        path = os.path.join(self.media_root, self.rendered_path)
+        os.utime(path, (1400000000, 1400000000))
+        self.etag = '"%x-%x"' % (1400000000, len('rendered-data'))
+
+    def test_validators(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['ETag'], self.etag)
+        self.assertEqual(resp['Last-Modified'], 'Tue, 13 May 2014 16:53:20 GMT')
+
+    def test_if_none_match(self):
+        self.renderer.serve_rendered = Mock()
+        resp = self.get(HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], self.etag)
+        self.assertTrue('Cache-Control' in resp)
+        self.assertFalse(self.renderer.serve_rendered.called)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other", %s' % self.etag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+    def test_if_none_match_stale(self):
+        resp = self.get(HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE='Tue, 13 May 2014 16:53:20 GMT')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, 'rendered-data')
+
+    def test_if_modified_since(self):
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE='Tue, 13 May 2014 16:53:20 GMT').status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE='Tue, 13 May 2014 16:53:19 GMT').status_code, 200)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE='garbage').status_code, 200)
+
+    def test_missing_rendition_renders(self):
+        """ conditional headers don't matter until the rendition exists """
+        self.renderer._render_and_save.return_value = 'new-data'
+        resp = self.get('lt_cache/resize/10/10/i/other.jpg', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(self.renderer._render_and_save.called)
+
+    @patch('lazythumbs.views.STALE_WHILE_REVALIDATE', 60)
+    @patch('lazythumbs.views.STALE_IF_ERROR', 86400)
+    def test_stale_directives(self):
+        resp = self.get()
+        self.assertEqual(resp['Cache-Control'], 'public,max-age=60,stale-while-revalidate=60,stale-if-error=86400')
+
+
 class TestOddFiles(TestCase):
 
     def test_extensionless_gif(self):
@@ -482,7 +848,7 @@ class TestOddFiles(TestCase):
                     renderer = LazyThumbRenderer()
                     source_path = os.path.relpath(filename, MEDIA_ROOT)
                     rsp = renderer.get(
-                        request=Mock(path="/thumbnail/x50/" + source_path),
+                        request=Mock(path="/thumbnail/x50/" + source_path, META={}),
                         action="thumbnail",
                         geometry="x50",
                         source_path=source_path
@@ -494,19 +860,6 @@ class TestOddFiles(TestCase):
                         os.remove(filename)
 
 
-def test_paths(routes_to_test=()):
-    for route in routes_to_test:
-        path = route["url_path"]
-        pattern = route["pattern_name"]
-
-        # if kwparams:
-        #     yield reverse(pattern, kwargs=kwparams), path
-        # else:
-        #     yield reverse(pattern), path
-
-        yield resolve(path).url_name, pattern
-
-
 class TestUrlMatching(TestCase):
     """
     Test that urls that are built by the template tag are properly matched by
@@ -515,14 +868,16 @@ class TestUrlMatching(TestCase):
 
     def setUp(self):
         self.routes_to_test = (
-            {'url_path':'/lt/lt_cache/resize/5/p/i.jpg', 'pattern_name':'lt_slash_sep'},
-            {'url_path':'/lt/lt_cache/resize/5/q80/p/i.jpg', 'pattern_name':'lt_slash_sep_w_quality'},
-            {'url_path':'/lt/lt_cache/resize/5/5/p/i.jpg', 'pattern_name':'lt_slash_sep'},
-            {'url_path':'/lt/lt_cache/resize/5/5/q80/p/i.jpg', 'pattern_name':'lt_slash_sep_w_quality'},
-            {'url_path':'/lt/lt_cache/resize/5x5/p/i.jpg', 'pattern_name':'lt_x_sep'},
-            {'url_path':'/lt/lt_cache/resize/5x5/q80/p/i.jpg', 'pattern_name':'lt_x_sep_w_quality'},
-            {'url_path':'/lt/lt_cache/resize/x/5/p/i.jpg', 'pattern_name':'lt_x_width'},
-            {'url_path':'/lt/lt_cache/resize/x/5/q80/p/i.jpg', 'pattern_name':'lt_x_width_w_quality'},
+            ('/lt/lt_cache/resize/5/p/i.jpg', RenditionSpec('resize', 5, 5, 80, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/5/q70/p/i.jpg', RenditionSpec('resize', 5, 5, 70, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/5/6/p/i.jpg', RenditionSpec('resize', 5, 6, 80, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/5/6/q70/p/i.jpg', RenditionSpec('resize', 5, 6, 70, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/5x6/p/i.jpg', RenditionSpec('resize', 5, 6, 80, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/5x6/q70/p/i.jpg', RenditionSpec('resize', 5, 6, 70, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/x/5/p/i.jpg', RenditionSpec('resize', 5, 5, 80, 'p/i.jpg')),
+            ('/lt/lt_cache/resize/x/5/q70/p/i.jpg', RenditionSpec('resize', 5, 5, 70, 'p/i.jpg')),
+            ('/lt/lt_cache/thumbnail/5/p/i.jpg', RenditionSpec('thumbnail', 5, None, 80, 'p/i.jpg')),
+            ('/lt/lt_cache/thumbnail/x/5/p/i.jpg', RenditionSpec('thumbnail', None, 5, 80, 'p/i.jpg')),
         )
 
     @patch('django.conf.settings')
@@ -530,7 +885,28 @@ class TestUrlMatching(TestCase):
         settings.ROOT_URLCONF = urlpatterns
         settings.USE_I18N = False
         routes_tested = 0
-        for path1, path2 in test_paths(self.routes_to_test):
+        for path, spec in self.routes_to_test:
+            match = resolve(path)
+            self.assertEqual(match.url_name, 'lt_cache')
+            self.assertEqual(parse_rendition_path(match.kwargs['rendition']), spec)
+            # the same spec the separately captured parts give
+            geometry = path.split('/')[4:-2]
+            quality = None
+            if geometry[-1].startswith('q'):
+                quality = geometry.pop()
+            self.assertEqual(RenditionSpec.from_args(spec.action, '/'.join(geometry), 'p/i.jpg', quality), spec)
             routes_tested += 1
-            self.assertEqual(path1, path2)
-        self.assertEqual(routes_tested, 8)
+        self.assertEqual(routes_tested, 10)
+
+    def test_default_quality_url_param(self):
+        self.assertEqual(DEFAULT_QUALITY_URL_PARAM, 'q80')
+        self.assertEqual(
+            RenditionSpec.from_args('resize', '5', 'p/i.jpg', DEFAULT_QUALITY_URL_PARAM),
+            RenditionSpec.from_args('resize', '5', 'p/i.jpg'),
+        )
+
+    def test_bad_paths(self):
+        for path in ('resize/5', 'resize/5/', 'resize/5x/p.jpg', 'resize/5/q0/p.jpg', 're-size/5/p.jpg'):
+            self.assertEqual(parse_rendition_path(path), None, path)
+        # a quality-like first path segment is taken as quality, as before
+        self.assertEqual(parse_rendition_path('resize/5/q7/p.jpg').quality, 7)
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import Mock, patch
+from PIL import Image
+
+from lazythumbs import spool
+from lazythumbs.missing import missing_sources
+from lazythumbs.management.commands import lazythumbs_render_spool
+from lazythumbs.tests.test_server import MockCache
+from lazythumbs.views import LazyThumbRenderer, PLACEHOLDER_GIF
+
+
+class SpoolTestCase(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        Image.new('RGB', (400, 300)).save(os.path.join(self.media_root, 'a.jpg'))
+        self.patchers = [
+            patch('django.core.files.storage.settings'),
+            patch('lazythumbs.views.settings'),
+            patch('lazythumbs.spool.settings'),
+        ]
+        for patcher in self.patchers:
+            mock_settings = patcher.start()
+            mock_settings.MEDIA_ROOT = self.media_root
+            mock_settings.MEDIA_URL = 'http://media.example.com/media/'
+        self.cache = MockCache()
+        self.patchers.append(patch('lazythumbs.views.cache', self.cache))
+        self.patchers[-1].start()
+        self.rendered_path = 'lt_cache/resize/100/100/a.jpg'
+        missing_sources.clear()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.media_root)
+
+    def enqueue(self, source_path='a.jpg', rendered_path=None):
+        return spool.enqueue('resize', 100, 100, source_path, rendered_path or self.rendered_path, 80)
+
+
+class TestSpool(SpoolTestCase):
+
+    def test_enqueue_once(self):
+        name = self.enqueue()
+        self.assertEqual(self.enqueue(), name)
+        self.assertEqual(spool.pending(), [name])
+        spool.claim(name)
+        self.enqueue()
+        self.assertEqual(spool.pending(), [])
+
+    def test_claim_once(self):
+        name = self.enqueue()
+        self.assertEqual(spool.claim(name)['source_path'], 'a.jpg')
+        self.assertEqual(spool.claim(name), None)
+
+    def test_reclaim(self):
+        name = self.enqueue()
+        spool.claim(name)
+        self.assertEqual(spool.reclaim(60), 0)
+        claimed = os.path.join(spool.get_spool_dir(), name + spool.CLAIMED_SUFFIX)
+        os.utime(claimed, (time.time() - 120, time.time() - 120))
+        self.assertEqual(spool.reclaim(60), 1)
+        self.assertEqual(spool.pending(), [name])
+
+    def test_run(self):
+        name = self.enqueue()
+        self.assertTrue(spool.run(LazyThumbRenderer(), name))
+        self.assertEqual(Image.open(os.path.join(self.media_root, self.rendered_path)).size, (100, 100))
+        self.assertEqual(os.listdir(spool.get_spool_dir()), [])
+
+    def test_run_missing_source(self):
+        name = self.enqueue('missing.jpg', 'lt_cache/resize/100/100/missing.jpg')
+        self.assertFalse(spool.run(LazyThumbRenderer(), name))
+        self.assertEqual(self.cache.cache.values(), [1])
+
+    def test_worker_pool(self):
+        pool = spool.WorkerPool(1)
+        pool.submit(LazyThumbRenderer, self.enqueue())
+        pool.jobs.join()
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, self.rendered_path)))
+
+    def test_command(self):
+        self.enqueue()
+        command = lazythumbs_render_spool.Command()
+        command.stdout = StringIO()
+        command.handle(once=True, interval=0, reclaim_after=600)
+        self.assertEqual(command.stdout.getvalue(), '1 rendered, 0 failed or claimed elsewhere\n')
+
+
+class TestAsyncRender(SpoolTestCase):
+
+    def setUp(self):
+        super(TestAsyncRender, self).setUp()
+        self.patchers.append(patch('lazythumbs.views.ASYNC_RENDER', True))
+        self.patchers.append(patch('lazythumbs.spool.workers', Mock()))
+        for patcher in self.patchers[-2:]:
+            patcher.start()
+        self.renderer = LazyThumbRenderer()
+        self.renderer._render_and_save = Mock()
+
+    def get(self, source_path='a.jpg'):
+        req = Mock(path='/lt_cache/resize/100/100/%s' % source_path, META={})
+        return self.renderer.get(req, 'resize', '100/100', source_path)
+
+    def test_redirect(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp['Location'], 'http://media.example.com/media/a.jpg')
+        self.assertEqual(resp['Retry-After'], '2')
+        self.assertFalse(self.renderer._render_and_save.called)
+        self.assertEqual(len(spool.pending()), 1)
+        self.assertTrue(spool.workers.submit.called)
+
+    @patch('lazythumbs.views.ASYNC_RENDER_FALLBACK', 'placeholder')
+    def test_placeholder(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'image/gif')
+        self.assertEqual(resp.content, PLACEHOLDER_GIF)
+        self.assertEqual(resp['Cache-Control'], 'public,max-age=2')
+
+    @patch('lazythumbs.views.ASYNC_RENDER_FALLBACK', 'accepted')
+    def test_accepted(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp['Retry-After'], '2')
+
+    def test_missing_source(self):
+        resp = self.get('missing.jpg')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(spool.pending(), [])
+
+    def test_rendered_served(self):
+        spool.run(LazyThumbRenderer(), self.enqueue())
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Image.open(StringIO(resp.content)).size, (100, 100))
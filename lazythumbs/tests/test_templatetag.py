@@ -72,6 +72,11 @@ class LazythumbGeometryCompileTest(TestCase):
         node = node_factory(LazythumbNode, "tag url thumbnail geo as as_var")
         self.assertEqual(type(node.geometry), Variable)
         self.assertEqual(node.geometry.var, 'geo')
+        self.assertEqual(node.compiled, None)
+
+    def test_geo_literal(self):
+        node = node_factory(LazythumbNode, "tag url resize '48x50' quality=70 as as_var")
+        self.assertEqual(node.compiled, (48, 50, 'lt_cache/resize/48x50/q70/'))
 
 
 class LazythumbRenderTest(LazythumbsTemplateTagTestCase):
@@ -92,6 +97,17 @@ class LazythumbRenderTest(LazythumbsTemplateTagTestCase):
         self.assertEqual(img_tag['height'], '50')
         self.assertTrue('url' in img_tag['src'])
 
+    def test_geo_literal_render(self):
+        """ rendering a compiled node repeatedly gives the same url """
+        node = node_factory(LazythumbNode, "tag url resize '48x50' quality=70 as img_tag")
+        self.context['url'] = 'i/p.jpg'
+        with patch('lazythumbs.templatetags.lazythumb.compute_img') as mock_compute_img:
+            node.render(self.mock_cxt)
+            node.render(self.mock_cxt)
+        self.assertEqual(mock_compute_img.call_args_list[0], mock_compute_img.call_args_list[1])
+        self.assertEqual(mock_compute_img.call_args[0][4], 'q70')
+        self.assertEqual(mock_compute_img.call_args[0][5], node.compiled)
+
     def test_resize_invalid_geo(self):
         """
         for a resize, if the geometry reference by the geometry variable is
@@ -4,6 +4,7 @@ from mock import patch, Mock
 
 from django.conf import settings
 from lazythumbs.util import geometry_parse, build_geometry, compute_img, get_img_attrs, get_source_img_attrs
+from lazythumbs.util import get_decode_size, compile_geometry, get_storage_path
 from lazythumbs.util import get_format, get_attr_string, get_placeholder_url, get_img_url
 
 class TestGeometry(TestCase):
@@ -84,6 +85,28 @@ class TestGeometry(TestCase):
         self.assertEqual(build_geometry('thumbnail', None, 20), "x20")
 
 
+class TestGetDecodeSize(TestCase):
+
+    def test_no_geometry(self):
+        """ without a geometry there is nothing to plan for """
+        self.assertEqual(get_decode_size((4000, 3000)), None)
+
+    def test_source_smaller(self):
+        """ sources already at or below the requested size are decoded fully """
+        self.assertEqual(get_decode_size((400, 300), 400, 300), None)
+        self.assertEqual(get_decode_size((400, 300), 800, None), None)
+
+    def test_cover_both_dimensions(self):
+        """ the decode box covers the requested box in both dimensions """
+        self.assertEqual(get_decode_size((4000, 3000), 200, 200), (267, 200))
+        self.assertEqual(get_decode_size((3000, 4000), 200, 200), (200, 267))
+
+    def test_single_dimension(self):
+        """ thumbnail requests only constrain one dimension """
+        self.assertEqual(get_decode_size((4000, 3000), 100, None), (100, 75))
+        self.assertEqual(get_decode_size((4000, 3000), None, 150), (200, 150))
+
+
 class TestComputeIMG(TestCase):
 
     def get_fake_quack(self, url='', width=None, height=None):
@@ -240,6 +263,60 @@ class TestComputeIMG(TestCase):
         self.assertEqual(attrs['src'], "data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw==")
 
 
+class TestCompileGeometry(TestCase):
+
+    def test_compile(self):
+        with patch('lazythumbs.util.settings') as mock_settings:
+            mock_settings.LAZYTHUMBS_USE_X_FOR_DIMENSIONS = False
+            self.assertEqual(compile_geometry('resize', '48x50', 'q70'), (48, 50, 'lt_cache/resize/48/50/q70/'))
+            self.assertEqual(compile_geometry('scale', '48'), (48, 48, 'lt_cache/scale/48/48/'))
+            self.assertEqual(compile_geometry('thumbnail', '48/'), (48, None, 'lt_cache/thumbnail/48/'))
+
+    def test_not_foldable(self):
+        self.assertEqual(compile_geometry('resize', 'responsive'), None)
+        self.assertEqual(compile_geometry('resize', '40x40x40'), None)
+        # height-only thumbnails are keyed by the width computed from the source
+        self.assertEqual(compile_geometry('thumbnail', 'x/50'), None)
+
+    def test_same_as_compute_img(self):
+        """ the compiled fast path builds exactly what compute_img builds """
+        class Img(object):
+            name = 'path/img.jpg'
+            def __init__(self, width, height):
+                self.width = width
+                self.height = height
+
+        things = [
+            'path/img.jpg', settings.MEDIA_URL + 'path/img.jpg', 'http://example.com/media/img.jpg',
+            Img(1000, 800), Img(40, 30), Img(None, None), '',
+        ]
+        cases = [
+            ('resize', '48x50', None), ('resize', '48', 'q30'), ('thumbnail', '48', None),
+            ('thumbnail', '48/', 'q90'), ('scale', 'x/60', None), ('aresize', '100/100', None),
+        ]
+        for action, geometry, quality in cases:
+            compiled = compile_geometry(action, geometry, quality)
+            for thing in things:
+                for options in ({}, {'force_scale': 'true'}):
+                    self.assertEqual(
+                        compute_img(thing, action, geometry, options, quality, compiled),
+                        compute_img(thing, action, geometry, options, quality),
+                    )
+
+
+class TestGetStoragePath(TestCase):
+
+    def test_url_layout(self):
+        self.assertEqual(get_storage_path('lt/lt_cache/resize/10/10/i/p.jpg', depth=0), 'lt/lt_cache/resize/10/10/i/p.jpg')
+
+    def test_sharded(self):
+        path = get_storage_path('lt/lt_cache/resize/10/10/i/p.jpg', depth=2, width=2)
+        self.assertEqual(path, 'lt_cache/48/7e/487e35bc4a46ac710e2a32a1187944f5.jpg')
+        self.assertEqual(get_storage_path(u'lt/lt_cache/resize/10/10/i/p.jpg', depth=2, width=2), path)
+        self.assertEqual(get_storage_path('lt/lt_cache/resize/10/10/i/p.jpg', depth=1, width=3), 'lt_cache/487/487e35bc4a46ac710e2a32a1187944f5.jpg')
+        self.assertEqual(get_storage_path('lt/lt_cache/thumbnail/10/i/p', depth=1), 'lt_cache/c4/c4217de616ff8543900b35ba5a23a8fa')
+
+
 class TestGetImgAttrs(TestCase):
     @patch('lazythumbs.util.compute_img')
     def test_no_height(self, mock_ci):
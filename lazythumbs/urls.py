@@ -6,25 +6,9 @@ except ImportError:
 from lazythumbs.views import LazyThumbRenderer
 
 urlpatterns = patterns('',
-    # we'll cleanse the liberal .+ in the view.
-    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+/\d+|\d+)/(?P<quality>q\d+)/(?P<source_path>.+)$',
+    # action, geometry, quality and source path are parsed in one pass by
+    # lazythumbs.spec.parse_rendition_path; the view cleanses the liberal .+
+    url(r'lt_cache/(?P<rendition>.+)$',
         LazyThumbRenderer.as_view(),
-        name='lt_slash_sep_w_quality'),
-    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+/\d+|\d+)/(?P<source_path>.+)$',
-        LazyThumbRenderer.as_view(),
-        name='lt_slash_sep'),
-
-    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+x\d+)/(?P<quality>q\d+)/(?P<source_path>.+)$',
-        LazyThumbRenderer.as_view(),
-        name='lt_x_sep_w_quality'),
-    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>\d+x\d+)/(?P<source_path>.+)$',
-        LazyThumbRenderer.as_view(),
-        name='lt_x_sep'),
-
-    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>x/\d+)/(?P<quality>q\d+)/(?P<source_path>.+)$',
-        LazyThumbRenderer.as_view(),
-        name='lt_x_width_w_quality'),
-    url(r'lt_cache/(?P<action>\w+)/(?P<geometry>x/\d+)/(?P<source_path>.+)$',
-        LazyThumbRenderer.as_view(),
-        name='lt_x_width'),
+        name='lt_cache'),
 )
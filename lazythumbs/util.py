@@ -1,4 +1,6 @@
+from hashlib import md5
 import logging
+import math
 import os
 import re
 from functools import partial
@@ -8,6 +10,9 @@ from urlparse import urljoin, urlparse
 from PIL import Image
 from django.conf import settings
 
+from lazythumbs.metadata import metadata_index
+from lazythumbs.settings import METADATA_INDEX, CACHE_SHARD_DEPTH, CACHE_SHARD_WIDTH
+
 logger = logging.getLogger()
 
 # This is a 1x1 transparent GIF
@@ -69,6 +74,36 @@ def build_geometry(action, width, height):
     return str(width)
 
 
+def get_decode_size(source_size, width=None, height=None):
+    """ compute the smallest size a source can be decoded at while still
+        covering the requested geometry. Every built in action scales the
+        source by at most max(width/source_width, height/source_height), so a
+        decode covering that box never loses pixels an action would use.
+        Returns None when the source is already small enough.
+
+        :param source_size: (width, height) of the undecoded source
+        :param width: requested width in pixels or None
+        :param height: requested height in pixels or None
+    """
+    source_width, source_height = source_size
+    factors = []
+    if width:
+        factors.append(float(width) / source_width)
+    if height:
+        factors.append(float(height) / source_height)
+    if not factors:
+        return None
+
+    factor = max(factors)
+    if factor >= 1:
+        return None
+
+    return (
+        int(math.ceil(source_width * factor)),
+        int(math.ceil(source_height * factor)),
+    )
+
+
 def quack(thing, properties, levels=[], default=None):
     """
     Introspects object thing for the first property in properties at its top
@@ -106,8 +141,33 @@ def quack(thing, properties, levels=[], default=None):
     return default
 
 
-def compute_img(thing, action, geometry, options=None, quality=None):
-    """ generate a src url, width and height tuple for given object or url"""
+def compile_geometry(action, geometry, quality=None):
+    """ do the url work of compute_img that only depends on a literal
+        geometry and quality ahead of time, e.g. once per template tag.
+
+        :returns: (width, height, path) where path is the part of the rendition
+            url between the url prefix and the source url, or None if the
+            geometry can't be folded (responsive or junk geometries)
+    """
+    if geometry == 'responsive':
+        return None
+    try:
+        width, height = geometry_parse(action, geometry, ValueError)
+    except ValueError:
+        return None
+    # the canonical geometry of a height-only thumbnail depends on the source
+    if action == 'thumbnail' and not width:
+        return None
+    path = _construct_lt_img_url('', action, build_geometry(action, width, height), '', quality)
+    return width, height, path.lstrip('/')
+
+
+def compute_img(thing, action, geometry, options=None, quality=None, compiled=None):
+    """ generate a src url, width and height tuple for given object or url
+
+        compiled is compile_geometry(action, geometry, quality), if it has
+        been computed already.
+    """
     if options is None:
         options = {}
 
@@ -129,8 +189,14 @@ def compute_img(thing, action, geometry, options=None, quality=None):
     if parsed.scheme or parsed.netloc:
         return dict(src=url, width=str(source_width(img_object) or ''), height=str(source_height(img_object) or ''))
 
+    # Objects that don't carry their dimensions, like plain urls, may still
+    # have them recorded in the metadata index.
+    if METADATA_INDEX:
+        source_width, source_height = _with_indexed_dimensions(url, source_width, source_height)
+    has_dimensions = img_object is not None or METADATA_INDEX
+
     # If this is a responsive image, we only need to provide a placeholder for the moment
-    if geometry == 'responsive':
+    if compiled is None and geometry == 'responsive':
         attrs = {
             'class': 'lt-responsive-img',
             'data-urltemplate': get_placeholder_url(thing),
@@ -142,18 +208,21 @@ def compute_img(thing, action, geometry, options=None, quality=None):
 
     # extract/ensure width & height
     # It's okay to end up with '' for one of the dimensions in the case of thumbnail
-    try:
-        width, height = geometry_parse(action, geometry, ValueError)
-    except ValueError, e:
-        logger.debug('got junk geometry variable resolution: %s' % e)
-        return exit(url, source_width(img_object), source_height(img_object))
+    if compiled is not None:
+        width, height, compiled_path = compiled
+    else:
+        try:
+            width, height = geometry_parse(action, geometry, ValueError)
+        except ValueError, e:
+            logger.debug('got junk geometry variable resolution: %s' % e)
+            return exit(url, source_width(img_object), source_height(img_object))
 
     # at this point we have our geo information as well as our action. if
     # it's a thumbnail, we'll need to try and scale the original image's
     # other dim to match our target dim.
     # TODO puke
     if action == 'thumbnail':
-        if img_object:  # if we didn't get an obj there's nothing we can do
+        if has_dimensions:  # if we didn't get an obj there's nothing we can do
             scale = lambda a, b, c: int(a * (float(b) / c))
             if not width:
                 s_w = source_width(img_object)
@@ -173,7 +242,7 @@ def compute_img(thing, action, geometry, options=None, quality=None):
     def _source_smaller(img, source):
         return source and img and img >= source
 
-    if img_object:
+    if has_dimensions:
         s_w = source_width(img_object)
         s_h = source_height(img_object)
 
@@ -181,8 +250,11 @@ def compute_img(thing, action, geometry, options=None, quality=None):
         if not force_scale and _source_smaller(width, s_w) and _source_smaller(height, s_h):
             return exit(url, s_w, s_h)
 
-    geometry = build_geometry(action, width, height)
-    src = _construct_lt_img_url(url_prefix, action, geometry, url, quality)
+    if compiled is not None:
+        src = url_prefix.rstrip('/') + '/' + compiled_path + url
+    else:
+        geometry = build_geometry(action, width, height)
+        src = _construct_lt_img_url(url_prefix, action, geometry, url, quality)
 
     if getattr(settings, 'LAZYTHUMBS_DUMMY', False):
         src = 'http://placekitten.com/%s/%s' % (width, height)
@@ -190,6 +262,24 @@ def compute_img(thing, action, geometry, options=None, quality=None):
     return exit(src, width, height)
 
 
+def _with_indexed_dimensions(url, source_width, source_height):
+    """ wrap compute_img's source dimension lookups so they fall back to the
+        metadata index, which is only queried if the object has no dimensions.
+        Entries recorded for an older version of the source are ignored.
+    """
+    indexed = []
+
+    def lookup():
+        if not indexed:
+            indexed.append(metadata_index.get_current(url) or {})
+        return indexed[0]
+
+    return (
+        lambda t: source_width(t) or lookup().get('width'),
+        lambda t: source_height(t) or lookup().get('height'),
+    )
+
+
 def get_img_url(thing, action, width=None, height=None):
     """ return only the src.
         This largely exists because I'm in a hurry and
@@ -209,6 +299,49 @@ def get_placeholder_url(thing):
     return _construct_lt_img_url(url_prefix, '{{ action }}', '{{ dimensions }}', url)
 
 
+def get_rendition_url(source_path, action, width, height, quality=None):
+    """ return the url the template tag would build for the rendition of a
+        MEDIA_ROOT relative source_path, possibly relative to MEDIA_URL.
+    """
+    geometry = build_geometry(action, width, height)
+    return _construct_lt_img_url(MAPPED_URLS[settings.MEDIA_URL], action, geometry, source_path, quality)
+
+
+def get_rendered_path(source_path, action, width, height, quality=None):
+    """ return the path, relative to MEDIA_ROOT, that LazyThumbRenderer saves
+        the rendition of a MEDIA_ROOT relative source_path to. This is the
+        storage path of the url the template tag would build for it.
+    """
+    url = get_rendition_url(source_path, action, width, height, quality)
+    return get_storage_path(urlparse(url).path[1:])
+
+
+def get_sibling_path(rendered_path, img_format):
+    """ the path of a rendition's sibling in another format, e.g.
+        lt_cache/resize/10/10/i/p.jpg -> lt_cache/resize/10/10/i/p.jpg.webp
+    """
+    return '%s.%s' % (rendered_path, img_format.lower())
+
+
+def get_storage_path(url_path, depth=None, width=None):
+    """ map the path of a rendition url (without the leading slash) to where
+        the rendition is stored, relative to MEDIA_ROOT. With a shard depth
+        of 0 that's the url path itself, otherwise
+        lt_cache/<shard>/.../<md5 of url_path><extension>
+    """
+    if depth is None:
+        depth = CACHE_SHARD_DEPTH
+    if width is None:
+        width = CACHE_SHARD_WIDTH
+    if not depth:
+        return url_path
+    if isinstance(url_path, unicode):
+        url_path = url_path.encode('utf-8')
+    digest = md5(url_path).hexdigest()
+    shards = [digest[i * width:(i + 1) * width] for i in range(depth)]
+    return '/'.join(['lt_cache'] + shards + [digest + os.path.splitext(url_path)[1]])
+
+
 def get_img_attrs(thing, action, width='', height=''):
     """ allows us to get a url easier outside of templates
         this just lets compute_img deal with invalid geometries
@@ -272,13 +405,13 @@ def _get_url_img_obj_from_thing(thing):
 
 def _construct_lt_img_url(prefix, action, geometry, url, quality=None):
     try:
-        quality = int(quality)
+        quality = int(str(quality).lstrip('q'))
         assert 0 < quality <= 100
     except (TypeError, ValueError, AssertionError):
         logger.debug('Invalid quality value: %s in _construct_lt_img_url.', quality)
         quality = False
 
     if quality:
-        return '/'.join([prefix.rstrip('/'), 'lt_cache', action, geometry, quality, url])
+        return '/'.join([prefix.rstrip('/'), 'lt_cache', action, geometry, 'q%d' % quality, url])
     else:
         return '/'.join([prefix.rstrip('/'), 'lt_cache', action, geometry, url])
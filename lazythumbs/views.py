@@ -1,29 +1,103 @@
-from cStringIO import StringIO
+from functools import partial
 from hashlib import md5
 import errno
 import logging
 import os
-import re
+import time
 import types
+from base64 import b64decode
+from urlparse import urljoin
+from wsgiref.util import FileWrapper
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.storage import FileSystemStorage
 from django.core.files.base import ContentFile
 from django.core.exceptions import SuspiciousOperation
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseRedirect
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # Django < 1.5 streams any iterator given to HttpResponse
+    StreamingHttpResponse = HttpResponse
+try:
+    from django.http import FileResponse
+except ImportError:  # Django < 1.8
+    FileResponse = None
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django.views.generic.base import View
 from PIL import Image
 
-from lazythumbs.settings import DEFAULT_QUALITY_FACTOR, DEFAULT_OPTIMIZE_FLAG, DEFAULT_PROGRESSIVE_FLAG
-from lazythumbs.util import geometry_parse, get_format
+from lazythumbs.settings import DEFAULT_QUALITY_FACTOR, DRAFT_DECODE, SOURCE_CACHE_BYTES
+from lazythumbs.settings import SERVE_MODE, STREAM_CHUNK_SIZE, X_ACCEL_REDIRECT_PREFIX
+from lazythumbs.settings import STALE_WHILE_REVALIDATE, STALE_IF_ERROR, DERIVE_RENDITIONS
+from lazythumbs.settings import METADATA_INDEX
+from lazythumbs.settings import ASYNC_RENDER, ASYNC_RENDER_FALLBACK, ASYNC_RETRY_AFTER
+from lazythumbs.settings import ACCESS_TIME_RESOLUTION, NEGOTIATE_FORMATS
+from lazythumbs.settings import RENDER_REJECT_FALLBACK, RENDER_REJECT_RETRY_AFTER
+from lazythumbs.settings import RENDER_DEADLINE, RENDER_DEADLINE_FALLBACK, RENDER_DEADLINE_RETRY_AFTER
+from lazythumbs.settings import RENDER_PROCESSES, RENDER_THREADS
+from lazythumbs.admission import RenderRejected, admission
+from lazythumbs.cache_manager import touch
+from lazythumbs.deadline import DeadlineExceeded, call_with_deadline, record_slow_source
+from lazythumbs.encoding import encode, get_save_params
+from lazythumbs.executor import RenderCrashed, render_pool, render_threads
+from lazythumbs.geometry import plan_aresize, plan_matte, plan_resize, plan_scale, plan_thumbnail
+from lazythumbs.locks import render_lock
+from lazythumbs.lru import DecodedImageCache
+from lazythumbs.metadata import metadata_index
+from lazythumbs.missing import missing_sources, get_cache_key as get_missing_key
+from lazythumbs.renditions import RenditionIndex, find_parent, find_variant, make_entry
+from lazythumbs.resample import get_tier, resample
+from lazythumbs.spec import RenditionSpec, parse_rendition_path
+from lazythumbs import spool
+from lazythumbs.util import LT_PLACEHOLDER_SRC, geometry_parse, get_decode_size, get_format
+from lazythumbs.util import get_rendered_path, get_rendition_url, get_sibling_path, get_storage_path
 
 logger = logging.getLogger('lazythumbs')
 
 MATTE_BACKGROUND_COLOR = getattr(settings, 'LAZYTHUMBS_MATTE_BACKGROUND_COLOR', (0, 0, 0))
 
+# the default quality as it appears in urls; urls without one get it too
 DEFAULT_QUALITY_URL_PARAM = 'q{0}'.format(DEFAULT_QUALITY_FACTOR)
 
+PLACEHOLDER_GIF = b64decode(LT_PLACEHOLDER_SRC.split(',', 1)[1])
+
+# url formats that get siblings in a negotiated format
+NEGOTIABLE_FORMATS = ('JPEG',)
+
+# those of LAZYTHUMBS_NEGOTIATE_FORMATS this Pillow can encode
+Image.init()
+NEGOTIATED_FORMATS = [f for f in NEGOTIATE_FORMATS if f in Image.SAVE]
+
+# decoded source images shared by every renderer in this process
+source_cache = DecodedImageCache(SOURCE_CACHE_BYTES)
+
+rendition_index = RenditionIndex()
+
+
+def index_renditions():
+    """ whether renditions are indexed, to derive others from or to stand in for late ones """
+    return DERIVE_RENDITIONS or (RENDER_DEADLINE and RENDER_DEADLINE_FALLBACK == 'variant')
+
+
+def get_source_size(img):
+    """ (width, height) of the source img was decoded from, at a reduced scale or not """
+    return getattr(img, 'source_size', img.size)
+
+
+def as_parent(entry, img, source_size):
+    """
+    Prepare the image of the rendition index entry to have an action run
+    against it instead of the source. A thumbnail is the whole source scaled
+    down, so geometry is worked out from the source's size as for a reduced
+    scale decode; a rendition of the same action is scaled as it is.
+    """
+    if entry['action'] == 'thumbnail':
+        img.source_size = tuple(source_size)
+    return img
+
+
 def action(fun):
     """
     Decorator used to denote an instance method as an action: a function
@@ -43,6 +117,9 @@ class LazyThumbRenderer(View):
     image transformations simply by subclassing this view and adding "action_"
     methods that return raw image data as a string.
     """
+    # resampling tier of the action being rendered, see lazythumbs.resample
+    resample_tier = None
+
     def __init__(self):
         self.fs = FileSystemStorage()
         self.allowed_actions = [a.__name__
@@ -51,126 +128,522 @@ class LazyThumbRenderer(View):
         ]
 
 
-    def get(self, request, action, geometry, source_path, quality=DEFAULT_QUALITY_URL_PARAM):
+    def get(self, request, action=None, geometry=None, source_path=None, quality=None, rendition=None):
         """
         Perform action routing and handle sanitizing url input. Handles caching the path to a rendered image to
         django.cache and saves the new image on the filesystem. 404s are cached to
         save time the next time the missing image is requested.
 
         :param request: HttpRequest
+        :param rendition: the url path after 'lt_cache/', parsed in one go;
+            alternatively the parts below captured separately
         :param action: some action, eg thumbnail or resize
         :param geometry: a string of either '\dx\d' or just '\d'
         :param source_path: the fs path to the image to be manipulated
         :param quality: a string of 'q\d'
         :returns: an HttpResponse with an image/{format} content_type
         """
-        # sanitize quality param
-        try:
-            quality = int(quality.lstrip('q'))
-        except (ValueError, AttributeError), e:
-            logger.info('corrupted quality "%s" for action "%s"', quality, action)
-            logger.info('Bad url quality parameter:\n%s', e)
-            return self.four_oh_four()
+        if rendition is not None:
+            spec = parse_rendition_path(rendition)
+            if spec is None:
+                logger.info('%s: bad rendition url', rendition)
+                return self.four_oh_four()
+        else:
+            try:
+                spec = RenditionSpec.from_args(action, geometry, source_path, quality)
+            except ValueError, e:
+                logger.info('corrupted geometry "%s" or quality "%s" for action "%s"', geometry, quality, action)
+                return self.four_oh_four()
+        return self.get_rendition(request, spec)
 
-        if not 0 < quality <= 100:
-            logger.info('corrupted quality "%s" for action "%s"', quality, action)
-            return self.four_oh_four()
+    def get_rendition(self, request, spec):
+        """
+        Serve, or render and serve, the rendition described by spec.
+
+        :param spec: a RenditionSpec
+        """
+        action, width, height, quality, source_path = spec
 
         # reject naughty paths and actions
-        if source_path.startswith('/'):
-            logger.info("%s: blocked bad path", source_path)
-            return self.four_oh_four()
-        if re.match('\.\./', source_path):
+        if source_path.startswith('/') or source_path.startswith('../'):
             logger.info("%s: blocked bad path", source_path)
             return self.four_oh_four()
         if action not in self.allowed_actions:
             logger.info("%s: bad action requested: %s", source_path, action)
             return self.four_oh_four()
 
-        try:
-            width, height = geometry_parse(action, geometry, ValueError)
-        except ValueError, e:
-            logger.info('corrupted geometry "%s" for action "%s"', geometry, action)
-            return self.four_oh_four()
-
-        width = int(width) if width is not None else None
-        height = int(height) if height is not None else None
-
-        rendered_path = request.path[1:]
-
-        cache_key = self.cache_key(source_path, action, width, height, quality)
-        was_404 = cache.get(cache_key)
-
-        if was_404 == 1:
-            return self.four_oh_four()
-
-        img_format = get_format(rendered_path)
-        # TODO this tangled mess of try/except is hideous... but such is
-        # filesystem io? No it can be cleaned up by splitting it out
-        try:
-            # does rendered file already exist?
-            raw_data = self.fs.open(rendered_path).read()
-        except IOError as e:
+        # where the rendition is stored, relative to MEDIA_ROOT: the url path
+        # itself, or a hashed path when LAZYTHUMBS_CACHE_SHARD_DEPTH is set
+        url_path = request.path[1:]
+        rendered_path = get_storage_path(url_path)
+
+        img_format = get_format(url_path)
+        cache_key_args = [source_path, action, width, height, quality]
+        # serve a sibling rendition in a better format to clients that take it
+        negotiate = img_format in NEGOTIABLE_FORMATS and bool(NEGOTIATED_FORMATS)
+        if negotiate:
+            accepted = self.negotiate_format(request)
+            if accepted:
+                img_format = accepted
+                url_path = get_sibling_path(url_path, img_format)
+                rendered_path = get_sibling_path(rendered_path, img_format)
+                cache_key_args.append(img_format)
+        cache_key = self.cache_key(*cache_key_args)
+        # does rendered file already exist?
+        validators = self.get_validators(rendered_path, record_access=True)
+        if validators is None and rendered_path != url_path:
+            # renditions not moved to the sharded layout yet are still served
+            validators = self.get_validators(url_path, record_access=True)
+            if validators:
+                rendered_path = url_path
+        resp = None
+        if validators:
+            if self.not_modified(request, *validators):
+                cache.set(cache_key, 0, settings.LAZYTHUMBS_CACHE_TIMEOUT)
+                return self.vary(self.three_oh_four(*validators), negotiate)
+            resp = self.serve_rendered(rendered_path, img_format)
+        if resp is None:
+            # missing sources are remembered per source rather than per
+            # rendition, and locally so that repeated misses don't even reach
+            # the cache backend. Renditions still on disk are served above.
+            if missing_sources.is_missing(source_path):
+                return self.four_oh_four()
+            if cache.get(get_missing_key(source_path)) == 1:
+                missing_sources.add(source_path, settings.LAZYTHUMBS_404_CACHE_TIMEOUT)
+                return self.four_oh_four()
+            was_404 = cache.get(cache_key)
+            if was_404 == 1:
+                return self.four_oh_four()
             if was_404 == 0:
                 # then it *was* here last time. if was_404 had been None then
                 # it makes sense for rendered image to not exist yet: we
                 # probably haven't seen it, or it dropped out of cache.
                 logger.info('rendered image previously on fs missing. regenerating')
+            if ASYNC_RENDER:
+                if not os.path.exists(os.path.join(settings.MEDIA_ROOT, source_path)):
+                    logger.info('404: %s does not exist', source_path)
+                    self.cache_404(source_path, cache_key)
+                    return self.four_oh_four()
+                name = spool.enqueue(action, width, height, source_path, rendered_path, quality)
+                spool.workers.submit(self.__class__, name)
+                return self.vary(self.render_pending(source_path), negotiate)
             try:
-                pil_img = getattr(self, action)(
-                    width=width,
-                    height=height,
-                    img_path=source_path
+                raw_data = self.render_in_time(
+                    action, width, height, source_path, rendered_path, quality
+                )
+            except RenderRejected:
+                return self.vary(self.render_rejected(source_path), negotiate)
+            except RenderCrashed as e:
+                # not necessarily the source's fault, so no 404 is cached
+                logger.warning('%s', e)
+                return self.vary(self.render_rejected(source_path), negotiate)
+            except DeadlineExceeded as e:
+                logger.warning('%s', e)
+                spool.enqueue(action, width, height, source_path, rendered_path, quality)
+                return self.vary(
+                    self.render_late(action, width, height, source_path, rendered_path, img_format), negotiate
                 )
-                # this code from sorl-thumbnail
-                buf = StringIO()
-                # TODO we need a better way of choosing options based on size and format
-                params = {
-                    'format': get_format(rendered_path),
-                    'quality': quality,
-                    'optimize': DEFAULT_OPTIMIZE_FLAG,
-                    'progressive': DEFAULT_PROGRESSIVE_FLAG,
-                }
-
-                if params['format'] == "JPEG" and pil_img.mode == 'P':
-                    # Cannot save mode 'P' image as JPEG without converting first
-                    # (This can happen if we have a GIF file without an extension and don't scale it)
-                    pil_img = pil_img.convert()
-
-                try:
-                    pil_img.save(buf, **params)
-                except IOError as e:
-                    logger.exception("pil_img.save(%r)", params)
-                    # TODO reevaluate this except when we make options smarter
-                    logger.info("Failed to create new image %s . Trying without options", rendered_path)
-                    pil_img.save(buf, format=img_format)
-                raw_data = buf.getvalue()
-                buf.close()
-                try:
-                    self.fs.save(rendered_path, ContentFile(raw_data))
-                except OSError as e:
-                    if e.errno == errno.EEXIST:
-                        # possible race condition, another WSGI worker wrote file or directory first
-                        # try to read again
-                        try:
-                            raw_data = self.fs.open(rendered_path).read()
-                        except Exception as e:
-                            logger.exception("Unable to read image file, returning 404: %s", e)
-                            return self.four_oh_four()
-                    else:
-                        logger.exception("Saving converted image: %s", e)
-                        raise
-
             except (IOError, SuspiciousOperation, ValueError), e:
                 # we've now failed to find a rendered path as well as the
                 # original source path. this is a 404.
                 logger.info('404: %s', e)
-                cache.set(cache_key, 1, settings.LAZYTHUMBS_404_CACHE_TIMEOUT)
+                self.cache_404(source_path, cache_key)
                 return self.four_oh_four()
 
+            if raw_data is None:
+                return self.four_oh_four()
+            resp = self.two_hundred(raw_data, img_format)
+            validators = self.get_validators(rendered_path)
+
+        if validators:
+            self.set_validators(resp, *validators)
         cache.set(cache_key, 0, settings.LAZYTHUMBS_CACHE_TIMEOUT)
 
-        return self.two_hundred(raw_data, img_format)
+        return self.vary(resp, negotiate)
+
+    def negotiate_format(self, request):
+        """
+        Pick the first of LAZYTHUMBS_NEGOTIATE_FORMATS that the request's
+        Accept header names explicitly (wildcards don't count).
+
+        :returns: a PIL format string, or None
+        """
+        accept = request.META.get('HTTP_ACCEPT')
+        if not accept:
+            return None
+        accepted = set()
+        for media_range in accept.split(','):
+            params = media_range.split(';')
+            quality = 1
+            for param in params[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        pass
+            if quality > 0:
+                accepted.add(params[0].strip().lower())
+        for img_format in NEGOTIATED_FORMATS:
+            if 'image/%s' % img_format.lower() in accepted:
+                return img_format
+        return None
+
+    def vary(self, resp, negotiate):
+        """ mark responses whose format depends on the Accept header """
+        if negotiate:
+            patch_vary_headers(resp, ('Accept',))
+        return resp
+
+    def get_validators(self, rendered_path, record_access=False):
+        """
+        Compute the ETag and modification time of a rendered image from a stat
+        of its file, without reading it.
+
+        :param record_access: also note the access for cache eviction
+        :returns: an (etag, mtime) tuple, or None if it isn't on disk
+        """
+        path = self.fs.path(rendered_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if record_access and ACCESS_TIME_RESOLUTION is not None:
+            touch(path, stat, ACCESS_TIME_RESOLUTION)
+        return '%x-%x' % (int(stat.st_mtime), stat.st_size), int(stat.st_mtime)
+
+    def not_modified(self, request, etag, mtime):
+        """
+        Check the request's If-None-Match and If-Modified-Since headers
+        against a rendered image's validators. If-None-Match wins when both
+        are given.
+        """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+            return if_modified_since is not None and mtime <= if_modified_since
+
+        return False
+
+    def set_validators(self, resp, etag, mtime):
+        resp['ETag'] = quote_etag(etag)
+        resp['Last-Modified'] = http_date(mtime)
+        return resp
+
+    def serve_rendered(self, rendered_path, img_format):
+        """
+        Build the response for an image that has already been rendered,
+        according to LAZYTHUMBS_SERVE_MODE:
+
+        * 'memory': read the file and return its data (the default)
+        * 'stream': stream the file from disk in chunks, or have the server
+          send it if it offers a wsgi.file_wrapper
+        * 'x-accel-redirect': let nginx send the file from an internal
+          location at LAZYTHUMBS_X_ACCEL_REDIRECT_PREFIX
+        * 'x-sendfile': let Apache/lighttpd send the file by absolute path
+
+        :returns: an HttpResponse, or None if the rendered image isn't on disk
+        """
+        if SERVE_MODE in ('x-accel-redirect', 'x-sendfile'):
+            if not self.fs.exists(rendered_path):
+                return None
+            resp = self.two_hundred('', img_format)
+            if SERVE_MODE == 'x-accel-redirect':
+                resp['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + rendered_path
+            else:
+                resp['X-Sendfile'] = self.fs.path(rendered_path)
+            return resp
+
+        try:
+            img_file = self.fs.open(rendered_path)
+        except IOError:
+            return None
+
+        if SERVE_MODE == 'stream':
+            if FileResponse is not None:
+                # servers with a wsgi.file_wrapper send the file themselves,
+                # e.g. with sendfile, rather than through a thread of ours
+                resp = self.two_hundred(img_file, img_format, FileResponse)
+                resp.block_size = STREAM_CHUNK_SIZE
+            else:
+                resp = self.two_hundred(
+                    FileWrapper(img_file, STREAM_CHUNK_SIZE), img_format, StreamingHttpResponse
+                )
+            resp['Content-Length'] = str(img_file.size)
+            return resp
+
+        try:
+            return self.two_hundred(img_file.read(), img_format)
+        finally:
+            img_file.close()
+
+    def render_in_time(self, action, width, height, source_path, rendered_path, quality):
+        """
+        render() for a request, within LAZYTHUMBS_RENDER_DEADLINE seconds if
+        that is set, on a render thread if LAZYTHUMBS_RENDER_THREADS is set.
+
+        :raises DeadlineExceeded: if the render didn't finish in time; it
+            goes on in the background
+        :raises RenderRejected: if no render slot or render thread came free
+        """
+        render = partial(
+            self.render, action, width, height, source_path, rendered_path, quality, admit=True
+        )
+        if RENDER_THREADS:
+            return render_threads.submit(render).result(RENDER_DEADLINE or None)
+        if not RENDER_DEADLINE:
+            return render()
+        return call_with_deadline(render, RENDER_DEADLINE, 'render of %s' % rendered_path)
+
+    def render(self, action, width, height, source_path, rendered_path, quality, admit=False):
+        """
+        Make sure the rendition at rendered_path exists and return its data.
+        Concurrent calls for the same rendered_path are coalesced: one of them
+        renders while the others wait and then read the finished file.
+
+        :param admit: whether the render is for a request, which needs a slot
+            from admission control (see lazythumbs.admission) and runs in a
+            render process if LAZYTHUMBS_RENDER_PROCESSES is set (see
+            lazythumbs.executor); renders outside of requests don't
+        :returns: the encoded image data, or None if it could not be read back
+        :raises IOError: if the source image can't be found or decoded
+        :raises RenderRejected: if admit is set and no render slot came free
+        """
+        with render_lock(rendered_path):
+            # whoever held the lock before us has probably just rendered
+            # this image; serve theirs instead of redoing it.
+            try:
+                return self.fs.open(rendered_path).read()
+            except IOError:
+                if not admit:
+                    return self._render_and_save(
+                        action, width, height, source_path, rendered_path, quality
+                    )
+                with admission.slot(rendered_path):
+                    if RENDER_PROCESSES:
+                        try:
+                            return render_pool.render(
+                                self.__class__, action, width, height, source_path, rendered_path, quality
+                            )
+                        except RenderCrashed:
+                            # the process may have been killed halfway through
+                            # writing the rendition; don't serve what it left
+                            if self.fs.exists(rendered_path):
+                                self.fs.delete(rendered_path)
+                            raise
+                    return self._render_and_save(
+                        action, width, height, source_path, rendered_path, quality
+                    )
+
+    def _render_and_save(self, action, width, height, source_path, rendered_path, quality):
+        """
+        Run action against the source image, encode the result and save it at
+        rendered_path.
+
+        :returns: the encoded image data, or None if another worker won a race
+            to write rendered_path and its file could not be read back
+        :raises IOError: if the source image can't be found or decoded
+        """
+        started = time.time()
+        img_format = get_format(rendered_path)
+        self.resample_tier = get_tier(action)
+        parent = None
+        indexed = index_renditions()
+        if indexed:
+            source = os.path.join(settings.MEDIA_ROOT, source_path)
+            try:
+                source_mtime = os.stat(source).st_mtime
+            except OSError as e:
+                raise IOError(e.errno, e.strerror, source)
+        if DERIVE_RENDITIONS:
+            # only reads the header
+            source_size = Image.open(source).size
+            parent, parent_img = self.open_parent(
+                action, width, height, source_path, source_mtime, source_size
+            )
+
+        if parent:
+            logger.debug('rendering %s from %s', rendered_path, parent['path'])
+            pil_img = getattr(self, action)(width=width, height=height, img=parent_img)
+        else:
+            pil_img = getattr(self, action)(
+                width=width,
+                height=height,
+                img_path=source_path
+            )
+        raw_data = self._encode(pil_img, rendered_path, quality)
+        elapsed = time.time() - started
+        if RENDER_DEADLINE and elapsed > RENDER_DEADLINE:
+            record_slow_source(source_path, rendered_path, elapsed)
+
+        index_entry = None
+        if indexed:
+            index_entry = (source_path, source_mtime, make_entry(
+                rendered_path, action, width, height, pil_img.size,
+                quality, img_format, derived=parent is not None
+            ))
+        return self._save(raw_data, rendered_path, index_entry)
+
+    def _encode(self, pil_img, rendered_path, quality):
+        """
+        :returns: pil_img encoded in the format of rendered_path
+        """
+        params = get_save_params(pil_img, get_format(rendered_path), quality)
+
+        if params['format'] == "JPEG" and pil_img.mode == 'P':
+            # Cannot save mode 'P' image as JPEG without converting first
+            # (This can happen if we have a GIF file without an extension and don't scale it)
+            pil_img = pil_img.convert()
+
+        return encode(pil_img, params, rendered_path)
+
+    def _save(self, raw_data, rendered_path, index_entry=None):
+        """
+        Save encoded image data at rendered_path.
+
+        :param index_entry: a (source path, source mtime, entry) tuple to add
+            to the rendition index once the rendition is saved, if any
+        :returns: raw_data, or the data of the file another worker saved
+            first, or None if that could not be read
+        """
+        try:
+            self.fs.save(rendered_path, ContentFile(raw_data))
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                # possible race condition, another WSGI worker wrote file or directory first
+                # try to read again
+                try:
+                    raw_data = self.fs.open(rendered_path).read()
+                except Exception as e:
+                    logger.exception("Unable to read image file, returning 404: %s", e)
+                    return None
+            else:
+                logger.exception("Saving converted image: %s", e)
+                raise
+        else:
+            if index_entry:
+                rendition_index.add(*index_entry)
+        return raw_data
+
+    def render_batch(self, source_path, specs, force=False):
+        """
+        Render several renditions of a source with a single decode, e.g. right
+        after it has been uploaded. Renditions are rendered largest first, and
+        from a rendition rendered earlier in the batch where that gives the
+        same picture (see lazythumbs.renditions.can_derive). Since those are
+        still in memory, no generation loss is involved. Renditions that
+        already exist are left alone unless force is set.
+
+        :param source_path: a path to an image file relative to MEDIA_ROOT
+        :param specs: (action, geometry, quality) tuples, geometry as in urls,
+            e.g. '150/150', and quality None for the default
+        :returns: a dict per spec, in order, with the rendition's 'url',
+            'path' relative to MEDIA_ROOT, pixel 'width' and 'height', 'bytes'
+            and whether it was 'rendered' or already there
+        :raises ValueError: for bad paths, unknown actions or bad geometry
+        :raises IOError: if the source image can't be found or decoded
+        """
+        if source_path.startswith('/') or source_path.startswith('../'):
+            raise ValueError('bad source path %r' % source_path)
+        renditions = []
+        for action, geometry, quality in specs:
+            if action not in self.allowed_actions:
+                raise ValueError('unknown action %r' % action)
+            width, height = geometry_parse(action, geometry, ValueError('bad geometry %r' % geometry))
+            renditions.append({
+                'action': action,
+                'size': (width, height),
+                'quality': quality,
+                'url': urljoin(settings.MEDIA_URL, get_rendition_url(source_path, action, width, height, quality)),
+                'path': get_rendered_path(source_path, action, width, height, quality),
+            })
+
+        source = os.path.join(settings.MEDIA_ROOT, source_path)
+        try:
+            source_mtime = os.stat(source).st_mtime
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, source)
+        # only reads the header
+        source_size = Image.open(source).size
+
+        def scale(rendition):
+            width, height = rendition['size']
+            return max(float(width or 0) / source_size[0], float(height or 0) / source_size[1])
+
+        indexed = index_renditions()
+        img = None
+        rendered = {}
+        for rendition in sorted(renditions, key=scale, reverse=True):
+            action, (width, height), quality = rendition['action'], rendition['size'], rendition['quality']
+            rendered_path = rendition['path']
+            with render_lock(rendered_path):
+                if self.fs.exists(rendered_path):
+                    if not force:
+                        rendition['rendered'] = False
+                        continue
+                    self.fs.delete(rendered_path)
+
+                self.resample_tier = get_tier(action)
+                parent = find_parent(
+                    [entry for entry, _ in rendered.values()], action, width, height, source_size, min_quality=0
+                )
+                if parent:
+                    parent_img = as_parent(parent, rendered[parent['path']][1], source_size)
+                    pil_img = getattr(self, action)(width=width, height=height, img=parent_img)
+                else:
+                    if img is None:
+                        # the first decode is for the largest rendition, which covers the rest
+                        img = self.get_pil_from_path(source_path, width, height)
+                        img.load()
+                    pil_img = getattr(self, action)(width=width, height=height, img=img)
+
+                img_format = get_format(rendered_path)
+                entry = make_entry(
+                    rendered_path, action, width, height, pil_img.size,
+                    quality or DEFAULT_QUALITY_FACTOR, img_format, derived=parent is not None
+                )
+                rendered[rendered_path] = (entry, pil_img)
+                raw_data = self._encode(pil_img, rendered_path, quality or DEFAULT_QUALITY_FACTOR)
+                self._save(raw_data, rendered_path, (source_path, source_mtime, entry) if indexed else None)
+                rendition['rendered'] = True
+
+        results = []
+        for rendition in renditions:
+            path = self.fs.path(rendition['path'])
+            width, height = Image.open(path).size
+            results.append({
+                'url': rendition['url'],
+                'path': rendition['path'],
+                'width': width,
+                'height': height,
+                'bytes': os.path.getsize(path),
+                'rendered': rendition['rendered'],
+            })
+        return results
+
+    def open_parent(self, action, width, height, source_path, source_mtime, source_size):
+        """
+        Find the smallest indexed rendition of source_path that action can be
+        run against instead of the source, and open it.
+
+        :returns: a (rendition index entry, PIL Image) tuple, or (None, None)
+        """
+        entries = rendition_index.entries(source_path, source_mtime)
+        while True:
+            parent = find_parent(entries, action, width, height, source_size)
+            if parent is None:
+                return None, None
+            try:
+                return parent, as_parent(parent, Image.open(self.fs.path(parent['path'])), source_size)
+            except IOError:
+                # the rendition was removed since it was indexed
+                rendition_index.remove(source_path, source_mtime, parent['path'])
+                entries = [e for e in entries if e is not parent]
 
     @action
     def resize(self, *args, **kwargs):
@@ -215,34 +688,9 @@ class LazyThumbRenderer(View):
         """
         if not (img or img_path):
             raise ValueError('unable to find img given args')
-        img = img or self.get_pil_from_path(img_path)
-
-        source_width = img.size[0]
-        source_height = img.size[1]
-
-        if (
-            not allow_undersized
-            and width >= source_width
-            and height >= source_height
-        ):
-            return img
-
-        img = self.thumbnail(
-            width = width if source_width < source_height else None,
-            height = height if source_height <= source_width else None,
-            img = img
-        )
-
-        # see if we even have to crop
-        if img.size == (width, height):
-            return img
-
-        left = (img.size[0] - width) / 2
-        top = (img.size[1] - height) / 2
-        right = left + width
-        bottom = top + height
+        img = img or self.get_pil_from_path(img_path, width, height)
 
-        return img.crop((left, top, right, bottom))
+        return self.execute(img, plan_resize(get_source_size(img), width, height, allow_undersized))
 
     @action
     def aresize(self, width, height, img_path=None, img=None, crop_img=True):
@@ -264,75 +712,13 @@ class LazyThumbRenderer(View):
         :returns: a PIL Image object
         """
 
-        img = img or self.get_pil_from_path(img_path)
+        img = img or self.get_pil_from_path(img_path, width, height)
         if not img:
             raise ValueError('unable to find img given args')
 
-        # If we're already the right size, don't do anything.
-        if img.size == (width, height):
-            return img
-
-        source_width, source_height = img.size
-
-        source_aspect = float(source_width) / source_height
-        aspect = float(width) / height if width and height else source_aspect
-
-        source_is_landscape = (source_aspect >= 1.0)
-        is_landscape = (aspect >= 1.0)
-
-        if source_is_landscape == is_landscape:
-            if crop_img:
-                # Source and target have the same orientation. Scale according to
-                # aspect ratio to maximize photo area and minimize horizontal/
-                # vertical border insertion.
-                if source_aspect > aspect:
-                    # Source has wider ratio than target. Scale to height.
-                    target_width, target_height = None, height
-                else:
-                    # Source has taller ratio than target. Scale to width.
-                    target_width, target_height = width, None
-            else:
-                # Source and target have the same orientation. Scale according to
-                # aspect ratio and larger dimension to avoid cropping. This will
-                # matte the image.
-                if source_aspect > aspect:
-                    # Source has wider ratio than target. Scale to width.
-                    target_width, target_height = width, None
-                else:
-                    # Source has taller ratio than target. Scale to height.
-                    target_width, target_height = None, height
-        else: # crop_img is irrelevant here. The image won't be cropped regardless.
-            # Source and target have opposite orientations. Scale to source's
-            # longer dimension. This will not crop the image. This will matte
-            # the image, but it will effectively maintain the visual
-            # appearance of the source orientation.
-            if source_is_landscape:
-                target_width, target_height = width, None
-            else:
-                target_width, target_height = None, height
-
-        # We never expand images. Resize only if the target is smaller.
-        if ((target_width and target_width < source_width) or
-                (target_height and target_height < source_height)):
-            img = self.thumbnail(
-                width = target_width,
-                height = target_height,
-                img = img
-            )
-
-        # see if we even have to crop
-        if img.size == (width, height):
-            return img
-
-        # Create a new image of the target size, and paste the resized image
-        # into it. This effectively mattes if necessary by pasting over the
-        # matte background color, and it crops if necessary by pasting outside
-        # the result image bounds.
-        offset_x = (width - img.size[0]) / 2
-        offset_y = (height - img.size[1]) / 2
-        result = Image.new(mode='RGB', size=(width, height), color=MATTE_BACKGROUND_COLOR)
-        result.paste(img, (offset_x, offset_y))
-        return result
+        return self.execute(
+            img, plan_aresize(get_source_size(img), width, height, MATTE_BACKGROUND_COLOR, crop_img)
+        )
 
     @action
     def aresize_no_crop(self, width, height, img_path=None, img=None):
@@ -367,14 +753,9 @@ class LazyThumbRenderer(View):
 
         if not (img or img_path):
             raise ValueError('unable to find img given args')
-        img = img or self.get_pil_from_path(img_path)
-
-        new_img = Image.new('RGB', (width, height), MATTE_BACKGROUND_COLOR)
-        img.thumbnail((width, height), Image.ANTIALIAS)
-        pos = ((width - img.size[0]) / 2, (height - img.size[1]) / 2)
-        new_img.paste(img, pos)
+        img = img or self.get_pil_from_path(img_path, width, height)
 
-        return new_img
+        return self.execute(img, plan_matte(get_source_size(img), width, height, MATTE_BACKGROUND_COLOR))
 
     @action
     def thumbnail(self, width=None, height=None, img_path=None, img=None):
@@ -390,24 +771,9 @@ class LazyThumbRenderer(View):
         """
         if not (img or img_path):
             raise ValueError('unable to find img given args')
-        img = img or self.get_pil_from_path(img_path)
-
-        if (width and height) or (width is None and height is None):
-            raise ValueError('thumbnail requires width XOR height; got (%s, %s)' % (width, height))
-
-        source_width = img.size[0]
-        source_height = img.size[1]
-        scale = lambda a,b,c: int(int(a) * float(b) / float(c))
-
-        # we are guaranteed to have either height or width which lets us take
-        # some validation shortcuts here.
-        width = width or scale(source_width, height, source_height)
-        height = height or scale(source_height, width, source_width)
+        img = img or self.get_pil_from_path(img_path, width, height)
 
-        if width >= source_width or height >= source_height:
-            return img
-
-        return self.scale(width, height, img=img)
+        return self.execute(img, plan_thumbnail(get_source_size(img), width, height))
 
     @action
     def scale(self, width, height, img_path=None, img=None):
@@ -422,31 +788,103 @@ class LazyThumbRenderer(View):
         """
         if not (img or img_path):
             raise ValueError('unable to find img given args')
-        img = img or self.get_pil_from_path(img_path)
-
-        if width > img.size[0]:
-            width = img.size[0]
-
-        if height > img.size[1]:
-            height = img.size[1]
+        img = img or self.get_pil_from_path(img_path, width, height)
 
-        # PIL is really bad at scaling GIFs. This helps a little with the quality.
-        # (http://python.6.n6.nabble.com/Poor-Image-Quality-When-Resizing-a-GIF-tp2099779.html)
-        if img.mode == "P":
-            img = img.convert(mode="RGB", dither=Image.NONE)
+        return self.execute(img, plan_scale(get_source_size(img), width, height))
 
-        return img.resize((width, height), Image.ANTIALIAS)
+    def execute(self, img, plan):
+        """
+        Carry out a geometry plan (see lazythumbs.geometry) against img with
+        at most one resample.
 
-    def get_pil_from_path(self, img_path):
+        :param img: a PIL Image object
+        :param plan: a Plan worked out from get_source_size(img)
+        :returns: a PIL Image object, img itself if the plan leaves it as is
+        """
+        plan = plan.decoded(get_source_size(img), img.size)
+        if plan.scaled:
+            # PIL is really bad at scaling GIFs. This helps a little with the quality.
+            # (http://python.6.n6.nabble.com/Poor-Image-Quality-When-Resizing-a-GIF-tp2099779.html)
+            if img.mode == "P":
+                img = img.convert(mode="RGB", dither=Image.NONE)
+            img = resample(img, plan.size, self.resample_tier, plan.box)
+        elif plan.box != (0, 0) + tuple(img.size):
+            img = img.crop(tuple(int(round(c)) for c in plan.box))
+
+        if plan.canvas:
+            if plan.background is None:
+                canvas = Image.new(mode=img.mode, size=plan.canvas)
+            else:
+                canvas = Image.new(mode='RGB', size=plan.canvas, color=plan.background)
+            canvas.paste(img, plan.offset)
+            return canvas
+        if plan.background is not None and img.mode != 'RGB':
+            img = img.convert('RGB')
+        return img
+
+    def get_pil_from_path(self, img_path, width=None, height=None):
         """
         given some path relative to MEDIA_ROOT, create a PIL Image and
-        return it.
+        return it. When the requested geometry is known and the source is a
+        JPEG, libjpeg is asked to decode at a reduced scale (draft mode) that
+        still covers the requested geometry.
+
+        The image has the source's full (width, height) as its source_size
+        attribute; actions work out their geometry from that (see
+        get_source_size), so a rendition of a reduced scale decode is the same
+        size as that of a full decode.
+
+        If LAZYTHUMBS_SOURCE_CACHE_BYTES is set, decoded sources are kept in
+        an in-process LRU keyed by path, mtime and file size so that sibling
+        renditions of one source only decode it once. If
+        LAZYTHUMBS_METADATA_INDEX is set, the source's dimensions, format and
+        mode are recorded in the metadata index.
 
         :param img_path: a path to an image file relative to MEDIA_ROOT
+        :param width: requested width in pixels, if known
+        :param height: requested height in pixels, if known
         :raises IOError: if image is not found
         :return: PIL.Image
         """
-        return Image.open(os.path.join(settings.MEDIA_ROOT, img_path))
+        path = os.path.join(settings.MEDIA_ROOT, img_path)
+        stat = None
+        if source_cache.max_cost or METADATA_INDEX:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                raise IOError(e.errno, e.strerror, path)
+
+        if source_cache.max_cost:
+            key = (path, stat.st_mtime, stat.st_size)
+            img = source_cache.get_image(key, width, height)
+            if img is not None:
+                return img
+
+        img = Image.open(path)
+        if METADATA_INDEX:
+            metadata_index.record(img_path, img, stat.st_mtime)
+        source_size = img.size
+        self.draft(img, width, height)
+        if source_cache.max_cost:
+            img.load()
+            source_cache.set_image(key, source_size, img)
+            img = img.copy()
+        img.source_size = source_size
+        return img
+
+    def draft(self, img, width=None, height=None):
+        """
+        Configure a freshly opened JPEG to decode at the smallest scale
+        (1/2, 1/4 or 1/8) that still covers the requested geometry.
+
+        :param img: a PIL Image object that has not been loaded yet
+        :returns: the same PIL Image object
+        """
+        if DRAFT_DECODE and img.format == 'JPEG':
+            decode_size = get_decode_size(img.size, width, height)
+            if decode_size:
+                img.draft(img.mode, decode_size)
+        return img
 
     def cache_key(self, *args):
         """
@@ -457,15 +895,141 @@ class LazyThumbRenderer(View):
         hashed = md5(key_string).hexdigest()
         return 'lazythumbs:{0}'.format(hashed)
 
-    def two_hundred(self, img_data, img_format):
+    def cache_404(self, source_path, cache_key):
+        """
+        Remember a failed render: for every rendition of the source if the
+        source is missing, otherwise for this rendition only.
+        """
+        timeout = settings.LAZYTHUMBS_404_CACHE_TIMEOUT
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, source_path)):
+            cache.set(cache_key, 1, timeout)
+        else:
+            cache.set(get_missing_key(source_path), 1, timeout)
+            missing_sources.add(source_path, timeout)
+
+    def two_hundred(self, img_data, img_format, response_class=HttpResponse):
         """
         Generate a 200 image response with raw image data, Cache-Control set,
         and an image/{img_format} content-type.
 
-        :param img_data: raw image data as a string
+        :param img_data: raw image data as a string, or an iterator of chunks
+            when response_class is StreamingHttpResponse
+        """
+        resp = response_class(img_data, content_type='image/%s' % img_format.lower())
+        resp['Cache-Control'] = self.cache_control()
+        return resp
+
+    def three_oh_four(self, etag, mtime):
+        """
+        Generate a 304 response for a conditional request whose copy of the
+        rendered image is still current.
+        """
+        resp = HttpResponse(status=304)
+        resp['Cache-Control'] = self.cache_control()
+        return self.set_validators(resp, etag, mtime)
+
+    def cache_control(self):
+        """
+        Cache-Control value for successful responses, including the optional
+        stale-while-revalidate and stale-if-error extensions.
+        """
+        directives = ['public', 'max-age=%s' % settings.LAZYTHUMBS_CACHE_TIMEOUT]
+        if STALE_WHILE_REVALIDATE is not None:
+            directives.append('stale-while-revalidate=%s' % STALE_WHILE_REVALIDATE)
+        if STALE_IF_ERROR is not None:
+            directives.append('stale-if-error=%s' % STALE_IF_ERROR)
+        return ','.join(directives)
+
+    def render_pending(self, source_path):
+        """
+        Generate the response sent while a rendition is being rendered in the
+        background, according to LAZYTHUMBS_ASYNC_RENDER_FALLBACK:
+
+        * 'redirect': a 302 to the original image
+        * 'placeholder': a 1x1 transparent GIF
+        * 'accepted': an empty 202
+
+        All of them carry a Retry-After and are only cacheable for that long.
+        """
+        return self.fallback(source_path, ASYNC_RENDER_FALLBACK, ASYNC_RETRY_AFTER)
+
+    def render_rejected(self, source_path):
+        """
+        Generate the response sent instead of a render admission control
+        turned down, according to LAZYTHUMBS_RENDER_REJECT_FALLBACK:
+
+        * 'unavailable': an empty 503
+        * 'redirect': a 302 to the original image
+        * 'placeholder': a 1x1 transparent GIF
+
+        All of them carry a Retry-After and are only cacheable for that long.
+        """
+        return self.fallback(source_path, RENDER_REJECT_FALLBACK, RENDER_REJECT_RETRY_AFTER)
+
+    def render_late(self, action, width, height, source_path, rendered_path, img_format):
+        """
+        Generate the response sent when a render misses its deadline,
+        according to LAZYTHUMBS_RENDER_DEADLINE_FALLBACK:
+
+        * 'variant': the nearest existing rendition of the source in
+          img_format, the format the client gets, as it is (see
+          lazythumbs.renditions.find_variant), or a redirect if there is none
+        * 'redirect', 'placeholder', 'unavailable' or 'accepted', see fallback
+
+        All of them carry a Retry-After and are only cacheable for that long.
+        """
+        kind = RENDER_DEADLINE_FALLBACK
+        if kind == 'variant':
+            resp = self.serve_variant(action, width, height, source_path, rendered_path, img_format)
+            if resp is not None:
+                resp['Retry-After'] = str(RENDER_DEADLINE_RETRY_AFTER)
+                resp['Cache-Control'] = 'public,max-age=%s' % RENDER_DEADLINE_RETRY_AFTER
+                return resp
+            kind = 'redirect'
+        return self.fallback(source_path, kind, RENDER_DEADLINE_RETRY_AFTER)
+
+    def serve_variant(self, action, width, height, source_path, rendered_path, img_format):
+        """
+        Serve the indexed rendition of source_path in img_format that best
+        stands in for action at width x height. Renditions in other formats
+        are left out: the client may not accept them, and the response's
+        Vary: Accept doesn't tell caches they differ.
+
+        :returns: an HttpResponse, or None if there is no such rendition
+        """
+        try:
+            source_mtime = os.stat(os.path.join(settings.MEDIA_ROOT, source_path)).st_mtime
+        except OSError:
+            return None
+        entries = [
+            e for e in rendition_index.entries(source_path, source_mtime)
+            if e['path'] != rendered_path and e['format'] == img_format
+        ]
+        while entries:
+            variant = find_variant(entries, action, width, height)
+            resp = self.serve_rendered(variant['path'], variant['format'])
+            if resp is not None:
+                return resp
+            entries.remove(variant)
+        return None
+
+    def fallback(self, source_path, kind, retry_after):
+        """
+        A response standing in for a rendition that isn't there yet.
+
+        :param kind: 'redirect', 'placeholder', 'unavailable' (503) or
+            'accepted' (202)
         """
-        resp = HttpResponse(img_data, content_type='image/%s' % img_format.lower())
-        resp['Cache-Control'] = 'public,max-age=%s' % settings.LAZYTHUMBS_CACHE_TIMEOUT
+        if kind == 'redirect':
+            resp = HttpResponseRedirect(urljoin(settings.MEDIA_URL, source_path))
+        elif kind == 'placeholder':
+            resp = HttpResponse(PLACEHOLDER_GIF, content_type='image/gif')
+        elif kind == 'unavailable':
+            resp = HttpResponse(status=503, content_type='image/jpeg')
+        else:
+            resp = HttpResponse(status=202, content_type='image/jpeg')
+        resp['Retry-After'] = str(retry_after)
+        resp['Cache-Control'] = 'public,max-age=%s' % retry_after
         return resp
 
     def four_oh_four(self):
@@ -11,7 +11,7 @@ setup(
     url='https://github.com/coxmediagroup/lazythumbs',
     packages=find_packages(exclude=['tests', 'tests.*']),
     platforms='any',
-    install_requires=["Pillow"],
+    install_requires=["Pillow>=4.3"],
     zip_safe=False,
     classifiers=[
         'Environment :: Web Environment',
@@ -19,6 +19,7 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 2.7',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
         'Topic :: Multimedia :: Graphics',
         'Framework :: Django',